@@ -1,13 +1,23 @@
-from flask import Flask, request, render_template, jsonify
-from rq import Queue
+from flask import Flask, Response, request, render_template, jsonify, stream_with_context
+from rq.exceptions import NoSuchJobError
 from redis import Redis
-from tasks import find_books_via_google_search, extract_keywords_from_text, background_book_analysis_task
-import requests
 import json
+import uuid
+import google_books
+import job_progress
+import queues
+import recommendation_pages
+import user_profiles
+from tasks import find_books_via_google_search, fetch_book_details_task, background_book_analysis_task
+from tasks import recommendation_engine_warm, compute_recommendation_results, recommendations_task
+from tasks import LLM_RESULT_FIELDS, add_books_to_profile_task
 
 app = Flask(__name__)
 redis_conn = Redis()
-q = Queue(connection=redis_conn)
+search_q = queues.get_queue(queues.SEARCH_QUEUE, redis_conn)
+interactive_q = queues.get_queue(queues.INTERACTIVE_QUEUE, redis_conn)
+
+SSE_KEEPALIVE_MS = 15000
 
 @app.route('/', methods=['GET', 'POST'])
 def index():
@@ -15,58 +25,82 @@ def index():
     if request.method == 'POST':
         book_list_text = request.form['book_list'] # uses the text area 'name' attribute
         user_book_titles = book_list_text.split("\n")
-        job = q.enqueue(find_books_via_google_search, user_book_titles)
+        job = search_q.enqueue(find_books_via_google_search, user_book_titles)
         return render_template('index.html', job_id=job.id, book_list_text=book_list_text)
     return render_template('index.html', book_list_text=book_list_text)
 
 @app.route('/results/<job_id>')
 def get_results(job_id):
-    job = q.fetch_job(job_id)
+    job = queues.fetch_job(job_id, redis_conn)
+    if job is None:
+        return jsonify(error="Unknown or expired job"), 404
 
     if job.is_finished:
         return jsonify(status="finished", result=job.result)
     elif job.is_failed:
         return jsonify(status="failed", error=str(job.exc_info))
     else:
-        return jsonify(status="pending")
+        # Jobs that publish progress (e.g. fetch_book_details_task) expose partial results while pending
+        return jsonify(status="pending",
+                       partial_result=job.meta.get('partial_results'),
+                       completed=job.meta.get('completed'),
+                       total=job.meta.get('total'))
     
+@app.route('/results/<job_id>/stream')
+def stream_results(job_id):
+    """
+    Server-Sent Events feed of a job's progress stream: one 'book' event per analysed
+    book as it completes, then 'done' (full result) or 'failed'. Reconnecting clients
+    resume from the Last-Event-ID header.
+    """
+    job = queues.fetch_job(job_id, redis_conn)
+    if job is None:
+        return jsonify(error="Unknown job"), 404
+    last_event_id = request.headers.get('Last-Event-ID', '0')
+
+    def event_stream():
+        last_id = last_event_id
+        while True:
+            events = job_progress.read_events(redis_conn, job_id, last_id, block_ms=SSE_KEEPALIVE_MS)
+            for entry_id, event, data in events:
+                last_id = entry_id
+                yield f"id: {entry_id}\nevent: {event}\ndata: {data}\n\n"
+                if event in ('done', 'failed'):
+                    return
+            if events:
+                continue
+
+            # Nothing new: the job may have ended without publishing (e.g. killed worker)
+            try:
+                job.refresh()
+            except NoSuchJobError:
+                yield f"event: failed\ndata: {json.dumps({'error': 'Job expired'})}\n\n"
+                return
+            if job.is_failed:
+                yield f"event: failed\ndata: {json.dumps({'error': str(job.exc_info)})}\n\n"
+                return
+            if job.is_finished:
+                yield f"event: done\ndata: {json.dumps(job.result)}\n\n"
+                return
+            yield ": keep-alive\n\n"
+
+    return Response(stream_with_context(event_stream()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/fetch_book_data', methods=['POST'])
 def fetch_book_data():
     data = request.get_json()
-    isbn_list = data.get("isbnList",[])
-    book_data = {}
-
-    for isbn in isbn_list:
-        api_url = f"https://www.googleapis.com/books/v1/volumes?q=isbn:{isbn}&langRestrict=en"
-        try:
-            response = requests.get(api_url)
-            response.raise_for_status()
-            api_data = response.json()
-            if 'items' in api_data and api_data['items']:
-                book_info = api_data['items'][0]['volumeInfo']
-                description = book_info.get('description')
-                keywords = []
-                if description:
-                    keywords = extract_keywords_from_text(description)
-
-                book_data[isbn] = {
-                    'isbn': isbn,
-                    'title': book_info.get('title'),
-                    'authors': book_info.get('authors', []),
-                    'description': description,
-                    'categories': book_info.get('categories', []),
-                    'imageLinks': book_info.get('imageLinks', {}).get('thumbnail'),
-                    'averageRating': book_info.get('averageRating'),
-                    'ratingsCount': book_info.get('ratingsCount'),
-                    'pageCount': book_info.get('pageCount'),
-                    'keywords': keywords
-                }
-            else:
-                book_data[isbn] = {'not_found': True}
-        except requests.exceptions.RequestException as e:
-            book_data[isbn] = {'error': str(e)}
-
-    return jsonify(book_data)
+    isbn_list = data.get("isbnList",[]) if data else []
+    if not isbn_list:
+        return jsonify(error="No ISBNs received"), 400
+
+    try:
+        job = search_q.enqueue(fetch_book_details_task, isbn_list)
+        print(f"Enqueued book details job: {job.id}")
+        return jsonify(job_id=job.id)
+    except Exception as e:
+        print(f"Error enqueuing book details task: {e}")
+        return jsonify(error="Server error: failed to start book details task."), 500
 
 @app.route('/enqueue_llm_analysis', methods=['POST'])
 def enqueue_llm_analysis():
@@ -83,14 +117,115 @@ def enqueue_llm_analysis():
         return jsonify(error="No valid books found in the provided data to analyse."), 400
     
     try:
-        job_llm = q.enqueue(background_book_analysis_task, book_list_for_llm)
+        job_llm = interactive_q.enqueue(background_book_analysis_task, book_list_for_llm)
 
         print(f"Enqueued LLM analysis job: {job_llm.id}")
 
         return jsonify(job_id=job_llm.id)
     except Exception as e:
         print(f"Error enqueuing LLM analysis task: {e}")
-        return jsonify(error=f"Server error: failed to start analysis task."), 500
+        return jsonify(error="Server error: failed to start analysis task."), 500
+
+@app.route('/recommendations', methods=['POST'])
+def request_recommendations():
+    """
+    Scores recommendations for a stored profile ({"profile_id": ...}), a finished
+    analysis job ({"analysis_job_id": ...}) or an analysed_books_map. Runs inline when the precomputed feature store is warm and
+    returns the first page; otherwise enqueues recommendations_task and returns 202 with
+    the result_id to poll. Later pages come from GET /recommendations/<result_id>.
+    """
+    data = request.get_json() or {}
+    analysed_books = data.get('analysed_books_map')
+    profile_id = data.get('profile_id')
+    if not analysed_books and not profile_id and data.get('analysis_job_id'):
+        analysis_job = queues.fetch_job(data['analysis_job_id'], redis_conn)
+        if analysis_job is None:
+            return jsonify(error="Unknown analysis job"), 404
+        if not analysis_job.is_finished:
+            return jsonify(error="Analysis job has not finished"), 409
+        result = analysis_job.result or {}
+        profile_id = result.get('profile_id')
+        analysed_books = result.get('analysed_books_map')
+    if profile_id and not user_profiles.profile_exists(redis_conn, profile_id):
+        profile_id = None
+    if not analysed_books and not profile_id:
+        return jsonify(error="No analysed books or profile received"), 400
+    limit = request.args.get('limit', recommendation_pages.DEFAULT_PAGE_SIZE, type=int)
+
+    try:
+        if recommendation_engine_warm():
+            result_id = uuid.uuid4().hex
+            compute_recommendation_results(analysed_books, result_id, redis_conn, profile_id=profile_id)
+            return jsonify(status="finished", **recommendation_pages.read_page(redis_conn, result_id, None, limit))
+        job = interactive_q.enqueue(recommendations_task, analysed_books, profile_id=profile_id)
+        print(f"Enqueued recommendations job: {job.id}")
+        return jsonify(status="pending", result_id=job.id), 202
+    except Exception as e:
+        print(f"Error generating recommendations: {e}")
+        return jsonify(error="Server error: failed to generate recommendations."), 500
+
+@app.route('/recommendations/<result_id>')
+def get_recommendations_page(result_id):
+    """A page of stored recommendations; pass the previous page's next_cursor as ?cursor= to continue."""
+    limit = request.args.get('limit', recommendation_pages.DEFAULT_PAGE_SIZE, type=int)
+    page = recommendation_pages.read_page(redis_conn, result_id, request.args.get('cursor'), limit)
+    if page is not None:
+        return jsonify(status="finished", **page)
+
+    job = queues.fetch_job(result_id, redis_conn)
+    if job is None:
+        return jsonify(error="Unknown or expired recommendations"), 404
+    if job.is_failed:
+        return jsonify(status="failed", error=str(job.exc_info))
+    return jsonify(status="pending")
+
+@app.route('/profiles/<profile_id>')
+def get_profile(profile_id):
+    user_profile = user_profiles.get_profile(redis_conn, profile_id)
+    if not user_profile:
+        return jsonify(error="Unknown profile"), 404
+    return jsonify(profile_id=profile_id, user_profile_details=user_profile)
+
+@app.route('/profiles/<profile_id>/books', methods=['POST'])
+def add_profile_books(profile_id):
+    """
+    Adds books to an incremental profile, as an {isbn: book_details} map. Books that
+    already carry their LLM analysis are added immediately; the rest are analysed by
+    add_books_to_profile_task and the response is its job_id.
+    """
+    books = request.get_json()
+    if not books or not isinstance(books, dict):
+        return jsonify(error="No books received"), 400
+    if not user_profiles.profile_exists(redis_conn, profile_id):
+        return jsonify(error="Unknown profile"), 404
+
+    analysed = {isbn: book for isbn, book in books.items()
+                if isinstance(book, dict) and any(book.get(field) for field in LLM_RESULT_FIELDS)}
+    to_analyse = [dict(book, isbn=book.get('isbn') or isbn) for isbn, book in books.items()
+                  if isinstance(book, dict) and isbn not in analysed]
+    user_profiles.add_books(redis_conn, profile_id, analysed)
+    response = {'profile_id': profile_id, 'added': list(analysed)}
+    if to_analyse:
+        job = interactive_q.enqueue(add_books_to_profile_task, profile_id, to_analyse)
+        response['job_id'] = job.id
+    response['user_profile_details'] = user_profiles.get_profile(redis_conn, profile_id)
+    return jsonify(response)
+
+@app.route('/profiles/<profile_id>/books/<isbn>', methods=['DELETE'])
+def remove_profile_book(profile_id, isbn):
+    if not user_profiles.remove_book(redis_conn, profile_id, isbn):
+        return jsonify(error="Book not in profile"), 404
+    return jsonify(profile_id=profile_id, removed=isbn,
+                   user_profile_details=user_profiles.get_profile(redis_conn, profile_id))
+
+@app.route('/stats/queues')
+def queue_stats():
+    """Depth, running/failed counts, wait times and worker counts for each priority queue."""
+    return jsonify(queues.get_queue_metrics(redis_conn))
+
+@app.route('/stats/google_books_cache')
+def google_books_cache_stats():
+    return jsonify(google_books.get_cache_stats(redis_conn))
 
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
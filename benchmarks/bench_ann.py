@@ -0,0 +1,84 @@
+"""
+Recall vs latency of the IVF embedding index against brute-force search.
+
+By default the catalogue is synthetic: clustered unit vectors, so the numbers don't
+depend on Ollama or an enriched database. --from-db uses the stored book embeddings
+instead, querying with lightly perturbed copies of random books.
+
+Run from the project root:
+    python -m benchmarks.bench_ann --books 100000 --dim 768 --queries 200
+    python -m benchmarks.bench_ann --from-db --lists 256
+"""
+import argparse
+import time
+
+import numpy as np
+
+import embedding_index
+
+
+def _normalise(vectors):
+    return (vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)).astype(np.float32)
+
+
+def make_catalogue(count, dim, topics=500, seed=42):
+    """Books scattered around `topics` random topic directions, like genre/theme clusters."""
+    rng = np.random.default_rng(seed)
+    centres = _normalise(rng.standard_normal((topics, dim)))
+    vectors = centres[rng.integers(0, topics, count)] + 0.6 * rng.standard_normal((count, dim)) / np.sqrt(dim)
+    return np.asarray([f"{9780000000000 + i}" for i in range(count)], dtype=str), _normalise(vectors)
+
+
+def make_queries(vectors, count, seed=7):
+    rng = np.random.default_rng(seed)
+    picks = vectors[rng.integers(0, len(vectors), count)]
+    return _normalise(picks + 0.3 * rng.standard_normal(picks.shape) / np.sqrt(vectors.shape[1]))
+
+
+def time_searches(search, queries):
+    latencies = []
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(search(query))
+        latencies.append(time.perf_counter() - start)
+    return np.asarray(latencies) * 1000, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--books', type=int, default=100000)
+    parser.add_argument('--dim', type=int, default=768)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--top-n', type=int, default=10)
+    parser.add_argument('--lists', type=int, default=None)
+    parser.add_argument('--from-db', action='store_true')
+    args = parser.parse_args()
+
+    if args.from_db:
+        isbns, vectors = embedding_index.load_embeddings()
+    else:
+        isbns, vectors = make_catalogue(args.books, args.dim)
+    queries = make_queries(vectors, args.queries)
+
+    start = time.perf_counter()
+    index = embedding_index.IVFIndex.build(isbns, vectors, args.lists)
+    print(f"{len(vectors)} vectors x {vectors.shape[1]} dims, {len(index.centroids)} lists, "
+          f"built in {time.perf_counter() - start:.1f}s\n")
+
+    exact_ms, exact_results = time_searches(lambda q: index.brute_force(q, args.top_n), queries)
+    exact_sets = [{isbn for isbn, _ in result} for result in exact_results]
+    print(f"{'mode':<14} {'recall@' + str(args.top_n):>10} {'mean ms':>9} {'p95 ms':>9}")
+    print(f"{'brute force':<14} {1.0:>10.3f} {exact_ms.mean():>9.2f} {np.percentile(exact_ms, 95):>9.2f}")
+
+    n_probe = 1
+    while n_probe <= len(index.centroids):
+        ivf_ms, ivf_results = time_searches(lambda q: index.search(q, args.top_n, n_probe=n_probe), queries)
+        recall = np.mean([len(exact & {isbn for isbn, _ in result}) / max(len(exact), 1)
+                          for exact, result in zip(exact_sets, ivf_results)])
+        print(f"{'n_probe=' + str(n_probe):<14} {recall:>10.3f} {ivf_ms.mean():>9.2f} {np.percentile(ivf_ms, 95):>9.2f}")
+        n_probe *= 2
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Benchmarks sequential vs concurrent Google Books title search against a local stub server.
+
+Run from the project root:
+    python -m benchmarks.bench_google_search --latency 0.2 --sizes 5 10 20 40
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import google_books
+
+STUB_RESPONSE = json.dumps({
+    "totalItems": 1,
+    "items": [{
+        "volumeInfo": {
+            "title": "Stub Title",
+            "authors": ["Stub Author"],
+            "industryIdentifiers": [{"type": "ISBN_13", "identifier": "9780000000002"}]
+        }
+    }]
+}).encode()
+
+
+def make_stub_handler(latency):
+    class StubGoogleBooksHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1' # keep-alive, like the real API
+
+        def do_GET(self):
+            time.sleep(latency)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(STUB_RESPONSE)))
+            self.end_headers()
+            self.wfile.write(STUB_RESPONSE)
+
+        def log_message(self, format, *args):
+            pass
+    return StubGoogleBooksHandler
+
+
+def time_search(titles, max_workers):
+    start = time.perf_counter()
+    results = google_books.search_titles(titles, max_workers=max_workers)
+    elapsed = time.perf_counter() - start
+    assert len(results) == len(titles)
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--latency', type=float, default=0.2, help="Simulated per-request latency in seconds")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[5, 10, 20, 40])
+    parser.add_argument('--workers', type=int, default=google_books.SEARCH_MAX_WORKERS)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_stub_handler(args.latency))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    google_books.GOOGLE_BOOKS_API_URL = f"http://127.0.0.1:{server.server_address[1]}/books/v1/volumes"
+
+    print(f"Stub latency {args.latency:.3f}s, concurrent workers {args.workers}, per-host limit {google_books.PER_HOST_CONCURRENCY}")
+    print(f"{'titles':>8} {'sequential (s)':>16} {'concurrent (s)':>16} {'speed-up':>10}")
+    try:
+        for size in args.sizes:
+            titles = [f"Benchmark Title {i}" for i in range(size)]
+            sequential = time_search(titles, max_workers=1)
+            concurrent = time_search(titles, max_workers=args.workers)
+            print(f"{size:>8} {sequential:>16.3f} {concurrent:>16.3f} {sequential / concurrent:>9.1f}x")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
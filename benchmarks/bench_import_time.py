@@ -0,0 +1,42 @@
+"""
+Measures process start-up cost: how long a fresh interpreter takes to import each
+entry-point module, compared with importing `tasks` and then loading every model
+(what every import paid before models were loaded lazily).
+
+Run from the project root:
+    python -m benchmarks.bench_import_time --repeat 5
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+SCENARIOS = [
+    ("import tasks (lazy models)", "import tasks"),
+    ("import enrich_db", "import enrich_db"),
+    ("import app", "import app"),
+    ("import tasks + warm_up_models() (old eager cost)", "import tasks; tasks.warm_up_models()"),
+]
+
+
+def time_subprocess(code):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", code], check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    baseline = statistics.median(time_subprocess("pass") for _ in range(args.repeat))
+    print(f"Bare interpreter start-up: {baseline:.3f}s (subtracted below)")
+    for label, code in SCENARIOS:
+        timings = [time_subprocess(code) for _ in range(args.repeat)]
+        print(f"{label:<50} median {statistics.median(timings) - baseline:7.3f}s  min {min(timings) - baseline:7.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Benchmarks spaCy keyword extraction: the old per-description call on the full
+en_core_web_sm pipeline vs the batched nlp.pipe path with parser/NER excluded.
+
+Run from the project root:
+    python -m benchmarks.bench_keywords --docs 3000 --batch-size 64 --n-process 1
+"""
+import argparse
+import random
+import time
+
+import spacy
+
+import tasks
+
+SEED_DESCRIPTION = (
+    "A gripping, heart-wrenching, and wholly remarkable tale of coming-of-age in a South poisoned by "
+    "virulent prejudice, it views a world of great beauty and savage inequities through the eyes of a "
+    "young girl, as her father, a crusading local lawyer, risks everything to defend a black man unjustly "
+    "accused of a terrible crime. A haunting story of memory, loss and family secrets set against a "
+    "windswept coastal village where an ambitious detective uncovers a dark conspiracy."
+)
+
+
+def make_descriptions(count, seed=42):
+    """Builds `count` synthetic descriptions by shuffling the words of a real one."""
+    rng = random.Random(seed)
+    words = SEED_DESCRIPTION.split()
+    descriptions = []
+    for _ in range(count):
+        length = rng.randint(60, 160)
+        descriptions.append(" ".join(rng.choice(words) for _ in range(length)))
+    return descriptions
+
+
+def run_old_path(descriptions):
+    tasks.get_nlp() # loads the stop-word set shared by both paths, outside the timed section
+    full_nlp = spacy.load("en_core_web_sm")
+    start = time.perf_counter()
+    results = [tasks._keywords_from_doc(full_nlp(text.lower())) for text in descriptions]
+    return time.perf_counter() - start, results
+
+
+def run_batched_path(descriptions, batch_size, n_process):
+    start = time.perf_counter()
+    results = tasks.extract_keywords_batch(descriptions, batch_size=batch_size, n_process=n_process)
+    return time.perf_counter() - start, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--docs', type=int, default=3000)
+    parser.add_argument('--batch-size', type=int, default=tasks.KEYWORD_BATCH_SIZE)
+    parser.add_argument('--n-process', type=int, default=1)
+    args = parser.parse_args()
+
+    descriptions = make_descriptions(args.docs)
+    old_elapsed, old_results = run_old_path(descriptions)
+    new_elapsed, new_results = run_batched_path(descriptions, args.batch_size, args.n_process)
+    matching = sum(1 for old, new in zip(old_results, new_results) if old == new)
+
+    print(f"Descriptions: {args.docs}")
+    print(f"Old path (full pipeline, one nlp() per doc): {old_elapsed:8.2f}s  {args.docs / old_elapsed:8.1f} docs/sec")
+    print(f"Batched nlp.pipe (batch_size={args.batch_size}, n_process={args.n_process}): "
+          f"{new_elapsed:8.2f}s  {args.docs / new_elapsed:8.1f} docs/sec")
+    print(f"Speed-up: {old_elapsed / new_elapsed:.2f}x, identical keyword lists: {matching}/{args.docs}")
+
+
+if __name__ == "__main__":
+    main()
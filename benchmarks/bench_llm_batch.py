@@ -0,0 +1,117 @@
+"""
+Books/sec of single-book vs batched LLM analysis prompts against a local mock Ollama server.
+
+The mock charges a fixed cost per request (prefilling the shared instruction block)
+plus a cost per book answered (generating its JSON), so batching amortises the first.
+--drop-rate makes the mock leave out some batched entries, to include the cost of the
+single-book fallback. Ollama is called directly, without the Redis cache.
+
+Run from the project root:
+    python -m benchmarks.bench_llm_batch --books 64 --request-latency 0.5 --per-book-latency 0.2
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import ollama_client
+import tasks
+
+MOCK_ANALYSIS = {
+    "genre": ["fiction"],
+    "setting_period": "contemporary",
+    "setting_location": "London, England",
+    "tone": ["suspenseful"],
+    "target_audience": "adult",
+    "themes": ["family", "memory"],
+    "sentiment": "Enjoyable and thought-provoking.",
+}
+BATCH_ISBN_PATTERN = re.compile(r"^- ISBN (\S+):", re.MULTILINE)
+
+
+def make_mock_handler(request_latency, per_book_latency, drop_rate, seed=42):
+    rng = random.Random(seed)
+
+    class MockOllamaHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            isbns = BATCH_ISBN_PATTERN.findall(payload['prompt'])
+            if isbns:
+                analysis = {isbn: MOCK_ANALYSIS for isbn in isbns if rng.random() >= drop_rate}
+            else:
+                analysis = MOCK_ANALYSIS
+            time.sleep(request_latency + per_book_latency * max(len(isbns), 1))
+            output = json.dumps(analysis)
+            if payload.get('stream'):
+                # NDJSON chunks, as Ollama streams them
+                chunks = [{"response": output[i:i + 16], "done": False} for i in range(0, len(output), 16)]
+                body = "".join(json.dumps(chunk) + "\n" for chunk in chunks + [{"response": "", "done": True}]).encode()
+            else:
+                body = json.dumps({"response": output}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+    return MockOllamaHandler
+
+
+def analyse_batch(batch):
+    """Batched call plus single-book fallback, as get_llm_analyses_batched does, minus the cache."""
+    if len(batch) == 1:
+        return [tasks._call_ollama_for_analysis(*batch[0])]
+    results = tasks._call_ollama_for_batch(batch)
+    return [results.get(isbn) or tasks._call_ollama_for_analysis(isbn, title, author)
+            for isbn, title, author in batch]
+
+
+def time_batches(books, batch_size, workers):
+    batches = [books[i:i + batch_size] for i in range(0, len(books), batch_size)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = [llm_results for batch_results in executor.map(analyse_batch, batches) for llm_results in batch_results]
+    elapsed = time.perf_counter() - start
+    assert len(results) == len(books) and all(results)
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--books', type=int, default=64)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--workers', type=int, default=tasks.LLM_ANALYSIS_MAX_WORKERS)
+    parser.add_argument('--request-latency', type=float, default=0.5, help="Simulated per-request prefill cost in seconds")
+    parser.add_argument('--per-book-latency', type=float, default=0.2, help="Simulated generation cost per book in seconds")
+    parser.add_argument('--drop-rate', type=float, default=0.0, help="Fraction of batched entries the mock leaves out")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0),
+                                 make_mock_handler(args.request_latency, args.per_book_latency, args.drop_rate))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    ollama_client.OLLAMA_URL = f"http://127.0.0.1:{server.server_address[1]}/api/generate"
+
+    books = [(f"978000000{i:04d}", f"Benchmark Title {i}", f"Author {i}") for i in range(args.books)]
+    print(f"{args.books} books, {args.workers} workers, request latency {args.request_latency:.3f}s, "
+          f"per-book latency {args.per_book_latency:.3f}s, drop rate {args.drop_rate:.0%}")
+    print(f"{'batch size':>10} {'prompt chars':>13} {'elapsed (s)':>12} {'books/sec':>10}")
+    try:
+        for batch_size in args.batch_sizes:
+            batch = books[:batch_size]
+            prompt = tasks.build_llm_batch_prompt(batch) if batch_size > 1 else tasks.build_llm_prompt(*batch[0][1:])
+            elapsed = time_batches(books, batch_size, args.workers)
+            print(f"{batch_size:>10} {len(prompt):>13} {elapsed:>12.2f} {args.books / elapsed:>10.1f}")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
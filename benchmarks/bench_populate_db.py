@@ -0,0 +1,144 @@
+"""
+Rows/sec of the populate_db ingestion path on a synthetic Book-Crossing style CSV.
+
+Writes a CSV of --rows rows (a mix of ISBN-10s, ISBN-13s, hyphenated and junk ISBNs,
+with repeats), then times load_and_clean_data and insert_data_to_db against a
+throwaway database. --legacy-sample also times the old one-INSERT-per-row loop on
+the first N cleaned rows, for comparison. --stream times the chunked streaming path
+instead; peak RSS is reported for both, so the two modes' memory use can be compared.
+
+Run from the project root:
+    python -m benchmarks.bench_populate_db --rows 1000000 --legacy-sample 50000
+    python -m benchmarks.bench_populate_db --rows 1000000 --stream --chunk-size 100000
+"""
+import argparse
+import csv
+import os
+import random
+import resource
+import sqlite3
+import tempfile
+import time
+
+import populate_db
+
+
+def _isbn10(rng):
+    digits = [rng.randint(0, 9) for _ in range(9)]
+    check = (11 - sum((10 - i) * d for i, d in enumerate(digits)) % 11) % 11
+    return "".join(map(str, digits)) + ("X" if check == 10 else str(check))
+
+
+def _isbn13(rng):
+    digits = [9, 7, 8] + [rng.randint(0, 9) for _ in range(9)]
+    check = (10 - sum(d * (3 if i % 2 else 1) for i, d in enumerate(digits)) % 10) % 10
+    return "".join(map(str, digits)) + str(check)
+
+
+def _random_isbn(rng):
+    roll = rng.random()
+    if roll < 0.6:
+        return _isbn10(rng)
+    if roll < 0.85:
+        return _isbn13(rng)
+    if roll < 0.95:
+        isbn = _isbn13(rng)
+        return f"{isbn[:3]}-{isbn[3]}-{isbn[4:8]}-{isbn[8:12]}-{isbn[12]}"
+    return rng.choice(["", "N/A", "12345", "0-00-ABC"])
+
+
+def write_synthetic_csv(path, rows, seed=42):
+    rng = random.Random(seed)
+    words = ["the", "house", "of", "night", "silent", "river", "a", "war", "garden", "stars", "lost", "city"]
+    recent_isbns = []
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['ISBN', 'Book-Title', 'Book-Author', 'Year-Of-Publication', 'Publisher'])
+        for _ in range(rows):
+            # ~10% repeats, like multiple editions/listings of the same book
+            isbn = rng.choice(recent_isbns) if recent_isbns and rng.random() < 0.1 else _random_isbn(rng)
+            recent_isbns = (recent_isbns + [isbn])[-1000:]
+            title = " ".join(rng.choice(words) for _ in range(rng.randint(1, 6)))
+            if rng.random() < 0.05:
+                title = f'"{title}"'
+            writer.writerow([isbn, title, f"Author {rng.randint(1, 50000)}",
+                             str(rng.randint(1900, 2024)), f"Publisher {rng.randint(1, 2000)}"])
+
+
+def legacy_insert(df, db_path):
+    """The previous per-row INSERT OR IGNORE loop, committing every 1000 rows."""
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    for count, row in enumerate(df.itertuples(index=False), start=1):
+        isbn10 = getattr(row, 'db_isbn10')
+        cursor.execute("""
+            INSERT OR IGNORE INTO books (isbn13, isbn10, title, authors, publication_date, publisher)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (row.db_isbn13, None if isbn10 is populate_db.pd.NA else isbn10, row[1], row.authors_json, row[3], row[4]))
+        if count % 1000 == 0:
+            conn.commit()
+    conn.commit()
+    conn.close()
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far (ru_maxrss is KB on Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--legacy-sample', type=int, default=0,
+                        help="also time the old per-row insert on this many rows")
+    parser.add_argument('--stream', action='store_true', help="time stream_csv_to_db instead of the in-memory path")
+    parser.add_argument('--chunk-size', type=int, default=populate_db.STREAM_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_path = os.path.join(tmp_dir, 'books.csv')
+        start = time.perf_counter()
+        write_synthetic_csv(csv_path, args.rows)
+        print(f"Wrote {args.rows} synthetic rows in {time.perf_counter() - start:.1f}s\n")
+
+        populate_db.CSV_FILE_PATH = csv_path
+        populate_db.DB_FILE_PATH = os.path.join(tmp_dir, 'books.db')
+        populate_db.setup_database()
+        rss_before = peak_rss_mb()
+
+        if args.stream:
+            start = time.perf_counter()
+            totals = populate_db.stream_csv_to_db(args.chunk_size)
+            elapsed = time.perf_counter() - start
+            print("\n--- populate_db (streaming) ---")
+            print(f"read + clean + insert: {elapsed:.2f}s ({totals['read'] / elapsed:.0f} rows/sec)")
+            print(f"peak RSS: {peak_rss_mb():.0f} MB (was {rss_before:.0f} MB before loading)")
+            return
+
+        start = time.perf_counter()
+        df = populate_db.load_and_clean_data()
+        clean_elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        populate_db.insert_data_to_db(df)
+        insert_elapsed = time.perf_counter() - start
+
+        print("\n--- populate_db ---")
+        print(f"load + clean: {clean_elapsed:.2f}s ({args.rows / clean_elapsed:.0f} rows/sec)")
+        print(f"insert:       {insert_elapsed:.2f}s ({len(df) / insert_elapsed:.0f} rows/sec)")
+        print(f"peak RSS: {peak_rss_mb():.0f} MB (was {rss_before:.0f} MB before loading)")
+
+        if args.legacy_sample:
+            sample = df.head(args.legacy_sample)
+            legacy_db = os.path.join(tmp_dir, 'legacy.db')
+            populate_db.DB_FILE_PATH = legacy_db
+            populate_db.setup_database()
+            start = time.perf_counter()
+            legacy_insert(sample, legacy_db)
+            legacy_elapsed = time.perf_counter() - start
+            print(f"legacy per-row insert ({len(sample)} rows): {legacy_elapsed:.2f}s "
+                  f"({len(sample) / legacy_elapsed:.0f} rows/sec)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Redis cache administration for Bookup.
+
+Usage:
+    python cache_admin.py stats                    # LLM cache size/hit rate + Google Books/recommendation cache counters
+    python cache_admin.py purge [--dry-run]        # delete LLM cache entries from old models/prompts/formats
+    python cache_admin.py set-policy [--maxmemory 2gb]  # evict LRU keys with a TTL (see the warning it prints)
+"""
+import argparse
+import json
+
+from redis import Redis
+
+import google_books
+import llm_cache
+import recommendation_cache
+import tasks
+
+
+def _format_bytes(num_bytes):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if num_bytes < 1024 or unit == 'GB':
+            return f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+
+
+def show_stats(redis_conn):
+    namespace = tasks.current_llm_cache_namespace()
+    stats = llm_cache.get_llm_cache_stats(redis_conn, namespace)
+    hit_rate = f"{stats['hit_rate']:.1%}" if stats['hit_rate'] is not None else "n/a"
+
+    print("--- LLM cache ---")
+    print(f"Model: {tasks.OLLAMA_MODEL}, namespace: {namespace}")
+    print(f"Current entries: {stats['current_entries']} ({_format_bytes(stats['current_bytes'])})")
+    print(f"Stale entries:   {stats['stale_entries']} ({_format_bytes(stats['stale_bytes'])})")
+    for stale_namespace, count in sorted(stats['stale_namespaces'].items()):
+        print(f"   - {stale_namespace}: {count}")
+    print(f"Hits: {stats.get('hits', 0)}, misses: {stats.get('misses', 0)}, hit rate: {hit_rate}")
+    print(f"Ollama calls: {stats.get('ollama_calls', 0)}, "
+          f"calls saved by coalescing concurrent misses: {stats.get('coalesced', 0)}")
+    print(f"Books analysed through batched prompts: {stats.get('batched_books', 0)}")
+    print(f"TTL for new entries: {llm_cache.CACHE_TTL_SECONDS or 'none'}s")
+
+    print("\n--- Google Books cache ---")
+    print(json.dumps(google_books.get_cache_stats(redis_conn), indent=2))
+
+    print("\n--- Recommendation cache ---")
+    print(json.dumps(recommendation_cache.get_recommendation_cache_stats(redis_conn), indent=2))
+
+    memory_info = redis_conn.info('memory')
+    print("\n--- Redis ---")
+    print(f"used_memory: {memory_info.get('used_memory_human')}, maxmemory: {memory_info.get('maxmemory_human')}, "
+          f"policy: {memory_info.get('maxmemory_policy')}")
+
+
+def purge(redis_conn, dry_run=False):
+    namespace = tasks.current_llm_cache_namespace()
+    deleted = llm_cache.purge_stale_entries(redis_conn, namespace, dry_run=dry_run)
+    verb = "Would delete" if dry_run else "Deleted"
+    print(f"{verb} {deleted} stale LLM cache entr{'y' if deleted == 1 else 'ies'} (keeping {namespace}:*).")
+
+
+def set_policy(redis_conn, maxmemory=None):
+    if maxmemory:
+        redis_conn.config_set('maxmemory', maxmemory)
+    redis_conn.config_set('maxmemory-policy', llm_cache.RECOMMENDED_EVICTION_POLICY)
+    print(f"Set maxmemory-policy={llm_cache.RECOMMENDED_EVICTION_POLICY}" + (f", maxmemory={maxmemory}" if maxmemory else "") + ".")
+    print("Warning: every key with a TTL can now be evicted under memory pressure: the caches, but also RQ job "
+          "results, job progress streams, stored recommendation pages and user profiles. Queued jobs are kept. "
+          "Use this on a Redis instance dedicated to caches, or keep maxmemory well above normal usage.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('stats')
+    purge_parser = subparsers.add_parser('purge')
+    purge_parser.add_argument('--dry-run', action='store_true')
+    policy_parser = subparsers.add_parser('set-policy')
+    policy_parser.add_argument('--maxmemory', help="e.g. 2gb; leave unset to keep the current limit")
+    args = parser.parse_args()
+
+    redis_conn = Redis(decode_responses=True)
+    if args.command == 'stats':
+        show_stats(redis_conn)
+    elif args.command == 'purge':
+        purge(redis_conn, dry_run=args.dry_run)
+    elif args.command == 'set-policy':
+        set_policy(redis_conn, maxmemory=args.maxmemory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+"""
+Approximate nearest-neighbour recommendations over embeddings of the LLM analyses.
+
+Exact feature matching never links "sci-fi" to "science fiction". This mode embeds
+a short text rendering of each enriched book's analysis with a local Ollama
+embedding model and stores the unit vectors in the book_embeddings table, so
+rebuilds only embed books that are new or were re-analysed. It then builds an
+IVF index on disk: k-means centroids, plus the vectors grouped by their nearest
+centroid. A query embeds the user profile the same way and only scores the
+vectors in the n_probe closest lists.
+
+Requires numpy and an Ollama embedding model (`ollama pull nomic-embed-text`). Usage:
+    python embedding_index.py build [--lists 256]    # embed new books, then rebuild data/embedding_index.npz
+"""
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import ollama_client
+
+DB_FILE_PATH = 'data/books.db'
+INDEX_FILE_PATH = os.environ.get('EMBEDDING_INDEX_PATH', 'data/embedding_index.npz')
+OLLAMA_EMBEDDINGS_URL = os.environ.get('OLLAMA_EMBEDDINGS_URL', 'http://localhost:11434/api/embeddings')
+EMBEDDING_MODEL = os.environ.get('EMBEDDING_MODEL', 'nomic-embed-text')
+EMBED_MAX_WORKERS = int(os.environ.get('EMBED_MAX_WORKERS', 4))
+EMBED_TIMEOUT = 60
+DEFAULT_N_PROBE = int(os.environ.get('EMBEDDING_N_PROBE', 8))
+KMEANS_ITERATIONS = 20
+KMEANS_SAMPLE_SIZE = 100000 # centroids are trained on at most this many vectors
+
+
+# --- Texts to embed ---
+
+def _json_list(value):
+    if isinstance(value, list):
+        return value
+    try:
+        loaded = json.loads(value) if value else []
+    except (json.JSONDecodeError, TypeError):
+        return [value]
+    return loaded if isinstance(loaded, list) else [loaded]
+
+
+def analysis_text(genres, tones, themes, periods, locations, audiences):
+    """One line per facet, so books and profiles are embedded from the same template."""
+    parts = [
+        ("Genres", genres), ("Tone", tones), ("Themes", themes),
+        ("Setting period", periods), ("Setting location", locations), ("Audience", audiences),
+    ]
+    return "\n".join(f"{label}: {', '.join(str(v) for v in values if v)}" for label, values in parts if values)
+
+
+def text_from_db_row(row):
+    return analysis_text(
+        _json_list(row['llm_genre']), _json_list(row['llm_tone']), _json_list(row['llm_themes']),
+        _json_list(row['llm_setting_period']), _json_list(row['llm_setting_location']),
+        _json_list(row['llm_target_audience']),
+    )
+
+
+def text_from_profile(user_profile):
+    return analysis_text(
+        user_profile.get('top_genres') or [], user_profile.get('top_tones') or [],
+        user_profile.get('top_themes') or [], user_profile.get('top_periods') or [],
+        user_profile.get('top_locations') or [], user_profile.get('top_audiences') or [],
+    )
+
+
+# --- Embedding ---
+
+def embed_text(text):
+    """Unit-length float32 embedding of `text` from the Ollama embedding model."""
+    vector = np.asarray(ollama_client.embed(text, EMBEDDING_MODEL, OLLAMA_EMBEDDINGS_URL, EMBED_TIMEOUT),
+                        dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def ensure_schema(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS book_embeddings (
+            isbn13 TEXT PRIMARY KEY,
+            model TEXT NOT NULL,
+            text TEXT NOT NULL,   -- what was embedded; a changed analysis means a re-embed
+            vector BLOB NOT NULL  -- float32, unit length
+        )
+    """)
+
+
+def embed_catalogue(db_path=DB_FILE_PATH, max_workers=EMBED_MAX_WORKERS, batch_size=500):
+    """Embeds every enriched book whose stored embedding is missing, from another model, or stale."""
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    ensure_schema(conn)
+    stored = {row['isbn13']: (row['model'], row['text'])
+              for row in conn.execute("SELECT isbn13, model, text FROM book_embeddings")}
+    pending = []
+    for row in conn.execute("""
+            SELECT isbn13, llm_genre, llm_themes, llm_tone,
+                   llm_setting_period, llm_setting_location, llm_target_audience
+            FROM books
+            WHERE llm_themes IS NOT NULL AND llm_themes != '[]'
+    """):
+        text = text_from_db_row(row)
+        if text and stored.get(row['isbn13']) != (EMBEDDING_MODEL, text):
+            pending.append((row['isbn13'], text))
+    print(f"{len(pending)} book(s) to embed with {EMBEDDING_MODEL} ({len(stored)} already stored).")
+
+    embedded = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for i in range(0, len(pending), batch_size):
+            batch = pending[i:i + batch_size]
+            vectors = list(executor.map(lambda item: embed_text(item[1]), batch))
+            conn.executemany(
+                "INSERT OR REPLACE INTO book_embeddings (isbn13, model, text, vector) VALUES (?, ?, ?, ?)",
+                [(isbn, EMBEDDING_MODEL, text, vector.tobytes()) for (isbn, text), vector in zip(batch, vectors)]
+            )
+            conn.commit()
+            embedded += len(batch)
+            elapsed = time.perf_counter() - start
+            print(f"Embedded {embedded}/{len(pending)} ({embedded / elapsed if elapsed else 0:.1f} books/sec)")
+    conn.close()
+    return embedded
+
+
+def load_embeddings(db_path=DB_FILE_PATH):
+    """(isbns, vectors) for the current embedding model, for books still in the catalogue."""
+    conn = sqlite3.connect(db_path)
+    ensure_schema(conn)
+    rows = conn.execute("""
+        SELECT e.isbn13, e.vector FROM book_embeddings AS e JOIN books AS b ON b.isbn13 = e.isbn13
+        WHERE e.model = ? ORDER BY e.isbn13
+    """, (EMBEDDING_MODEL,)).fetchall()
+    conn.close()
+    if not rows:
+        return np.empty(0, dtype=str), np.empty((0, 0), dtype=np.float32)
+    isbns = np.asarray([isbn for isbn, _ in rows], dtype=str)
+    vectors = np.vstack([np.frombuffer(blob, dtype=np.float32) for _, blob in rows])
+    return isbns, vectors
+
+
+# --- IVF index ---
+
+def train_centroids(vectors, n_lists, iterations=KMEANS_ITERATIONS, seed=0):
+    """Spherical k-means (cosine) on a sample of the vectors. Returns unit-length centroids."""
+    rng = np.random.default_rng(seed)
+    sample = vectors
+    if len(vectors) > KMEANS_SAMPLE_SIZE:
+        sample = vectors[rng.choice(len(vectors), KMEANS_SAMPLE_SIZE, replace=False)]
+    n_lists = max(1, min(n_lists, len(sample)))
+    centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        empty = norms[:, 0] == 0
+        # Empty lists keep their previous centroid
+        centroids = np.where(empty[:, None], centroids, sums / np.where(norms == 0, 1, norms))
+    return centroids.astype(np.float32)
+
+
+class IVFIndex:
+    """Vectors grouped by nearest centroid; list i is vectors[offsets[i]:offsets[i + 1]]."""
+
+    def __init__(self, centroids, offsets, vectors, isbns):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.vectors = vectors
+        self.isbns = isbns
+
+    @classmethod
+    def build(cls, isbns, vectors, n_lists=None):
+        if len(vectors) == 0:
+            raise ValueError("No embeddings to index; run an embedding pass first.")
+        n_lists = n_lists or max(1, int(np.sqrt(len(vectors))))
+        centroids = train_centroids(vectors, n_lists)
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        order = np.argsort(assignment, kind='stable')
+        counts = np.bincount(assignment, minlength=len(centroids))
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        return cls(centroids, offsets, vectors[order], isbns[order])
+
+    def save(self, path=INDEX_FILE_PATH):
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, centroids=self.centroids, offsets=self.offsets, vectors=self.vectors,
+                 isbns=self.isbns, model=np.asarray(EMBEDDING_MODEL))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=INDEX_FILE_PATH):
+        with np.load(path) as arrays:
+            if str(arrays['model']) != EMBEDDING_MODEL:
+                raise ValueError(f"Index at {path} was built with {arrays['model']}, not {EMBEDDING_MODEL}.")
+            return cls(arrays['centroids'], arrays['offsets'], arrays['vectors'], arrays['isbns'])
+
+    def search(self, query, top_n=10, n_probe=DEFAULT_N_PROBE, exclude_isbns=()):
+        """[(isbn13, cosine similarity), ...] from the n_probe lists closest to `query`."""
+        n_probe = min(n_probe, len(self.centroids))
+        probe_lists = np.argpartition(-(self.centroids @ query), n_probe - 1)[:n_probe]
+        rows = np.concatenate([np.arange(self.offsets[i], self.offsets[i + 1]) for i in probe_lists])
+        return self._top(rows, self.vectors[rows] @ query, top_n, exclude_isbns)
+
+    def brute_force(self, query, top_n=10, exclude_isbns=()):
+        """Exact search over every vector, the baseline for recall measurements."""
+        return self._top(np.arange(len(self.vectors)), self.vectors @ query, top_n, exclude_isbns)
+
+    def _top(self, rows, scores, top_n, exclude_isbns):
+        if exclude_isbns:
+            keep = ~np.isin(self.isbns[rows], list(exclude_isbns))
+            rows, scores = rows[keep], scores[keep]
+        if len(rows) == 0:
+            return []
+        top_n = min(top_n, len(rows))
+        best = np.argpartition(-scores, top_n - 1)[:top_n]
+        best = best[np.argsort(-scores[best], kind='stable')]
+        return [(str(self.isbns[rows[i]]), float(scores[i])) for i in best]
+
+
+_index = None
+_index_mtime = None
+_index_lock = threading.Lock()
+
+
+def get_index(path=INDEX_FILE_PATH):
+    """Process-wide index, reloaded when the file is rebuilt. Raises FileNotFoundError if not built."""
+    global _index, _index_mtime
+    mtime = os.path.getmtime(path)
+    if _index is None or mtime != _index_mtime:
+        with _index_lock:
+            if _index is None or mtime != _index_mtime:
+                _index = IVFIndex.load(path)
+                _index_mtime = mtime
+    return _index
+
+
+def recommend(user_profile, exclude_isbns=(), top_n=10, n_probe=DEFAULT_N_PROBE):
+    """[(isbn13, similarity), ...] for the books closest to the embedded profile."""
+    text = text_from_profile(user_profile)
+    if not text:
+        return []
+    return get_index().search(embed_text(text), top_n=top_n, n_probe=n_probe, exclude_isbns=exclude_isbns)
+
+
+def build_embedding_index(db_path=DB_FILE_PATH, path=INDEX_FILE_PATH, n_lists=None):
+    embed_catalogue(db_path)
+    start = time.perf_counter()
+    isbns, vectors = load_embeddings(db_path)
+    index = IVFIndex.build(isbns, vectors, n_lists)
+    index.save(path)
+    print(f"Built IVF index over {len(vectors)} vectors ({len(index.centroids)} lists) "
+          f"in {time.perf_counter() - start:.2f}s -> {path}")
+    return index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['build'])
+    parser.add_argument('--db', default=DB_FILE_PATH)
+    parser.add_argument('--output', default=INDEX_FILE_PATH)
+    parser.add_argument('--lists', type=int, default=None, help="IVF lists (default: sqrt of the catalogue size)")
+    args = parser.parse_args()
+    if args.command == 'build':
+        build_embedding_index(args.db, args.output, args.lists)
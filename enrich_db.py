@@ -1,127 +1,628 @@
-from tasks import get_llm_analysis_for_book_local
+from tasks import get_llm_analysis_with_source
+import feature_index
+import queues
+import recommendation_cache
 
+import argparse
 import sqlite3
-import requests
 import json
+import os
+import queue
+import socket
+import threading
 import time
-import redis
+import uuid
 from redis import Redis, RedisError
-import os
 
 DB_FILE_PATH = 'data/books.db'
-SLEEP_INTERVAL = 1.0 # Adjust as needed for Ollama setup
+# Match this to the Ollama server's OLLAMA_NUM_PARALLEL; more workers than that just queue inside Ollama
+OLLAMA_NUM_PARALLEL = int(os.environ.get('OLLAMA_NUM_PARALLEL', 1))
+WRITE_BATCH_SIZE = 50 # Rows per executemany/commit in the writer
+TARGET_LATENCY_SECONDS = float(os.environ.get('ENRICH_TARGET_LATENCY', 30.0)) # Back off if Ollama calls get slower than this
+MAX_DELAY_SECONDS = 10.0
+
+# --- Sharded (RQ) enrichment ---
+ENRICH_QUEUE_NAME = queues.BULK_QUEUE # behind search and interactive jobs on shared workers
+DEFAULT_SHARD_SIZE = 500
+SHARD_JOB_TIMEOUT = 3600 * 24 # A CPU-only Ollama box can take hours per shard
+LEASE_TTL_SECONDS = 120 # A shard whose lease isn't renewed for this long is considered abandoned
+SHARD_KEY_PREFIX = 'enrich_shard'
+SHARD_IDS_KEY = 'enrich_shards'
+SHARD_RESULTS_KEY = 'enrich_shard_results' # isbn -> analysis JSON, waiting to be collected into books.db
+
+# Only touch the lease if we still own it
+_RENEW_LEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('expire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+_RELEASE_LEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class AdaptiveRateController:
+    """
+    Paces Ollama calls from observed latency instead of a fixed sleep.
+    Keeps an exponentially weighted moving average of call latency: while it stays
+    under the target the delay between calls decays towards zero, and when Ollama
+    slows down (queueing, thermal throttling, swapping) the delay doubles.
+    """
+
+    def __init__(self, target_latency=TARGET_LATENCY_SECONDS, max_delay=MAX_DELAY_SECONDS, smoothing=0.2):
+        self.target_latency = target_latency
+        self.max_delay = max_delay
+        self.smoothing = smoothing
+        self.avg_latency = None
+        self.delay = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, latency):
+        with self._lock:
+            if self.avg_latency is None:
+                self.avg_latency = latency
+            else:
+                self.avg_latency += self.smoothing * (latency - self.avg_latency)
+
+            if self.avg_latency > self.target_latency:
+                self.delay = min(self.max_delay, max(self.delay * 2, 0.25))
+            else:
+                self.delay = self.delay / 2 if self.delay > 0.05 else 0.0
+
+    def wait(self):
+        with self._lock:
+            delay = self.delay
+        if delay > 0:
+            time.sleep(delay)
+
+
+def write_llm_results(conn, rows):
+    """
+    Writes a batch of (isbn, llm_analysis) pairs, and their feature index rows, with
+    one executemany and one commit.
+    """
+    conn.executemany("""
+        UPDATE books
+        SET llm_genre = ?,
+            llm_themes = ?,
+            llm_tone = ?,
+            llm_setting_period = ?,
+            llm_setting_location = ?,
+            llm_target_audience = ?,
+            llm_sentiment = ?
+            -- Note: We are NOT updating description or google_categories
+        WHERE isbn13 = ?
+    """, [
+        (
+            json.dumps(llm_analysis_result.get('genre', [])),
+            json.dumps(llm_analysis_result.get('themes', [])),
+            json.dumps(llm_analysis_result.get('tone', [])),
+            llm_analysis_result.get('setting_period'),
+            llm_analysis_result.get('setting_location'),
+            llm_analysis_result.get('target_audience'),
+            llm_analysis_result.get('sentiment'),
+            isbn
+        )
+        for isbn, llm_analysis_result in rows
+    ])
+    feature_index.index_analyses(conn, rows)
+    conn.commit()
+
+
+class SQLiteResultSink:
+    """Writes finished analyses straight into books.db (single-process mode)."""
+
+    def __init__(self):
+        self.conn = sqlite3.connect(DB_FILE_PATH)
+        feature_index.ensure_schema(self.conn)
+
+    def write(self, rows):
+        try:
+            write_llm_results(self.conn, rows)
+        except sqlite3.Error:
+            self.conn.rollback()
+            raise
+
+    def close(self):
+        self.conn.close()
+
+
+class RedisResultSink:
+    """
+    Parks finished analyses in Redis (sharded mode), so shard workers only need to
+    reach Redis and Ollama; `collect_shard_results` later writes them into books.db.
+    """
+
+    def __init__(self, redis_conn, shard_id=None):
+        self.redis_conn = redis_conn
+        self.shard_id = shard_id
+
+    def write(self, rows):
+        pipe = self.redis_conn.pipeline()
+        pipe.hset(SHARD_RESULTS_KEY, mapping={isbn: json.dumps(result) for isbn, result in rows})
+        if self.shard_id is not None:
+            pipe.hincrby(_shard_key(self.shard_id), 'updated', len(rows))
+        pipe.execute()
+
+    def close(self):
+        pass
+
+
+def _put_result(results_queue, item, writer_failed):
+    """Queues an item for the writer, giving up (False) if the writer has died and nothing will drain the queue."""
+    while not writer_failed.is_set():
+        try:
+            results_queue.put(item, timeout=1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _writer_thread(results_queue, make_sink, stats, total_books, write_batch_size, on_progress, writer_failed, stop_event):
+    """Runs the writer loop; if it raises, records the error and stops the workers instead of leaving them blocked."""
+    try:
+        _writer_loop(results_queue, make_sink, stats, total_books, write_batch_size, on_progress)
+    except Exception as e:
+        print(f"ERROR: Enrichment writer failed: {e!r}. Stopping workers.")
+        stats['writer_error'] = repr(e)
+        writer_failed.set()
+        stop_event.set()
+
+
+def _writer_loop(results_queue, make_sink, stats, total_books, write_batch_size, on_progress=None):
+    """Single writer thread: the only place results are written, so workers never contend for the SQLite lock."""
+    sink = make_sink()
+    pending_rows = []
+    reported = {'processed': 0, 'llm_errors': 0}
+
+    def report():
+        if on_progress:
+            delta = {key: stats[key] - reported[key] for key in reported}
+            reported.update({key: stats[key] for key in reported})
+            on_progress(delta)
+
+    def flush():
+        if not pending_rows:
+            report()
+            return
+        try:
+            sink.write(pending_rows)
+            stats['updated'] += len(pending_rows)
+            print(f"   - Committed batch of {len(pending_rows)} ({stats['processed']}/{total_books} processed)")
+        except (sqlite3.Error, RedisError) as e:
+            print(f"   - Error writing batch of results: {e}")
+            stats['write_errors'] += len(pending_rows)
+        pending_rows.clear()
+        report()
+
+    while True:
+        try:
+            item = results_queue.get(timeout=5)
+        except queue.Empty:
+            flush() # Don't sit on finished rows while the workers are slow
+            continue
+        if item is None:
+            break
+
+        isbn, llm_analysis_result = item
+        stats['processed'] += 1
+        if llm_analysis_result:
+            pending_rows.append((isbn, llm_analysis_result))
+            if len(pending_rows) >= write_batch_size:
+                flush()
+        else:
+            stats['llm_errors'] += 1
+
+    flush()
+    sink.close()
+
+
+def _enrichment_worker(books_queue, results_queue, redis_conn, rate_controller, stats_lock, stats, stop_event,
+                       writer_failed):
+    while not stop_event.is_set():
+        try:
+            book_row = books_queue.get_nowait()
+        except queue.Empty:
+            return
+
+        isbn, title, authors = book_row
+        book_data_for_llm = {
+            'isbn': isbn,
+            'title': title,
+            'authors': authors
+        }
+        start = time.perf_counter()
+        llm_analysis_result, cache_hit = get_llm_analysis_with_source(book_data_for_llm, redis_conn)
+        latency = time.perf_counter() - start
+
+        if cache_hit:
+            with stats_lock:
+                stats['cache_hits'] += 1
+        else:
+            # Only real model calls inform (and pay) the pacing delay
+            rate_controller.record(latency)
+            rate_controller.wait()
+
+        if not _put_result(results_queue, (isbn, llm_analysis_result), writer_failed):
+            return
+
+
+def run_enrichment(books_to_process, redis_conn, make_sink, num_workers=OLLAMA_NUM_PARALLEL,
+                   write_batch_size=WRITE_BATCH_SIZE, target_latency=TARGET_LATENCY_SECONDS,
+                   stop_event=None, on_progress=None):
+    """
+    Analyses (isbn, title, authors) rows with `num_workers` concurrent workers and
+    hands results to a single batched writer built by `make_sink`. Setting
+    `stop_event` stops workers picking up new books; finished ones are still written.
+    Returns the run's stats dict, or raises RuntimeError if the writer failed.
+    """
+    stop_event = stop_event or threading.Event()
+    writer_failed = threading.Event()
+    total_books = len(books_to_process)
+    books_queue = queue.Queue()
+    for book_row in books_to_process:
+        books_queue.put(tuple(book_row))
+    results_queue = queue.Queue(maxsize=write_batch_size * 4)
+
+    stats = {'processed': 0, 'updated': 0, 'llm_errors': 0, 'write_errors': 0, 'cache_hits': 0}
+    stats_lock = threading.Lock()
+    rate_controller = AdaptiveRateController(target_latency=target_latency)
+
+    writer = threading.Thread(target=_writer_thread,
+                              args=(results_queue, make_sink, stats, total_books, write_batch_size, on_progress,
+                                    writer_failed, stop_event))
+    writer.start()
+    workers = [
+        threading.Thread(target=_enrichment_worker,
+                         args=(books_queue, results_queue, redis_conn, rate_controller, stats_lock, stats, stop_event,
+                               writer_failed),
+                         daemon=True)
+        for _ in range(max(1, num_workers))
+    ]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        print("\nInterrupted: finishing in-flight books and committing finished results...")
+        stop_event.set()
+        for worker in workers:
+            worker.join()
+    finally:
+        _put_result(results_queue, None, writer_failed)
+        writer.join()
+    if writer_failed.is_set():
+        raise RuntimeError(f"Enrichment writer failed after {stats['processed']} book(s): {stats['writer_error']}")
+    return stats
+
+
+def _connect_redis():
+    try:
+        redis_conn = Redis(decode_responses=True)
+        redis_conn.ping()
+        print("Connected to Redis for caching.")
+        return redis_conn
+    except (RedisError, OSError) as e:
+        print(f"ERROR: Could not connect to Redis, which LLM analysis requires. {e}")
+        return None
 
-def enrich_database_llm_only():
-    """Fetches only LLM analysis for books in the database."""
-    print("Starting database enrichment (LLM only)...")
+
+def enrich_database_llm_only(num_workers=OLLAMA_NUM_PARALLEL, write_batch_size=WRITE_BATCH_SIZE,
+                             target_latency=TARGET_LATENCY_SECONDS):
+    """
+    Fetches only LLM analysis for books in the database.
+    Books with llm_themes IS NULL are analysed by `num_workers` concurrent workers and
+    written back by a single batched writer, so an interrupted run resumes where the
+    last committed batch left off.
+    """
+    print(f"Starting database enrichment (LLM only) with {num_workers} worker(s)...")
     try:
         conn = sqlite3.connect(DB_FILE_PATH)
-        conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
     except sqlite3.Error as e:
         print(f"ERROR: Could not connect to database {DB_FILE_PATH}: {e}")
         return
 
-    # Persistent Redis connection for caching across the script run
-    try:
-        redis_conn = Redis(decode_responses=True)
-        redis_conn.ping()
-        print("Connected to Redis for caching.")
-    except Exception as e:
-        print(f"WARNING: Could not connect to Redis. Caching disabled. {e}")
-        redis_conn = None
+    # Persistent Redis connection for caching across the script run (its pool is thread-safe)
+    redis_conn = _connect_redis()
+    if redis_conn is None:
+        conn.close()
+        return
 
     # Check for NULL in llm_themes
     cursor.execute("SELECT isbn13, title, authors FROM books WHERE llm_themes IS NULL")
     books_to_process = cursor.fetchall()
+    conn.close()
     total_books = len(books_to_process)
     print(f"Found {total_books} books to process.")
 
-    processed_count = 0
-    updated_count = 0
-    llm_errors = 0
+    start = time.perf_counter()
+    stats = run_enrichment(books_to_process, redis_conn, SQLiteResultSink, num_workers=num_workers,
+                           write_batch_size=write_batch_size, target_latency=target_latency)
+    elapsed = time.perf_counter() - start
 
-    for book_row in books_to_process:
-        processed_count += 1
-        isbn = book_row['isbn13']
-        title = book_row['title']
-        authors = book_row['authors']
-
-        print(f"\nProcessing {processed_count}/{total_books}: ISBN {isbn} - {title}")
-
-        # Get LLM Analysis (Requires title, authors, isbn)
-        llm_analysis_result = None
-        if redis_conn:
-            print(" - Getting LLM analysis...")
-            book_data_for_llm = {
-                'isbn': isbn,
-                'title': title,
-                'authors': authors
-            }
-            llm_analysis_result = get_llm_analysis_for_book_local(book_data_for_llm, redis_conn)
-
-            if llm_analysis_result:
-                print("   - LLM analysis successful.")
-            else:
-                print("   - LLM analysis failed or returned invalid data.")
-                llm_errors += 1
-        else:
-            print(" - Skipping LLM analysis (Redis connection failed).")
-            llm_errors += 1
+    print("\n--- Enrichment Summary ---")
+    print(f"Total books needing processing: {total_books}")
+    print(f"Attempted processing: {stats['processed']}")
+    print(f"Cache hits: {stats['cache_hits']}")
+    print(f"Rows updated in DB: {stats['updated']}")
+    print(f"LLM analysis errors/skips: {stats['llm_errors']}")
+    print(f"DB write errors: {stats['write_errors']}")
+    print(f"Elapsed: {elapsed:.1f}s ({stats['processed'] / elapsed if elapsed else 0:.2f} books/sec)")
+    print("-------------------------")
+    if stats['updated']:
+        recommendation_cache.refresh_recommendation_artifacts(DB_FILE_PATH, redis_conn)
 
-        # Update Database if successful
-        if llm_analysis_result:
-            try:
-                print(" - Updating database...")
-                update_cursor = conn.cursor()
-                update_cursor.execute("""
-                    UPDATE books
-                    SET llm_genre = ?,
-                        llm_themes = ?,
-                        llm_tone = ?,
-                        llm_setting_period = ?,
-                        llm_setting_location = ?,
-                        llm_target_audience = ?,
-                        llm_sentiment = ?
-                        -- Note: We are NOT updating description or google_categories
-                    WHERE isbn13 = ?
-                """, (
-                    json.dumps(llm_analysis_result.get('genre', [])),
-                    json.dumps(llm_analysis_result.get('themes', [])),
-                    json.dumps(llm_analysis_result.get('tone', [])),
-                    llm_analysis_result.get('setting_period'),
-                    llm_analysis_result.get('setting_location'),
-                    llm_analysis_result.get('target_audience'),
-                    llm_analysis_result.get('sentiment'),
-                    isbn
-                ))
-                if processed_count % 50 == 0: # Commit every 50 records
-                     conn.commit()
-                     print(f"   - Committed batch at record {processed_count}")
-                updated_count += 1
-            except sqlite3.Error as e:
-                print(f"   - Error updating database for {isbn}: {e}")
-                conn.rollback() # Rollback failed update if needed
-
-        # 3. Sleep
-        time.sleep(SLEEP_INTERVAL)
-
-    # Final commit for any remaining records
+
+# --- Sharded enrichment across RQ workers ---
+def _shard_key(shard_id):
+    return f"{SHARD_KEY_PREFIX}:{shard_id}"
+
+def _shard_rows_key(shard_id):
+    return f"{SHARD_KEY_PREFIX}:{shard_id}:rows"
+
+def _shard_lease_key(shard_id):
+    return f"{SHARD_KEY_PREFIX}:{shard_id}:lease"
+
+
+def _enqueue_shard(redis_conn, rq_conn, shard_id):
+    """rq_conn is a raw (non-decoding) connection, which RQ requires; pass one per run, not per shard."""
+    enrich_queue = queues.get_queue(ENRICH_QUEUE_NAME, rq_conn)
+    job = enrich_queue.enqueue(enrich_shard_task, shard_id, job_timeout=SHARD_JOB_TIMEOUT)
+    redis_conn.hset(_shard_key(shard_id), mapping={'status': 'queued', 'job_id': job.id})
+    return job
+
+
+def plan_shards(shard_size=DEFAULT_SHARD_SIZE, enqueue=True):
+    """
+    Splits the unenriched rows (llm_themes IS NULL) into contiguous rowid ranges of
+    `shard_size` books and registers each as a shard in Redis. The rows themselves are
+    stored with the shard, so any worker that can reach Redis and Ollama can run it.
+    """
+    redis_conn = _connect_redis()
+    if redis_conn is None:
+        return []
+
+    unfinished = [shard_id for shard_id in redis_conn.smembers(SHARD_IDS_KEY)
+                  if redis_conn.hget(_shard_key(shard_id), 'status') != 'done']
+    if unfinished:
+        print(f"ERROR: {len(unfinished)} shard(s) from a previous plan are not done yet. "
+              "Finish them (or run with `shards reset`) before planning again.")
+        return []
+
+    conn = sqlite3.connect(DB_FILE_PATH)
+    cursor = conn.execute("SELECT rowid, isbn13, title, authors FROM books WHERE llm_themes IS NULL ORDER BY rowid")
+    # Rows already analysed by shard workers but not yet collected into books.db are skipped
+    pending_isbns = set(redis_conn.hkeys(SHARD_RESULTS_KEY))
+
+    shard_ids = []
+    while True:
+        fetched = cursor.fetchmany(shard_size * 2)
+        if not fetched:
+            break
+        # A chunk that is entirely pending yields no shards, but later chunks still need planning
+        batch = [row for row in fetched if row[1] not in pending_isbns]
+        for i in range(0, len(batch), shard_size):
+            shard_rows = batch[i:i + shard_size]
+            shard_id = uuid.uuid4().hex[:12]
+            pipe = redis_conn.pipeline()
+            pipe.set(_shard_rows_key(shard_id), json.dumps([row[1:] for row in shard_rows]))
+            pipe.hset(_shard_key(shard_id), mapping={
+                'rowid_start': shard_rows[0][0],
+                'rowid_end': shard_rows[-1][0],
+                'total': len(shard_rows),
+                'processed': 0,
+                'updated': 0,
+                'llm_errors': 0,
+                'attempts': 0,
+                'status': 'planned',
+            })
+            pipe.sadd(SHARD_IDS_KEY, shard_id)
+            pipe.execute()
+            shard_ids.append(shard_id)
+    conn.close()
+
+    if enqueue:
+        rq_conn = Redis()
+        for shard_id in shard_ids:
+            _enqueue_shard(redis_conn, rq_conn, shard_id)
+    print(f"Planned {len(shard_ids)} shard(s) of up to {shard_size} books" + (" and enqueued them." if enqueue else "."))
+    return shard_ids
+
+
+def enrich_shard_task(shard_id, num_workers=None):
+    """
+    RQ job: analyses one shard's books. Holds a renewable lease on the shard while it
+    runs; if the worker dies the lease expires and `requeue_expired_shards` hands the
+    shard to another worker. Books finished before a crash are LLM cache hits on retry.
+    """
+    redis_conn = Redis(decode_responses=True)
+    shard_key = _shard_key(shard_id)
+    lease_key = _shard_lease_key(shard_id)
+    token = uuid.uuid4().hex
+
+    if redis_conn.hget(shard_key, 'status') == 'done':
+        print(f"Shard {shard_id} is already done, skipping.")
+        return {'shard_id': shard_id, 'skipped': True}
+    if not redis_conn.set(lease_key, token, nx=True, ex=LEASE_TTL_SECONDS):
+        print(f"Shard {shard_id} is leased by another worker, skipping.")
+        return {'shard_id': shard_id, 'skipped': True}
+
+    renew_lease = redis_conn.register_script(_RENEW_LEASE_SCRIPT)
+    release_lease = redis_conn.register_script(_RELEASE_LEASE_SCRIPT)
+    redis_conn.hset(shard_key, mapping={'status': 'leased', 'leased_at': time.time(), 'worker': socket.gethostname()})
+    redis_conn.hincrby(shard_key, 'attempts', 1)
+    # Progress counters restart with each attempt; rows already done come back as cache hits
+    redis_conn.hset(shard_key, mapping={'processed': 0, 'updated': 0, 'llm_errors': 0})
+
+    stop_event = threading.Event()
+
+    def heartbeat():
+        while not stop_event.wait(LEASE_TTL_SECONDS / 3):
+            if not renew_lease(keys=[lease_key], args=[token, LEASE_TTL_SECONDS]):
+                print(f"Lost lease on shard {shard_id}; stopping after in-flight books.")
+                stop_event.set()
+
+    heartbeat_thread = threading.Thread(target=heartbeat, daemon=True)
+    heartbeat_thread.start()
+
+    def on_progress(delta):
+        pipe = redis_conn.pipeline()
+        for field, amount in delta.items():
+            if amount:
+                pipe.hincrby(shard_key, field, amount)
+        pipe.execute()
+
+    rows = json.loads(redis_conn.get(_shard_rows_key(shard_id)) or "[]")
+    print(f"Processing shard {shard_id}: {len(rows)} books.")
     try:
-        conn.commit()
-        print("Final commit successful.")
-    except sqlite3.Error as e:
-        print(f"Error during final commit: {e}")
+        stats = run_enrichment(rows, redis_conn, lambda: RedisResultSink(redis_conn, shard_id),
+                               num_workers=num_workers or OLLAMA_NUM_PARALLEL,
+                               stop_event=stop_event, on_progress=on_progress)
+    finally:
+        lost_lease = stop_event.is_set()
+        stop_event.set()
+        heartbeat_thread.join()
+
+    if lost_lease:
+        return {'shard_id': shard_id, 'lost_lease': True, **stats}
+
+    redis_conn.hset(shard_key, mapping={'status': 'done', 'finished_at': time.time()})
+    release_lease(keys=[lease_key], args=[token])
+    print(f"Shard {shard_id} done: {stats}")
+    return {'shard_id': shard_id, **stats}
+
 
+def _stalled_status(redis_conn, rq_conn, shard_id, status, job_id):
+    """
+    'expired' for a leased shard whose worker stopped renewing the lease (crashed, killed,
+    lost network); 'lost' for a queued shard whose RQ job is gone or failed before it took
+    the lease. None if the shard is still progressing.
+    """
+    if status == 'leased' and not redis_conn.exists(_shard_lease_key(shard_id)):
+        return 'expired'
+    if status == 'queued':
+        job = queues.fetch_job(job_id, rq_conn) if job_id else None
+        if job is None or job.is_failed:
+            return 'lost'
+    return None
+
+
+def requeue_expired_shards():
+    """Re-enqueues shards whose lease expired or whose queued job was lost or failed."""
+    redis_conn = _connect_redis()
+    if redis_conn is None:
+        return []
+    rq_conn = Redis()
+    requeued = []
+    for shard_id in redis_conn.smembers(SHARD_IDS_KEY):
+        status, job_id = redis_conn.hmget(_shard_key(shard_id), ['status', 'job_id'])
+        if _stalled_status(redis_conn, rq_conn, shard_id, status, job_id):
+            _enqueue_shard(redis_conn, rq_conn, shard_id)
+            requeued.append(shard_id)
+    print(f"Re-queued {len(requeued)} abandoned shard(s).")
+    return requeued
+
+
+def collect_shard_results(write_batch_size=WRITE_BATCH_SIZE):
+    """Writes analyses parked in Redis by shard workers into books.db, in batches."""
+    redis_conn = _connect_redis()
+    if redis_conn is None:
+        return 0
+    conn = sqlite3.connect(DB_FILE_PATH)
+    feature_index.ensure_schema(conn)
+    written = 0
+    cursor = 0
+    while True:
+        cursor, entries = redis_conn.hscan(SHARD_RESULTS_KEY, cursor, count=write_batch_size)
+        if entries:
+            rows = [(isbn, json.loads(result)) for isbn, result in entries.items()]
+            write_llm_results(conn, rows)
+            redis_conn.hdel(SHARD_RESULTS_KEY, *entries.keys())
+            written += len(rows)
+        if cursor == 0:
+            break
     conn.close()
-    print("\n--- Enrichment Summary ---")
-    print(f"Total books needing processing: {total_books}")
-    print(f"Attempted processing: {processed_count}")
-    print(f"Rows updated in DB: {updated_count}")
-    print(f"LLM analysis errors/skips: {llm_errors}")
-    print("-------------------------")
+    print(f"Collected {written} shard result(s) into {DB_FILE_PATH}.")
+    if written:
+        recommendation_cache.refresh_recommendation_artifacts(DB_FILE_PATH, redis_conn)
+    return written
+
+
+def shard_progress_summary():
+    """Aggregates progress across every shard of the current plan and prints it."""
+    redis_conn = _connect_redis()
+    if redis_conn is None:
+        return {}
+    rq_conn = Redis()
+    summary = {'shards': 0, 'total': 0, 'processed': 0, 'updated': 0, 'llm_errors': 0, 'status_counts': {}}
+    for shard_id in redis_conn.smembers(SHARD_IDS_KEY):
+        shard = redis_conn.hgetall(_shard_key(shard_id))
+        status = shard.get('status', 'unknown')
+        status = _stalled_status(redis_conn, rq_conn, shard_id, status, shard.get('job_id')) or status
+        summary['shards'] += 1
+        summary['status_counts'][status] = summary['status_counts'].get(status, 0) + 1
+        for field in ('total', 'processed', 'updated', 'llm_errors'):
+            summary[field] += int(shard.get(field, 0))
+    summary['awaiting_collection'] = redis_conn.hlen(SHARD_RESULTS_KEY)
+
+    print("\n--- Shard Progress ---")
+    print(f"Shards: {summary['shards']} ({', '.join(f'{k}: {v}' for k, v in sorted(summary['status_counts'].items()))})")
+    percent = 100 * summary['processed'] / summary['total'] if summary['total'] else 0
+    print(f"Books processed: {summary['processed']}/{summary['total']} ({percent:.1f}%)")
+    print(f"Analyses stored: {summary['updated']}, LLM errors: {summary['llm_errors']}")
+    print(f"Results waiting to be collected into books.db: {summary['awaiting_collection']}")
+    stalled = summary['status_counts'].get('expired', 0) + summary['status_counts'].get('lost', 0)
+    if stalled:
+        print(f"{stalled} shard(s) have stalled (expired lease or lost job). "
+              "Run `python enrich_db.py shards requeue` to hand them to another worker.")
+    print("----------------------")
+    return summary
+
+
+def reset_shards():
+    """Forgets the current shard plan (uncollected results are kept)."""
+    redis_conn = _connect_redis()
+    if redis_conn is None:
+        return
+    shard_ids = redis_conn.smembers(SHARD_IDS_KEY)
+    for shard_id in shard_ids:
+        redis_conn.delete(_shard_key(shard_id), _shard_rows_key(shard_id), _shard_lease_key(shard_id))
+    redis_conn.delete(SHARD_IDS_KEY)
+    print(f"Removed {len(shard_ids)} shard(s).")
 
 
 # --- Main Execution ---
 if __name__ == "__main__":
-    enrich_database_llm_only()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Enrich books.db with LLM analysis.")
+    parser.add_argument('--workers', type=int, default=OLLAMA_NUM_PARALLEL,
+                        help="Concurrent Ollama calls (match the server's OLLAMA_NUM_PARALLEL)")
+    parser.add_argument('--batch-size', type=int, default=WRITE_BATCH_SIZE, help="Rows per database commit")
+    parser.add_argument('--target-latency', type=float, default=TARGET_LATENCY_SECONDS,
+                        help="Ollama latency (seconds) above which calls are slowed down")
+    subparsers = parser.add_subparsers(dest='command')
+    shards_parser = subparsers.add_parser('shards', help="Distribute enrichment across RQ workers")
+    shards_parser.add_argument('action', choices=['plan', 'progress', 'requeue', 'collect', 'reset'])
+    shards_parser.add_argument('--shard-size', type=int, default=DEFAULT_SHARD_SIZE)
+    args = parser.parse_args()
+
+    if args.command == 'shards':
+        if args.action == 'plan':
+            plan_shards(shard_size=args.shard_size)
+        elif args.action == 'progress':
+            shard_progress_summary()
+        elif args.action == 'requeue':
+            requeue_expired_shards()
+        elif args.action == 'collect':
+            collect_shard_results(write_batch_size=args.batch_size)
+        elif args.action == 'reset':
+            reset_shards()
+    else:
+        enrich_database_llm_only(num_workers=args.workers, write_batch_size=args.batch_size,
+                                 target_latency=args.target_latency)
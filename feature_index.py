@@ -0,0 +1,307 @@
+"""
+Inverted index of LLM-derived book features for recommendation scoring.
+
+Each enriched book contributes one (isbn13, kind, value) row per normalised feature
+(genre, tone, theme, setting, audience, author) to the book_features table, written
+by the enrichment paths as analyses are stored. Scoring a user profile is then a
+single indexed join of the profile's features against that table, rather than
+parsing the JSON columns of every candidate row.
+
+Usage:
+    python feature_index.py rebuild    # backfill book_features from already-enriched books
+    python feature_index.py explain    # print the candidate query plan; exit 1 if it full-scans
+"""
+import argparse
+import json
+import sqlite3
+import sys
+
+from user_profiles import PROFILE_FEATURES
+
+DB_FILE_PATH = 'data/books.db'
+
+# Score a candidate earns per matching feature; the single source of the weights for both scoring engines
+FEATURE_WEIGHTS = {
+    'genre': 7,
+    'tone': 5,
+    'theme': 2,             # Per shared theme
+    'setting_period': 3,
+    'setting_location': 3,
+    'target_audience': 4,
+    'author': 5             # Applied once if any of the candidate's authors was read by the user
+}
+
+# Which generate_user_profile list feeds each feature kind; authors are read, not counted
+PROFILE_FEATURE_KEYS = {kind: top_key for kind, (_, top_key, _, _) in PROFILE_FEATURES.items()}
+PROFILE_FEATURE_KEYS['author'] = 'read_authors'
+
+# LLM analysis key for each kind (authors come from the books table / Google Books data)
+ANALYSIS_FEATURE_KEYS = {
+    'genre': 'genre',
+    'tone': 'tone',
+    'theme': 'themes',
+    'setting_period': 'setting_period',
+    'setting_location': 'setting_location',
+    'target_audience': 'target_audience',
+}
+
+
+def ensure_schema(conn):
+    """
+    Creates the book_features table if it doesn't exist. It's a WITHOUT ROWID table
+    clustered on (kind, value, isbn13), so looking up a feature's postings is a range
+    read of the primary key that never touches another b-tree; idx_book_features_isbn
+    serves the per-book deletes done when a book is re-indexed.
+    """
+    existing = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'book_features'").fetchone()
+    if existing and 'WITHOUT ROWID' not in existing[0].upper():
+        _migrate_rowid_table(conn)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS book_features (
+            kind TEXT NOT NULL,   -- genre, tone, theme, setting_period, setting_location, target_audience, author
+            value TEXT NOT NULL,  -- lower-cased, stripped feature value
+            isbn13 TEXT NOT NULL,
+            PRIMARY KEY (kind, value, isbn13)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_book_features_isbn ON book_features (isbn13)")
+
+
+def _migrate_rowid_table(conn):
+    """Moves a book_features table from the original (rowid + secondary index) layout to the clustered one."""
+    print("Migrating book_features to the clustered (kind, value, isbn13) layout...")
+    conn.execute("ALTER TABLE book_features RENAME TO book_features_old")
+    conn.execute("DROP INDEX IF EXISTS idx_book_features_kind_value")
+    conn.execute("DROP INDEX IF EXISTS idx_book_features_isbn")
+    conn.execute("""
+        CREATE TABLE book_features (
+            kind TEXT NOT NULL,
+            value TEXT NOT NULL,
+            isbn13 TEXT NOT NULL,
+            PRIMARY KEY (kind, value, isbn13)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("INSERT OR IGNORE INTO book_features (kind, value, isbn13) SELECT kind, value, isbn13 FROM book_features_old")
+    conn.execute("DROP TABLE book_features_old")
+    conn.commit()
+
+
+def normalise_value(value):
+    return value.strip().lower() if isinstance(value, str) else ""
+
+
+def _as_list(value):
+    """Accepts a list, a JSON list string (books.db columns) or a single string."""
+    if isinstance(value, str):
+        try:
+            loaded = json.loads(value)
+        except json.JSONDecodeError:
+            return [value]
+        value = loaded
+    if isinstance(value, list):
+        return value
+    if isinstance(value, str):
+        return [value]
+    return []
+
+
+def features_from_analysis(llm_analysis, authors=None):
+    """Returns the set of (kind, value) features for an LLM analysis dict plus the book's authors."""
+    features = set()
+    if llm_analysis:
+        for kind, analysis_key in ANALYSIS_FEATURE_KEYS.items():
+            for value in _as_list(llm_analysis.get(analysis_key)):
+                normalised = normalise_value(value)
+                if normalised:
+                    features.add((kind, normalised))
+    for author in _as_list(authors):
+        normalised = normalise_value(author)
+        if normalised:
+            features.add(('author', normalised))
+    return features
+
+
+def features_from_db_row(row):
+    """Features for a books row (llm_* columns hold JSON list strings or plain strings)."""
+    return features_from_analysis({
+        'genre': row['llm_genre'],
+        'tone': row['llm_tone'],
+        'themes': row['llm_themes'],
+        'setting_period': row['llm_setting_period'],
+        'setting_location': row['llm_setting_location'],
+        'target_audience': row['llm_target_audience'],
+    }, row['authors'])
+
+
+def replace_book_features(conn, features_by_isbn):
+    """
+    Replaces the indexed features of each ISBN in `features_by_isbn` (isbn -> set of
+    (kind, value)). Runs inside the caller's transaction; the caller commits.
+    """
+    if not features_by_isbn:
+        return
+    conn.executemany("DELETE FROM book_features WHERE isbn13 = ?", [(isbn,) for isbn in features_by_isbn])
+    conn.executemany(
+        "INSERT OR IGNORE INTO book_features (isbn13, kind, value) VALUES (?, ?, ?)",
+        [(isbn, kind, value) for isbn, features in features_by_isbn.items() for kind, value in features]
+    )
+
+
+def index_analyses(conn, rows):
+    """
+    Indexes a batch of (isbn, llm_analysis) pairs, looking the authors up in books.
+    Used by the enrichment writers, which only carry the analysis.
+    """
+    if not rows:
+        return
+    isbns = [isbn for isbn, _ in rows]
+    authors_by_isbn = {}
+    for i in range(0, len(isbns), 500):
+        chunk = isbns[i:i + 500]
+        placeholders = ','.join('?' for _ in chunk)
+        for isbn, authors in conn.execute(f"SELECT isbn13, authors FROM books WHERE isbn13 IN ({placeholders})", chunk):
+            authors_by_isbn[isbn] = authors
+    replace_book_features(conn, {
+        isbn: features_from_analysis(llm_analysis, authors_by_isbn.get(isbn))
+        for isbn, llm_analysis in rows
+    })
+
+
+def rebuild_feature_index(db_path=DB_FILE_PATH, batch_size=5000):
+    """Rebuilds book_features from every enriched row of books."""
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    ensure_schema(conn)
+    conn.execute("DELETE FROM book_features")
+
+    read_cursor = conn.cursor()
+    read_cursor.execute("""
+        SELECT isbn13, authors, llm_genre, llm_themes, llm_tone,
+               llm_setting_period, llm_setting_location, llm_target_audience
+        FROM books
+        WHERE llm_themes IS NOT NULL AND llm_themes != '[]'
+    """)
+    indexed = 0
+    while True:
+        batch = read_cursor.fetchmany(batch_size)
+        if not batch:
+            break
+        conn.executemany(
+            "INSERT OR IGNORE INTO book_features (isbn13, kind, value) VALUES (?, ?, ?)",
+            [(row['isbn13'], kind, value) for row in batch for kind, value in features_from_db_row(row)]
+        )
+        indexed += len(batch)
+        print(f"Indexed {indexed} books...")
+    conn.commit()
+    conn.close()
+    print(f"Feature index rebuilt for {indexed} books.")
+    return indexed
+
+
+def profile_features(user_profile):
+    """The (kind, value) features a profile is scored on, from its top-N lists and read authors."""
+    features = set()
+    for kind, profile_key in PROFILE_FEATURE_KEYS.items():
+        for value in user_profile.get(profile_key) or []:
+            normalised = normalise_value(value)
+            if normalised:
+                features.add((kind, normalised))
+    return features
+
+
+# Candidate retrieval: the profile's features and the excluded ISBNs are loaded into
+# per-connection temp tables, and one query joins them against the clustered
+# book_features key. CROSS JOIN pins the small profile table as the outer loop (SQLite
+# otherwise may prefer scanning book_features in isbn13 order for the GROUP BY).
+# Author matches count once however many of a book's authors match.
+CANDIDATE_QUERY = """
+    SELECT bf.isbn13,
+           SUM(CASE WHEN pf.kind != 'author' THEN pf.weight ELSE 0 END)
+             + MAX(CASE WHEN pf.kind = 'author' THEN pf.weight ELSE 0 END) AS score
+    FROM temp.profile_features AS pf
+    CROSS JOIN book_features AS bf ON bf.kind = pf.kind AND bf.value = pf.value
+    WHERE NOT EXISTS (SELECT 1 FROM temp.excluded_isbns AS ex WHERE ex.isbn13 = bf.isbn13)
+    GROUP BY bf.isbn13
+    ORDER BY score DESC, bf.isbn13
+    LIMIT ?
+"""
+
+
+def _load_query_tables(conn, user_profile, exclude_isbns):
+    conn.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS profile_features (
+            kind TEXT NOT NULL, value TEXT NOT NULL, weight INTEGER NOT NULL, PRIMARY KEY (kind, value)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS excluded_isbns (isbn13 TEXT PRIMARY KEY) WITHOUT ROWID")
+    conn.execute("DELETE FROM temp.profile_features")
+    conn.execute("DELETE FROM temp.excluded_isbns")
+    conn.executemany("INSERT INTO temp.profile_features (kind, value, weight) VALUES (?, ?, ?)",
+                     [(kind, value, FEATURE_WEIGHTS[kind]) for kind, value in profile_features(user_profile)])
+    conn.executemany("INSERT OR IGNORE INTO temp.excluded_isbns (isbn13) VALUES (?)",
+                     [(isbn,) for isbn in exclude_isbns])
+
+
+def score_candidates(conn, user_profile, exclude_isbns=(), top_n=10):
+    """
+    Scores every indexed book sharing at least one feature with the profile by summing
+    FEATURE_WEIGHTS over the matched features, entirely inside SQLite.
+    Returns [(isbn13, score), ...] for the top_n highest scores.
+    """
+    _load_query_tables(conn, user_profile, exclude_isbns)
+    return [(isbn, score) for isbn, score in conn.execute(CANDIDATE_QUERY, (top_n,))]
+
+
+def explain_candidate_query(conn):
+    """EXPLAIN QUERY PLAN detail lines for CANDIDATE_QUERY."""
+    _load_query_tables(conn, {}, ())
+    return [row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {CANDIDATE_QUERY}", (10,))]
+
+
+def full_scans_in_plan(plan_details):
+    """Plan lines that scan a catalogue table (book_features or books) instead of searching an index."""
+    return [detail for detail in plan_details
+            if detail.startswith('SCAN') and ('book_features' in detail or ' bf' in detail or 'books' in detail)]
+
+
+def check_query_plan(db_path=DB_FILE_PATH):
+    """Prints the candidate query plan; returns False if it full-scans a catalogue table."""
+    conn = sqlite3.connect(db_path)
+    ensure_schema(conn)
+    plan = explain_candidate_query(conn)
+    conn.close()
+    for detail in plan:
+        print(f"  {detail}")
+    scans = full_scans_in_plan(plan)
+    if scans:
+        print(f"Full scan(s) in candidate query: {scans}")
+        return False
+    print("Candidate query uses indexed lookups only.")
+    return True
+
+
+def fetch_book_summaries(conn, isbns):
+    """isbn -> {'title', 'authors'} for the given ISBNs."""
+    summaries = {}
+    for i in range(0, len(isbns), 500):
+        chunk = list(isbns[i:i + 500])
+        placeholders = ','.join('?' for _ in chunk)
+        for isbn, title, authors in conn.execute(
+                f"SELECT isbn13, title, authors FROM books WHERE isbn13 IN ({placeholders})", chunk):
+            try:
+                authors_list = json.loads(authors or "[]")
+            except json.JSONDecodeError:
+                authors_list = []
+            summaries[isbn] = {'title': title, 'authors': authors_list}
+    return summaries
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['rebuild', 'explain'])
+    parser.add_argument('--db', default=DB_FILE_PATH)
+    args = parser.parse_args()
+    if args.command == 'rebuild':
+        rebuild_feature_index(args.db)
+    elif args.command == 'explain':
+        sys.exit(0 if check_query_plan(args.db) else 1)
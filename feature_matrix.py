@@ -0,0 +1,254 @@
+"""
+Vectorised recommendation scoring over the whole enriched catalogue.
+
+Every enriched book in `books` becomes a row of a sparse multi-hot CSR matrix
+whose columns are the genre/tone/theme/period/location/audience/author vocabulary.
+A user profile's weighted counters become a dense weight vector over the same
+columns, so scoring the entire catalogue is one sparse mat-vec, and the top-N comes
+from np.argpartition instead of a full sort.
+
+The matrix is stored on disk as a feature store: one directory per build holding
+the raw CSR arrays (.npy), the row ISBNs and a vocabulary text file, plus a CURRENT
+file naming the live build. Processes np.load the arrays with mmap_mode='r', so
+every RQ worker and Flask process shares one page-cache copy, startup doesn't
+read the arrays in, and a rebuild is picked up on the next query without restarting.
+
+Requires numpy and scipy. Usage:
+    python feature_matrix.py build    # export a new build of data/feature_store from books.db
+    python feature_matrix.py info     # show the live build
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+import numpy as np
+from scipy import sparse
+
+import feature_index
+from user_profiles import PROFILE_FEATURES
+
+DB_FILE_PATH = 'data/books.db'
+FEATURE_STORE_DIR = os.environ.get('FEATURE_STORE_DIR', 'data/feature_store')
+CURRENT_POINTER_FILE = 'CURRENT'
+VOCAB_FILE = 'vocab.txt'
+KEEP_VERSIONS = 2 # older builds are removed; processes still mapping them keep their open files
+BUILD_FETCH_SIZE = 5000
+
+# generate_user_profile counter for each feature kind
+PROFILE_WEIGHT_KEYS = {kind: weighted_key for kind, (_, _, _, weighted_key) in PROFILE_FEATURES.items()}
+
+
+def vocab_term(kind, value):
+    return f"{kind}\t{value}"
+
+
+class FeatureMatrixEngine:
+    """
+    Holds the catalogue matrix (books x features), its ISBN row labels and column
+    vocabulary. Rows are sorted by ISBN so exclusions are a binary search over the
+    (possibly memory-mapped) ISBN array rather than a per-process dict.
+    """
+
+    def __init__(self, matrix, isbns, vocab, version=None):
+        self.matrix = matrix
+        self.isbns = isbns
+        self.vocab = list(vocab)
+        self.term_to_column = {term: i for i, term in enumerate(self.vocab)}
+        self.version = version
+
+    @classmethod
+    def build_from_db(cls, db_path=DB_FILE_PATH):
+        """Exports the llm_* and authors columns of every enriched book (see populate_db.setup_database)."""
+        conn = sqlite3.connect(db_path)
+        conn.row_factory = sqlite3.Row
+        cursor = conn.execute("""
+            SELECT isbn13, authors, llm_genre, llm_themes, llm_tone,
+                   llm_setting_period, llm_setting_location, llm_target_audience
+            FROM books
+            WHERE llm_themes IS NOT NULL AND llm_themes != '[]'
+            ORDER BY isbn13
+        """)
+        isbns = []
+        indptr = [0]
+        columns = []
+        term_to_column = {}
+        while True:
+            batch = cursor.fetchmany(BUILD_FETCH_SIZE)
+            if not batch:
+                break
+            for row in batch:
+                isbns.append(row['isbn13'])
+                for kind, value in feature_index.features_from_db_row(row):
+                    term = vocab_term(kind, value.replace('\n', ' '))
+                    columns.append(term_to_column.setdefault(term, len(term_to_column)))
+                indptr.append(len(columns))
+        conn.close()
+
+        # Sorted vocabulary, so the column numbering doesn't depend on row order
+        vocab = sorted(term_to_column)
+        remap = np.empty(len(vocab), dtype=np.int32)
+        remap[[term_to_column[term] for term in vocab]] = np.arange(len(vocab), dtype=np.int32)
+        index_dtype = np.int32 if len(columns) < np.iinfo(np.int32).max else np.int64
+        indices = remap[np.asarray(columns, dtype=np.int32)].astype(index_dtype) if columns else np.empty(0, dtype=index_dtype)
+        matrix = sparse.csr_matrix((np.ones(len(columns), dtype=np.float32), indices, np.asarray(indptr, dtype=index_dtype)),
+                                   shape=(len(isbns), len(vocab)))
+        return cls(matrix, np.asarray(isbns, dtype=str), vocab)
+
+    def save(self, store_dir=FEATURE_STORE_DIR):
+        """
+        Writes a new build directory and then repoints CURRENT at it. Readers only
+        ever follow CURRENT to a complete build. Returns the new version name.
+        """
+        os.makedirs(store_dir, exist_ok=True)
+        # Versions are millisecond stamps; two builds in the same millisecond take the next free one
+        stamp = time.time_ns() // 1_000_000
+        while True:
+            version = f"v{stamp}"
+            tmp_dir = os.path.join(store_dir, f".{version}.tmp")
+            if not os.path.exists(os.path.join(store_dir, version)):
+                try:
+                    os.makedirs(tmp_dir)
+                    break
+                except FileExistsError:
+                    pass
+            stamp += 1
+        np.save(os.path.join(tmp_dir, 'indptr.npy'), self.matrix.indptr)
+        np.save(os.path.join(tmp_dir, 'indices.npy'), self.matrix.indices)
+        np.save(os.path.join(tmp_dir, 'data.npy'), self.matrix.data)
+        np.save(os.path.join(tmp_dir, 'isbns.npy'), np.asarray(self.isbns, dtype=str))
+        with open(os.path.join(tmp_dir, VOCAB_FILE), 'w', encoding='utf-8') as f:
+            f.write('\n'.join(self.vocab))
+        os.replace(tmp_dir, os.path.join(store_dir, version))
+
+        pointer_tmp = os.path.join(store_dir, f"{CURRENT_POINTER_FILE}.tmp")
+        with open(pointer_tmp, 'w') as f:
+            f.write(version)
+        os.replace(pointer_tmp, os.path.join(store_dir, CURRENT_POINTER_FILE))
+        self.version = version
+        _prune_old_versions(store_dir, keep=KEEP_VERSIONS)
+        return version
+
+    @classmethod
+    def load(cls, store_dir=FEATURE_STORE_DIR, version=None):
+        """Maps a build (the live one by default) read-only; nothing but the vocabulary is read eagerly."""
+        version = version or current_version(store_dir)
+        version_dir = os.path.join(store_dir, version)
+        arrays = {name: np.load(os.path.join(version_dir, f"{name}.npy"), mmap_mode='r')
+                  for name in ('indptr', 'indices', 'data', 'isbns')}
+        with open(os.path.join(version_dir, VOCAB_FILE), encoding='utf-8') as f:
+            content = f.read()
+        vocab = content.split('\n') if content else []
+        # copy=False keeps scipy pointing at the mapped arrays instead of private copies
+        matrix = sparse.csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']),
+                                   shape=(len(arrays['isbns']), len(vocab)), copy=False)
+        return cls(matrix, arrays['isbns'], vocab, version=version)
+
+    def rows_for_isbns(self, isbns):
+        """Row numbers of the given ISBNs that are in the catalogue."""
+        if not isbns or len(self.isbns) == 0:
+            return np.empty(0, dtype=np.int64)
+        wanted = np.asarray(list(isbns), dtype=str)
+        positions = np.searchsorted(self.isbns, wanted)
+        positions = np.minimum(positions, len(self.isbns) - 1)
+        return positions[self.isbns[positions] == wanted]
+
+    def profile_weight_vector(self, user_profile):
+        """
+        Dense weight per column from the profile's weighted counters. Each kind's
+        counter is scaled so its strongest feature gets the kind's FEATURE_WEIGHTS
+        weight; read authors get the author boost.
+        """
+        weights = np.zeros(len(self.vocab), dtype=np.float32)
+        for kind, profile_key in PROFILE_WEIGHT_KEYS.items():
+            counter = user_profile.get(profile_key) or {}
+            if not counter:
+                continue
+            max_weight = max(counter.values()) or 1.0
+            for value, weight in counter.items():
+                column = self.term_to_column.get(vocab_term(kind, feature_index.normalise_value(value)))
+                if column is not None:
+                    weights[column] += feature_index.FEATURE_WEIGHTS[kind] * (weight / max_weight)
+        for author in user_profile.get('read_authors') or []:
+            column = self.term_to_column.get(vocab_term('author', feature_index.normalise_value(author)))
+            if column is not None:
+                weights[column] = feature_index.FEATURE_WEIGHTS['author']
+        return weights
+
+    def score(self, user_profile, exclude_isbns=(), top_n=10):
+        """Returns [(isbn13, score), ...] for the top_n books in the whole catalogue (scores > 0 only)."""
+        if self.matrix.shape[0] == 0 or top_n <= 0:
+            return []
+        scores = self.matrix @ self.profile_weight_vector(user_profile)
+        scores[self.rows_for_isbns(exclude_isbns)] = -np.inf
+
+        top_n = min(top_n, len(scores))
+        top_rows = np.argpartition(-scores, top_n - 1)[:top_n]
+        top_rows = top_rows[np.argsort(-scores[top_rows], kind='stable')]
+        return [(str(self.isbns[row]), float(scores[row])) for row in top_rows if scores[row] > 0]
+
+
+def current_version(store_dir=FEATURE_STORE_DIR):
+    """Name of the live build. Raises FileNotFoundError if nothing has been built yet."""
+    with open(os.path.join(store_dir, CURRENT_POINTER_FILE)) as f:
+        return f.read().strip()
+
+
+def _prune_old_versions(store_dir, keep=KEEP_VERSIONS):
+    versions = sorted((name for name in os.listdir(store_dir) if name.startswith('v')),
+                      key=lambda name: int(name[1:]))
+    for name in versions[:-keep]:
+        shutil.rmtree(os.path.join(store_dir, name), ignore_errors=True)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine(store_dir=FEATURE_STORE_DIR):
+    """
+    Process-wide engine over the live build. Checking for a new build is one small
+    file read; switching to it is a fresh set of mmaps. Raises FileNotFoundError if
+    nothing has been built.
+    """
+    global _engine
+    version = current_version(store_dir)
+    if _engine is None or _engine.version != version:
+        with _engine_lock:
+            if _engine is None or _engine.version != version:
+                start = time.perf_counter()
+                _engine = FeatureMatrixEngine.load(store_dir, version)
+                print(f"Mapped feature store {version} {_engine.matrix.shape} in {time.perf_counter() - start:.3f}s")
+    return _engine
+
+
+def build_feature_matrix(db_path=DB_FILE_PATH, store_dir=FEATURE_STORE_DIR):
+    start = time.perf_counter()
+    engine = FeatureMatrixEngine.build_from_db(db_path)
+    version = engine.save(store_dir)
+    print(f"Built feature store {version} {engine.matrix.shape} ({engine.matrix.nnz} features) "
+          f"in {time.perf_counter() - start:.2f}s -> {os.path.join(store_dir, version)}")
+    return engine
+
+
+def show_info(store_dir=FEATURE_STORE_DIR):
+    engine = FeatureMatrixEngine.load(store_dir)
+    version_dir = os.path.join(store_dir, engine.version)
+    size = sum(os.path.getsize(os.path.join(version_dir, name)) for name in os.listdir(version_dir))
+    print(f"Live build: {engine.version} ({version_dir})")
+    print(f"Books: {engine.matrix.shape[0]}, vocabulary: {engine.matrix.shape[1]}, features: {engine.matrix.nnz}")
+    print(f"On disk: {size / (1024 * 1024):.1f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['build', 'info'])
+    parser.add_argument('--db', default=DB_FILE_PATH)
+    parser.add_argument('--store', default=FEATURE_STORE_DIR)
+    args = parser.parse_args()
+    if args.command == 'build':
+        build_feature_matrix(args.db, args.store)
+    elif args.command == 'info':
+        show_info(args.store)
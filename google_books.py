@@ -0,0 +1,293 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from redis import RedisError
+from requests.adapters import HTTPAdapter
+
+from user_profiles import decode
+
+# --- Configuration ---
+GOOGLE_BOOKS_API_URL = os.environ.get('GOOGLE_BOOKS_API_URL', 'https://www.googleapis.com/books/v1/volumes')
+REQUEST_TIMEOUT = 10
+SEARCH_MAX_WORKERS = int(os.environ.get('GOOGLE_BOOKS_MAX_WORKERS', 8))
+PER_HOST_CONCURRENCY = int(os.environ.get('GOOGLE_BOOKS_PER_HOST_CONCURRENCY', 8))
+MAX_RETRIES = 3
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 8.0
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+CACHE_KEY_PREFIX = 'gb_cache'
+CACHE_STATS_KEY = f'{CACHE_KEY_PREFIX}:stats'
+CACHE_TTL_SECONDS = int(os.environ.get('GOOGLE_BOOKS_CACHE_TTL', 3600 * 24 * 7)) # 7 days
+NEGATIVE_CACHE_TTL_SECONDS = int(os.environ.get('GOOGLE_BOOKS_NEGATIVE_CACHE_TTL', 3600)) # "not found" results
+
+# One pooled session per process so repeated searches reuse TCP/TLS connections
+_session = None
+_session_lock = threading.Lock()
+
+_host_semaphores = {}
+_host_semaphores_lock = threading.Lock()
+
+
+def get_session():
+    """Returns the process-wide requests.Session used for Google Books calls."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(SEARCH_MAX_WORKERS, PER_HOST_CONCURRENCY))
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
+
+
+def _host_semaphore(url):
+    host = urlsplit(url).netloc
+    with _host_semaphores_lock:
+        semaphore = _host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = threading.BoundedSemaphore(PER_HOST_CONCURRENCY)
+            _host_semaphores[host] = semaphore
+    return semaphore
+
+
+def _retry_after_seconds(response):
+    """Parses a Retry-After header (seconds or HTTP date), returns None if absent/invalid."""
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def get_with_retry(url, timeout=REQUEST_TIMEOUT, max_retries=MAX_RETRIES):
+    """
+    GETs a URL through the shared session, holding the per-host concurrency slot
+    only while the request is in flight. Retries 429/5xx responses and connection
+    errors with exponential backoff (honouring Retry-After when sent).
+
+    Returns the final requests.Response; raises requests.exceptions.RequestException
+    if the last attempt fails.
+    """
+    session = get_session()
+    semaphore = _host_semaphore(url)
+    attempt = 0
+    while True:
+        try:
+            with semaphore:
+                response = session.get(url, timeout=timeout)
+            if response.status_code not in RETRY_STATUS_CODES or attempt >= max_retries:
+                response.raise_for_status()
+                return response
+            delay = _retry_after_seconds(response)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            if attempt >= max_retries:
+                raise
+            delay = None
+
+        if delay is None:
+            delay = BACKOFF_BASE_SECONDS * (2 ** attempt)
+        delay = min(delay, BACKOFF_MAX_SECONDS)
+        attempt += 1
+        print(f"   - Retrying {url} in {delay:.2f}s (attempt {attempt}/{max_retries})")
+        time.sleep(delay)
+
+
+# --- Response cache (Redis) ---
+def normalise_query(text):
+    """Case-folds and collapses whitespace so trivially different inputs share a cache entry."""
+    return " ".join(str(text).casefold().split())
+
+
+def search_cache_key(title):
+    digest = hashlib.sha1(normalise_query(title).encode('utf-8')).hexdigest()
+    return f"{CACHE_KEY_PREFIX}:search:{digest}"
+
+
+def volume_cache_key(isbn):
+    cleaned_isbn = "".join(ch for ch in str(isbn) if ch.isalnum()).upper()
+    return f"{CACHE_KEY_PREFIX}:volume:{cleaned_isbn}"
+
+
+def _record_cache_event(redis_conn, kind, event):
+    try:
+        redis_conn.hincrby(CACHE_STATS_KEY, f"{kind}_{event}", 1)
+    except RedisError:
+        pass
+
+
+def cache_get(redis_conn, cache_key, kind):
+    """Returns the cached value for a key, or None on a miss (or if Redis is unavailable)."""
+    if redis_conn is None:
+        return None
+    try:
+        cached_data = redis_conn.get(cache_key)
+    except RedisError as e:
+        print(f"   - Redis error reading {cache_key}: {e}. Skipping cache.")
+        return None
+
+    if cached_data is None:
+        _record_cache_event(redis_conn, kind, 'misses')
+        return None
+    try:
+        value = json.loads(cached_data)
+    except (json.JSONDecodeError, TypeError):
+        _record_cache_event(redis_conn, kind, 'misses')
+        return None
+    _record_cache_event(redis_conn, kind, 'hits')
+    return value
+
+
+def cache_set(redis_conn, cache_key, value, negative=False):
+    if redis_conn is None:
+        return
+    ttl = NEGATIVE_CACHE_TTL_SECONDS if negative else CACHE_TTL_SECONDS
+    try:
+        redis_conn.set(cache_key, json.dumps(value), ex=ttl)
+    except RedisError as e:
+        print(f"   - Redis error writing {cache_key}: {e}")
+
+
+def get_cache_stats(redis_conn):
+    """Returns hit/miss counters and hit rates for the search and volume caches."""
+    raw_stats = redis_conn.hgetall(CACHE_STATS_KEY) or {}
+    counters = {}
+    for field, count in raw_stats.items():
+        counters[decode(field)] = int(count)
+
+    stats = {}
+    for kind in ('search', 'volume'):
+        hits = counters.get(f"{kind}_hits", 0)
+        misses = counters.get(f"{kind}_misses", 0)
+        stats[kind] = {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / (hits + misses) if hits + misses else None
+        }
+    return stats
+
+
+def build_search_url(title):
+    return f"{GOOGLE_BOOKS_API_URL}?q=intitle:{requests.utils.quote(title)}&langRestrict=en&maxResults=5&projection-lite"
+
+
+def parse_search_matches(data):
+    """Extracts title/authors/ISBN matches from a Google Books search response."""
+    possible_matches = []
+    if data.get("totalItems", 0) > 0 and "items" in data:
+        for item in data["items"]:
+            volume_info = item.get("volumeInfo", {})
+            title = volume_info.get("title")
+            authors = volume_info.get("authors", ["Unknown Author"])
+            isbn13 = None
+            isbn10 = None
+
+            identifiers = volume_info.get("industryIdentifiers", [])
+            for identifier in identifiers:
+                if identifier.get("type") == "ISBN_13":
+                    isbn13 = identifier.get("identifier")
+                elif identifier.get("type") == "ISBN_10":
+                    isbn10 = identifier.get("identifier")
+
+            if isbn13 or isbn10:
+                possible_matches.append({
+                    "match": {
+                        "title": title,
+                        "authors": authors,
+                        "isbn": isbn13 if isbn13 else isbn10
+                    },
+                })
+    return possible_matches
+
+
+def search_title(title, redis_conn=None):
+    """Searches Google Books for a single (already stripped) title. Never raises."""
+    print(f" - Searching for: '{title}'")
+    cache_key = search_cache_key(title)
+    cached = cache_get(redis_conn, cache_key, 'search')
+    if cached is not None:
+        return cached
+
+    try:
+        response = get_with_retry(build_search_url(title))
+        possible_matches = parse_search_matches(response.json())
+    except requests.exceptions.RequestException as e:
+        print(f"   - Error searching Google Books for '{title}': {e}")
+        return []
+    except Exception as e:
+        print(f"   - Unexpected error processing results for '{title}': {e}")
+        return []
+
+    cache_set(redis_conn, cache_key, possible_matches, negative=not possible_matches)
+    return possible_matches
+
+
+def search_titles(titles, max_workers=SEARCH_MAX_WORKERS, redis_conn=None):
+    """
+    Searches Google Books for every title, returning a list of match lists in the
+    same order as `titles`. max_workers=1 keeps the old one-at-a-time behaviour.
+    """
+    if max_workers <= 1 or len(titles) <= 1:
+        return [search_title(title, redis_conn) for title in titles]
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(titles))) as executor:
+        # executor.map yields in submission order regardless of completion order
+        return list(executor.map(lambda title: search_title(title, redis_conn), titles))
+
+
+def build_volume_url(isbn):
+    return f"{GOOGLE_BOOKS_API_URL}?q=isbn:{isbn}&langRestrict=en"
+
+
+def parse_volume_details(isbn, data):
+    """Builds the book detail dict for an ISBN lookup response, or {'not_found': True}."""
+    if 'items' in data and data['items']:
+        book_info = data['items'][0]['volumeInfo']
+        return {
+            'isbn': isbn,
+            'title': book_info.get('title'),
+            'authors': book_info.get('authors', []),
+            'description': book_info.get('description'),
+            'categories': book_info.get('categories', []),
+            'imageLinks': book_info.get('imageLinks', {}).get('thumbnail'),
+            'averageRating': book_info.get('averageRating'),
+            'ratingsCount': book_info.get('ratingsCount'),
+            'pageCount': book_info.get('pageCount'),
+        }
+    return {'not_found': True}
+
+
+def fetch_volume_details(isbn, redis_conn=None):
+    """Looks up a single ISBN on Google Books. Never raises; errors come back as {'error': ...}."""
+    cache_key = volume_cache_key(isbn)
+    cached = cache_get(redis_conn, cache_key, 'volume')
+    if cached is not None:
+        return cached
+
+    try:
+        response = get_with_retry(build_volume_url(isbn))
+        details = parse_volume_details(isbn, response.json())
+    except requests.exceptions.RequestException as e:
+        return {'error': str(e)}
+    except Exception as e:
+        print(f"   - Unexpected error processing volume data for ISBN {isbn}: {e}")
+        return {'error': str(e)}
+
+    # Errors are never cached; "not found" is, but only briefly
+    cache_set(redis_conn, cache_key, details, negative=bool(details.get('not_found')))
+    return details
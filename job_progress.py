@@ -0,0 +1,35 @@
+import json
+
+from user_profiles import decode
+
+# Per-job Redis stream of progress events, read by the /results/<job_id>/stream SSE endpoint
+PROGRESS_STREAM_PREFIX = 'job_progress'
+PROGRESS_STREAM_TTL_SECONDS = 3600
+PROGRESS_STREAM_MAXLEN = 1000
+
+
+def progress_stream_key(job_id):
+    return f"{PROGRESS_STREAM_PREFIX}:{job_id}"
+
+
+def publish_event(redis_conn, job_id, event, data):
+    """Appends an event ('book', 'done', 'failed', ...) with a JSON payload to the job's stream."""
+    stream_key = progress_stream_key(job_id)
+    pipe = redis_conn.pipeline()
+    pipe.xadd(stream_key, {'event': event, 'data': json.dumps(data)}, maxlen=PROGRESS_STREAM_MAXLEN, approximate=True)
+    pipe.expire(stream_key, PROGRESS_STREAM_TTL_SECONDS)
+    pipe.execute()
+
+
+def read_events(redis_conn, job_id, last_id='0', block_ms=15000):
+    """
+    Blocks up to block_ms for events after last_id. Returns a list of
+    (entry_id, event, data_json) string tuples, empty on timeout.
+    """
+    response = redis_conn.xread({progress_stream_key(job_id): last_id}, block=block_ms)
+    events = []
+    for _, entries in response or []:
+        for entry_id, fields in entries:
+            decoded = {decode(k): decode(v) for k, v in fields.items()}
+            events.append((decode(entry_id), decoded.get('event'), decoded.get('data')))
+    return events
@@ -0,0 +1,229 @@
+import base64
+import hashlib
+import json
+import os
+import time
+import uuid
+import zlib
+
+from redis import RedisError
+
+import ollama_client
+from user_profiles import decode
+
+# --- Configuration ---
+CACHE_KEY_PREFIX = 'llm_cache'
+CACHE_FORMAT_VERSION = 'v2' # bump when the stored value format changes
+CACHE_STATS_KEY = 'llm_cache_stats' # deliberately outside the llm_cache:* namespace so purges never touch it
+CACHE_TTL_SECONDS = int(os.environ.get('LLM_CACHE_TTL', 3600 * 24 * 90)) # 90 days; 0 disables expiry
+COMPRESSION_LEVEL = 6
+# Under memory pressure Redis then evicts least recently used keys *with a TTL*. That is
+# not only the caches: RQ job results, job_progress streams, rec_results pages and
+# user_profile keys all carry TTLs too, so on a shared instance they can be evicted.
+# Only queued jobs and other TTL-less keys are safe. Apply it to a Redis instance that
+# holds nothing but caches, or size maxmemory so eviction never happens in practice.
+RECOMMENDED_EVICTION_POLICY = 'volatile-lru'
+
+# --- Single-flight (request coalescing) ---
+INFLIGHT_KEY_PREFIX = 'llm_inflight'
+INFLIGHT_DONE_CHANNEL_PREFIX = 'llm_inflight_done'
+INFLIGHT_LOCK_TTL_SECONDS = ollama_client.MAX_CALL_SECONDS + 30 # outlives the longest Ollama call
+INFLIGHT_CHECK_INTERVAL_SECONDS = 2.0
+
+_RELEASE_INFLIGHT_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    redis.call('del', KEYS[1])
+    redis.call('publish', ARGV[2], '1')
+    return 1
+end
+return 0
+"""
+
+
+def prompt_fingerprint(model_name, prompt_template):
+    """Short stable hash of the model name and prompt template, so changing either invalidates the cache."""
+    digest = hashlib.sha256(f"{model_name}\n{prompt_template}".encode('utf-8')).hexdigest()
+    return digest[:12]
+
+
+def cache_namespace(model_name, prompt_template):
+    """Key prefix shared by every entry produced by this model + prompt combination."""
+    safe_model = "".join(ch if ch.isalnum() or ch in '.-' else '_' for ch in model_name)
+    return f"{CACHE_KEY_PREFIX}:{CACHE_FORMAT_VERSION}:{safe_model}:{prompt_fingerprint(model_name, prompt_template)}"
+
+
+def cache_key(isbn, model_name, prompt_template):
+    return f"{cache_namespace(model_name, prompt_template)}:{isbn}"
+
+
+def encode_value(llm_results):
+    """Compact JSON -> zlib -> base85 text, so it also round-trips on decode_responses=True connections."""
+    raw = json.dumps(llm_results, separators=(',', ':')).encode('utf-8')
+    return base64.b85encode(zlib.compress(raw, COMPRESSION_LEVEL)).decode('ascii')
+
+
+def decode_value(stored_value):
+    if isinstance(stored_value, bytes):
+        stored_value = stored_value.decode('ascii')
+    return json.loads(zlib.decompress(base64.b85decode(stored_value)))
+
+
+def record_event(redis_conn, event, amount=1):
+    try:
+        redis_conn.hincrby(CACHE_STATS_KEY, event, amount)
+    except RedisError:
+        pass
+
+
+def get_cached_analysis(redis_conn, key, record=True):
+    """
+    Returns the cached analysis for a key, or None on a miss. Corrupt entries count as
+    misses. Redis errors propagate so callers keep their existing error handling.
+    """
+    stored_value = redis_conn.get(key)
+    if stored_value is None:
+        if record:
+            record_event(redis_conn, 'misses')
+        return None
+    try:
+        llm_results = decode_value(stored_value)
+    except (ValueError, zlib.error, UnicodeDecodeError):
+        print(f"Warning: Could not decode cached LLM analysis at {key}. Fetching fresh.")
+        if record:
+            record_event(redis_conn, 'misses')
+        return None
+    if record:
+        record_event(redis_conn, 'hits')
+    return llm_results
+
+
+def get_cached_analyses(redis_conn, keys):
+    """
+    One MGET for many keys. Returns a list aligned with `keys` holding the analysis or
+    None (miss or corrupt entry), and records the hits/misses in one go.
+    """
+    if not keys:
+        return []
+    results = []
+    for key, stored_value in zip(keys, redis_conn.mget(keys)):
+        llm_results = None
+        if stored_value is not None:
+            try:
+                llm_results = decode_value(stored_value)
+            except (ValueError, zlib.error, UnicodeDecodeError):
+                print(f"Warning: Could not decode cached LLM analysis at {key}. Fetching fresh.")
+        results.append(llm_results)
+    hits = sum(1 for llm_results in results if llm_results is not None)
+    if hits:
+        record_event(redis_conn, 'hits', hits)
+    if len(results) - hits:
+        record_event(redis_conn, 'misses', len(results) - hits)
+    return results
+
+
+def store_analysis(redis_conn, key, llm_results, ttl=CACHE_TTL_SECONDS):
+    redis_conn.set(key, encode_value(llm_results), ex=ttl or None)
+
+
+def _inflight_key(key):
+    return f"{INFLIGHT_KEY_PREFIX}:{key}"
+
+
+def _inflight_channel(key):
+    return f"{INFLIGHT_DONE_CHANNEL_PREFIX}:{key}"
+
+
+def acquire_inflight(redis_conn, key, ttl=INFLIGHT_LOCK_TTL_SECONDS):
+    """Marks `key` as being computed. Returns an ownership token, or None if another worker already is."""
+    token = uuid.uuid4().hex
+    if redis_conn.set(_inflight_key(key), token, nx=True, ex=ttl):
+        return token
+    return None
+
+
+def release_inflight(redis_conn, key, token):
+    """Drops our in-flight marker (only if we still own it) and wakes any waiters."""
+    try:
+        redis_conn.eval(_RELEASE_INFLIGHT_SCRIPT, 1, _inflight_key(key), token, _inflight_channel(key))
+    except RedisError as e:
+        print(f"Warning: Could not release in-flight marker for {key}: {e}")
+
+
+def wait_for_inflight(redis_conn, key, timeout=INFLIGHT_LOCK_TTL_SECONDS):
+    """
+    Waits for the worker holding the in-flight marker to publish its result.
+    Returns the cached analysis, or None if the owner finished without caching one,
+    died (its marker expired), or `timeout` passed.
+    """
+    pubsub = redis_conn.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(_inflight_channel(key))
+    deadline = time.monotonic() + timeout
+    try:
+        while time.monotonic() < deadline:
+            # Checked after subscribing, so a result published in between isn't missed
+            llm_results = get_cached_analysis(redis_conn, key, record=False)
+            if llm_results is not None:
+                return llm_results
+            if not redis_conn.exists(_inflight_key(key)):
+                return None
+            pubsub.get_message(timeout=INFLIGHT_CHECK_INTERVAL_SECONDS)
+        return None
+    finally:
+        pubsub.close()
+
+
+def get_llm_cache_stats(redis_conn, current_namespace, scan_count=1000):
+    """
+    Scans the llm_cache:* keyspace and reports entry counts and memory for the current
+    model/prompt version vs stale ones, along with hit/miss counters.
+    """
+    counters = {}
+    for field, value in (redis_conn.hgetall(CACHE_STATS_KEY) or {}).items():
+        counters[decode(field)] = int(value)
+
+    stats = {
+        'current_namespace': current_namespace,
+        'current_entries': 0,
+        'stale_entries': 0,
+        'current_bytes': 0,
+        'stale_bytes': 0,
+        'stale_namespaces': {},
+        **counters,
+    }
+    lookups = counters.get('hits', 0) + counters.get('misses', 0)
+    stats['hit_rate'] = counters.get('hits', 0) / lookups if lookups else None
+
+    current_prefix = f"{current_namespace}:"
+    for key in redis_conn.scan_iter(match=f"{CACHE_KEY_PREFIX}:*", count=scan_count):
+        key = decode(key)
+        try:
+            size = redis_conn.memory_usage(key) or 0
+        except RedisError:
+            size = 0
+        if key.startswith(current_prefix):
+            stats['current_entries'] += 1
+            stats['current_bytes'] += size
+        else:
+            stats['stale_entries'] += 1
+            stats['stale_bytes'] += size
+            namespace = key.rsplit(':', 1)[0]
+            stats['stale_namespaces'][namespace] = stats['stale_namespaces'].get(namespace, 0) + 1
+    return stats
+
+
+def purge_stale_entries(redis_conn, current_namespace, scan_count=1000, dry_run=False):
+    """Deletes every llm_cache:* key not in the current namespace (old models, prompts, formats, legacy keys)."""
+    current_prefix = f"{current_namespace}:"
+    deleted = 0
+    batch = []
+    for key in redis_conn.scan_iter(match=f"{CACHE_KEY_PREFIX}:*", count=scan_count):
+        key_str = decode(key)
+        if key_str.startswith(current_prefix):
+            continue
+        batch.append(key)
+        if len(batch) >= scan_count:
+            deleted += len(batch) if dry_run else redis_conn.unlink(*batch)
+            batch = []
+    if batch:
+        deleted += len(batch) if dry_run else redis_conn.unlink(*batch)
+    return deleted
@@ -0,0 +1,194 @@
+"""
+Pooled client for the local Ollama server, shared by the LLM analysis and embedding code.
+
+One requests.Session per process keeps connections to Ollama open between calls, and
+every generate request passes keep_alive so the model stays loaded in between. Requests
+also carry fixed num_ctx/num_predict options. num_ctx is the same on every request,
+because a change makes Ollama reload the model. In streaming mode the JSON is scanned
+as it arrives. Reading stops as soon as the top-level object closes, and a generation
+that stops looking like a JSON object (or that emits runs of whitespace, a known failure
+mode of format=json) is cut off at once instead of running to the timeout.
+agenerate() is the asyncio variant; it runs the same pooled call in a worker thread.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# --- Configuration ---
+OLLAMA_URL = os.environ.get('OLLAMA_URL', 'http://localhost:11434/api/generate')
+OLLAMA_KEEP_ALIVE = os.environ.get('OLLAMA_KEEP_ALIVE', '30m') # how long Ollama keeps the model loaded after a call
+OLLAMA_NUM_CTX = int(os.environ.get('OLLAMA_NUM_CTX', 4096)) # raise for large LLM_BATCH_SIZE batches
+OLLAMA_NUM_PREDICT = int(os.environ.get('OLLAMA_NUM_PREDICT', 512)) # token cap per book analysed
+OLLAMA_STREAM = os.environ.get('OLLAMA_STREAM', '1') not in ('0', 'false', 'no')
+OLLAMA_POOL_SIZE = int(os.environ.get('OLLAMA_POOL_SIZE', 8))
+CONNECT_TIMEOUT = 10
+REQUEST_TIMEOUT = 300 # whole response; streamed generations are cut off at this deadline too
+STREAM_READ_TIMEOUT = int(os.environ.get('OLLAMA_STREAM_READ_TIMEOUT', 120)) # longest gap between streamed chunks
+# Longest a generate() call can run: the deadline is checked between chunks, so it can overrun by one gap.
+# llm_cache's in-flight lock TTL is derived from this.
+MAX_CALL_SECONDS = CONNECT_TIMEOUT + REQUEST_TIMEOUT + STREAM_READ_TIMEOUT
+CHARS_PER_TOKEN = 4 # rough prompt size estimate when capping num_predict to the context window
+MIN_NUM_PREDICT = 256
+MAX_WHITESPACE_RUN = 200
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class GenerationAborted(Exception):
+    """Ollama reported an error, or a streamed generation was cut off as unusable."""
+
+
+def get_session():
+    """Returns the process-wide requests.Session used for Ollama calls."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=2, pool_maxsize=OLLAMA_POOL_SIZE)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _session = session
+    return _session
+
+
+class JsonObjectScanner:
+    """
+    Tracks nesting and string state of streamed JSON text, without parsing it, to tell
+    when the top-level object is complete or the output can no longer be one.
+    """
+    def __init__(self, max_whitespace_run=MAX_WHITESPACE_RUN):
+        self.max_whitespace_run = max_whitespace_run
+        self.depth = 0
+        self.started = False
+        self.complete = False
+        self.in_string = False
+        self.escaped = False
+        self.whitespace_run = 0
+
+    def feed(self, text):
+        """Returns True once the object has closed. Raises GenerationAborted if the text can't be the object."""
+        for char in text:
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == '\\':
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+                continue
+            if char.isspace():
+                self.whitespace_run += 1
+                if self.whitespace_run > self.max_whitespace_run:
+                    raise GenerationAborted(f"more than {self.max_whitespace_run} consecutive whitespace characters")
+                continue
+            self.whitespace_run = 0
+            if self.complete:
+                raise GenerationAborted("text after the end of the JSON object")
+            if not self.started:
+                if char != '{':
+                    raise GenerationAborted(f"output starts with {char!r}, not a JSON object")
+                self.started = True
+            if char == '"':
+                self.in_string = True
+            elif char in '{[':
+                self.depth += 1
+            elif char in '}]':
+                self.depth -= 1
+                if self.depth < 0:
+                    raise GenerationAborted("unbalanced closing bracket")
+                if self.depth == 0:
+                    self.complete = True
+        return self.complete
+
+
+def capped_num_predict(prompt, num_predict=None):
+    """The requested output budget, capped so the prompt plus the output fit in OLLAMA_NUM_CTX."""
+    num_predict = num_predict or OLLAMA_NUM_PREDICT
+    available = max(OLLAMA_NUM_CTX - len(prompt) // CHARS_PER_TOKEN, MIN_NUM_PREDICT)
+    if num_predict > available:
+        print(f"Warning: num_predict {num_predict} doesn't fit num_ctx {OLLAMA_NUM_CTX} with this prompt; "
+              f"capping it at {available}. Raise OLLAMA_NUM_CTX for large batches.")
+        return available
+    return num_predict
+
+
+def _payload(prompt, model, stream, num_predict, json_format):
+    payload = {
+        "model": model,
+        "prompt": prompt,
+        "stream": stream,
+        "keep_alive": OLLAMA_KEEP_ALIVE,
+        "options": {"num_ctx": OLLAMA_NUM_CTX, "num_predict": capped_num_predict(prompt, num_predict)},
+    }
+    if json_format:
+        payload["format"] = "json"
+    return payload
+
+
+def _read_stream(response, json_format, deadline):
+    """
+    Concatenates streamed 'response' pieces, returning early once a JSON object is
+    complete. Raises GenerationAborted once time.monotonic() passes `deadline`.
+    """
+    scanner = JsonObjectScanner() if json_format else None
+    pieces = []
+    for line in response.iter_lines():
+        if time.monotonic() > deadline:
+            raise GenerationAborted(f"generation still running after {REQUEST_TIMEOUT}s")
+        if not line:
+            continue
+        chunk = json.loads(line)
+        if chunk.get('error'):
+            raise GenerationAborted(f"Ollama error: {chunk['error']}")
+        piece = chunk.get('response', '')
+        pieces.append(piece)
+        if scanner is not None and scanner.feed(piece):
+            break # closing the response makes Ollama stop generating
+        if chunk.get('done'):
+            break
+    return ''.join(pieces)
+
+
+def generate(prompt, model, stream=OLLAMA_STREAM, num_predict=None, json_format=True):
+    """
+    Runs one generation and returns the model's output text. num_predict overrides the
+    per-request token cap (e.g. scaled by the number of books in a batched prompt); it
+    is capped to what fits in OLLAMA_NUM_CTX. Streamed or not, a call is abandoned
+    after REQUEST_TIMEOUT seconds.
+    Request errors propagate as requests exceptions; Ollama errors and aborted streams
+    raise GenerationAborted.
+    """
+    payload = _payload(prompt, model, stream, num_predict, json_format)
+    if not stream:
+        response = get_session().post(OLLAMA_URL, json=payload, timeout=(CONNECT_TIMEOUT, REQUEST_TIMEOUT))
+        response.raise_for_status()
+        data = response.json()
+        if data.get('error'):
+            raise GenerationAborted(f"Ollama error: {data['error']}")
+        return data.get('response', '')
+
+    deadline = time.monotonic() + REQUEST_TIMEOUT
+    with get_session().post(OLLAMA_URL, json=payload, stream=True,
+                            timeout=(CONNECT_TIMEOUT, STREAM_READ_TIMEOUT)) as response:
+        response.raise_for_status()
+        return _read_stream(response, json_format, deadline)
+
+
+async def agenerate(prompt, model, stream=OLLAMA_STREAM, num_predict=None, json_format=True):
+    """generate() for asyncio callers, on a worker thread so the pooled session is shared."""
+    return await asyncio.to_thread(generate, prompt, model, stream, num_predict, json_format)
+
+
+def embed(text, model, url, timeout):
+    """Raw embedding vector of `text` from an Ollama embeddings endpoint."""
+    response = get_session().post(url, json={"model": model, "prompt": text, "keep_alive": OLLAMA_KEEP_ALIVE},
+                                  timeout=(CONNECT_TIMEOUT, timeout))
+    response.raise_for_status()
+    return response.json()["embedding"]
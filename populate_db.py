@@ -1,12 +1,16 @@
+import argparse
 import pandas as pd
 import sqlite3
 import json
-import math
-from isbnlib import to_isbn13, is_isbn10, is_isbn13, clean as clean_isbn_string
+import time
+import feature_index
+from isbnlib import canonical, to_isbn13, is_isbn10, is_isbn13, clean as clean_isbn_string
 
 # --- Configuration ---
 CSV_FILE_PATH = 'data/book_data.csv'
 DB_FILE_PATH = 'data/books.db'
+INSERT_CHUNK_SIZE = 50000
+STREAM_CHUNK_SIZE = 100000 # CSV rows per streamed chunk
 
 # --- Database Setup ---
 def setup_database():
@@ -14,8 +18,9 @@ def setup_database():
     conn = sqlite3.connect(DB_FILE_PATH)
     cursor = conn.cursor()
 
-    # Drop table if it exists
+    # Drop tables if they exist
     cursor.execute("DROP TABLE IF EXISTS books")
+    cursor.execute("DROP TABLE IF EXISTS book_features")
 
     # Create table schema
     cursor.execute("""
@@ -43,115 +48,116 @@ def setup_database():
             llm_sentiment TEXT
         )
     """)
+    # Inverted index of LLM features, filled in by enrichment
+    feature_index.ensure_schema(conn)
     conn.commit()
     conn.close()
     print(f"Database '{DB_FILE_PATH}' setup complete.")
 
-def load_and_clean_data():
-    """Loads data from CSV, cleans it, and prepares for DB insertion."""
-    print(f"Loading data from '{CSV_FILE_PATH}'...")
-    try:
-        # Adjusting dtype={'isbn': str, 'isbn13': str} if pandas misinterprets them
-        df = pd.read_csv(
-            CSV_FILE_PATH,
-            dtype={
-                'ISBN': str,
-                'Book-Title': str,
-                'Book-Author': str,
-                'Year-Of-Publication': str,
-                'Publisher': str
-            },
-            on_bad_lines='warn',
-            low_memory=False
-        )
-        print(f"Loaded {len(df)} rows.")
-    except FileNotFoundError:
-        print(f"ERROR: CSV file not found at '{CSV_FILE_PATH}'. Please update the path.")
-        return None
-    except Exception as e:
-        print(f"ERROR: Failed to load CSV: {e}")
-        return None
+def convert_isbn(original_isbn_str):
+    """
+    Returns (isbn13, isbn10) for a raw CSV ISBN, either being pd.NA when unavailable.
+    A valid ISBN-10 is kept as isbn10 and converted for the isbn13 primary key. Both are
+    stored in canonical form (digits only), so hyphenated inputs match Google Books ISBNs.
+    """
+    # Use isbnlib's clean function - it's good at removing junk
+    cleaned_original_isbn = clean_isbn_string(original_isbn_str)
+    if is_isbn13(cleaned_original_isbn):
+        return canonical(cleaned_original_isbn), pd.NA
+    if is_isbn10(cleaned_original_isbn):
+        converted_isbn13 = to_isbn13(cleaned_original_isbn) # Returns '' on failure
+        # is_isbn13('') will be False
+        return (canonical(converted_isbn13) if is_isbn13(converted_isbn13) else pd.NA), canonical(cleaned_original_isbn)
+    return pd.NA, pd.NA
+
+CSV_READ_OPTIONS = {
+    # Adjusting dtype={'isbn': str, 'isbn13': str} if pandas misinterprets them
+    'dtype': {
+        'ISBN': str,
+        'Book-Title': str,
+        'Book-Author': str,
+        'Year-Of-Publication': str,
+        'Publisher': str
+    },
+    'on_bad_lines': 'warn',
+}
+REQUIRED_COLUMNS = ['ISBN', 'Book-Title', 'Book-Author']
 
-    required_cols = ['ISBN', 'Book-Title', 'Book-Author']
-    for col in required_cols:
+def _has_required_columns(df):
+    for col in REQUIRED_COLUMNS:
         if col not in df.columns:
             print(f"ERROR: Required column '{col}' not found in CSV. Available columns: {list(df.columns)}")
-            return None
-    
-    df_cleaned = df.copy()
-    
+            return False
+    return True
+
+def clean_books_frame(df, verbose=True):
+    """
+    Cleans a frame of raw CSV rows for insertion (titles, ISBNs, authors). Works on
+    the whole file or on one streamed chunk; the frame passed in is modified.
+    """
     # --- Title Cleaning ---
-    print("Cleaning 'Book-Title' column...")
-    df_cleaned['Book-Title'] = df_cleaned['Book-Title'].astype(str).str.strip()
+    if verbose: print("Cleaning 'Book-Title' column...")
+    df['Book-Title'] = df['Book-Title'].astype(str).str.strip()
     # Remove leading/trailing double quotes only if they are at the very start/end
-    df_cleaned['Book-Title'] = df_cleaned['Book-Title'].apply(
-        lambda x: x[1:-1] if x.startswith('"') and x.endswith('"') else x
-    )
-    df_cleaned['Book-Title'] = df_cleaned['Book-Title'].str.title() # Convert to Title Case
-    df_cleaned = df_cleaned[df_cleaned['Book-Title'].str.strip() != ''] # Remove if title became empty
-    df_cleaned.dropna(subset=['Book-Title'], inplace=True)
-    print(f"{len(df_cleaned)} rows after title cleaning.")
+    quoted = df['Book-Title'].str.startswith('"') & df['Book-Title'].str.endswith('"')
+    df.loc[quoted, 'Book-Title'] = df.loc[quoted, 'Book-Title'].str[1:-1]
+    df['Book-Title'] = df['Book-Title'].str.title() # Convert to Title Case
+    df = df[df['Book-Title'].str.strip() != ''] # Remove if title became empty
+    df = df.dropna(subset=['Book-Title'])
+    if verbose: print(f"{len(df)} rows after title cleaning.")
 
     # --- ISBN Processing using isbnlib ---
-    print("Processing ISBNs...")
-    processed_isbns = []
-    for index, row in df_cleaned.iterrows():
-        original_isbn_str = str(row.get('ISBN', '')).strip()
-        # Use isbnlib's clean function - it's good at removing junk
-        cleaned_original_isbn = clean_isbn_string(original_isbn_str)
-
-        final_isbn13 = None
-        final_isbn10 = None
-
-        # --- DEBUG PRINT START ---
-        # print(f"DEBUG: Row Index: {index}, Original ISBN Str: '{original_isbn_str}', Cleaned Original: '{cleaned_original_isbn}'")
-        # --- DEBUG PRINT END ---
-
-        if is_isbn13(cleaned_original_isbn):
-            final_isbn13 = cleaned_original_isbn
-            # print(f"DEBUG: Valid ISBN-13 found: {final_isbn13}")
-        elif is_isbn10(cleaned_original_isbn):
-            final_isbn10 = cleaned_original_isbn
-            converted_isbn13 = to_isbn13(cleaned_original_isbn) # Returns '' on failure
-            # print(f"DEBUG: Is ISBN-10 ('{final_isbn10}'). Attempting conversion to ISBN-13: '{converted_isbn13}'")
-            if is_isbn13(converted_isbn13): # is_isbn13('') will be False
-                final_isbn13 = converted_isbn13
-            # else:
-                # print(f"DEBUG: Conversion from ISBN-10 to ISBN-13 failed for '{final_isbn10}'. final_isbn13 remains None.")
-        # else:
-            # if cleaned_original_isbn: # Only print if there was something to evaluate
-                # print(f"DEBUG: Not a valid ISBN-10 or ISBN-13 after cleaning: '{cleaned_original_isbn}'")
-
-
-        processed_isbns.append({
-            'original_index': index,
-            'db_isbn13': final_isbn13 if final_isbn13 else pd.NA, # Use pd.NA for proper dropna handling
-            'db_isbn10': final_isbn10 if final_isbn10 else pd.NA
-        })
-
-    isbn_df = pd.DataFrame(processed_isbns).set_index('original_index')
-    df_cleaned = df_cleaned.join(isbn_df)
+    # Each distinct raw ISBN is converted once and mapped back onto the rows,
+    # instead of calling isbnlib for every row
+    if verbose: print("Processing ISBNs...")
+    # Blank cells are NaN; fill them first so every value reaches isbnlib as a string
+    raw_isbns = df['ISBN'].fillna('').astype(str).str.strip()
+    conversions = {raw: convert_isbn(raw) for raw in raw_isbns.unique()}
+    df = df.assign(db_isbn13=raw_isbns.map(lambda raw: conversions[raw][0]),
+                   db_isbn10=raw_isbns.map(lambda raw: conversions[raw][1]))
 
     # IMPORTANT: Keep only rows where we successfully got a valid ISBN-13 for the PK
     # pd.NA will be treated as missing by dropna.
-    original_row_count_before_dropna = len(df_cleaned)
-    df_cleaned.dropna(subset=['db_isbn13'], inplace=True)
+    original_row_count_before_dropna = len(df)
+    df = df.dropna(subset=['db_isbn13'])
     # Additionally, ensure db_isbn13 is not an empty string if any somehow passed dropna
     # (though pd.NA should have handled cases where final_isbn13 was None/empty from conversion)
-    df_cleaned = df_cleaned[df_cleaned['db_isbn13'].astype(str).str.strip() != '']
+    df = df[df['db_isbn13'].astype(str).str.strip() != '']
 
-    print(f"Rows before db_isbn13 NA/empty drop: {original_row_count_before_dropna}, Rows after: {len(df_cleaned)}")
-    print(f"{len(df_cleaned)} rows remaining after ISBN processing and validation (must have valid non-empty ISBN-13).")
+    if verbose:
+        print(f"Rows before db_isbn13 NA/empty drop: {original_row_count_before_dropna}, Rows after: {len(df)}")
+        print(f"{len(df)} rows remaining after ISBN processing and validation (must have valid non-empty ISBN-13).")
 
     # --- Author Parsing ---
-    print("Processing 'Book-Author' column...")
-    df_cleaned['authors_json'] = df_cleaned['Book-Author'].apply(
-        lambda x: json.dumps([str(x).strip()]) if pd.notna(x) and str(x).strip() else json.dumps([])
-    )
+    if verbose: print("Processing 'Book-Author' column...")
+    authors = df['Book-Author'].fillna('').astype(str).str.strip()
+    authors_json = {author: json.dumps([author]) if author else json.dumps([]) for author in authors.unique()}
+    df = df.assign(authors_json=authors.map(authors_json))
     
     # --- Other Columns from your CSV ---
-    df_cleaned['Year-Of-Publication'] = df_cleaned['Year-Of-Publication'].astype(str).str.strip()
-    df_cleaned['Publisher'] = df_cleaned['Publisher'].astype(str).str.strip()
+    df = df.assign(**{
+        'Year-Of-Publication': df['Year-Of-Publication'].astype(str).str.strip(),
+        'Publisher': df['Publisher'].astype(str).str.strip(),
+    })
+    return df
+
+def load_and_clean_data():
+    """Loads data from CSV, cleans it, and prepares for DB insertion."""
+    print(f"Loading data from '{CSV_FILE_PATH}'...")
+    try:
+        df = pd.read_csv(CSV_FILE_PATH, low_memory=False, **CSV_READ_OPTIONS)
+        print(f"Loaded {len(df)} rows.")
+    except FileNotFoundError:
+        print(f"ERROR: CSV file not found at '{CSV_FILE_PATH}'. Please update the path.")
+        return None
+    except Exception as e:
+        print(f"ERROR: Failed to load CSV: {e}")
+        return None
+
+    if not _has_required_columns(df):
+        return None
+    
+    df_cleaned = clean_books_frame(df)
 
     print("Data cleaning finished.")
     print("\n--- Sample of df_cleaned before returning (first 5 rows): ---")
@@ -160,70 +166,121 @@ def load_and_clean_data():
     return df_cleaned
 
 
-def insert_data_to_db(df):
-    """Inserts cleaned data from DataFrame into the SQLite database."""
+def _open_bulk_load_connection():
+    """WAL mode and synchronous=OFF for the bulk load (a crash mid-load means re-running it)."""
+    conn = sqlite3.connect(DB_FILE_PATH)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    return conn
+
+def _insert_rows(conn, df, chunk_size=INSERT_CHUNK_SIZE, report_progress=True):
+    """executemany INSERT OR IGNORE of a cleaned frame, in the caller's transaction. Returns rows inserted."""
+    rows = list(zip(
+        df['db_isbn13'],                      # PRIMARY KEY
+        df['db_isbn10'].astype(object).where(df['db_isbn10'].notna(), None), # None if original was ISBN-13
+        df['Book-Title'],
+        df['authors_json'],
+        df['Year-Of-Publication'].astype(str),
+        df['Publisher'].astype(str),
+    ))
+    changes_before = conn.total_changes
+    for i in range(0, len(rows), chunk_size):
+        conn.executemany("""
+            INSERT OR IGNORE INTO books (
+                isbn13, isbn10, title, authors, language_code, num_pages,
+                publication_date, average_rating, ratings_count, text_reviews_count, publisher
+            ) VALUES (?, ?, ?, ?, NULL, NULL, ?, NULL, NULL, NULL, ?)
+        """, rows[i:i + chunk_size])
+        if report_progress:
+            print(f"Processed {min(i + chunk_size, len(rows))} rows...")
+    return conn.total_changes - changes_before
+
+def insert_data_to_db(df, chunk_size=INSERT_CHUNK_SIZE):
+    """
+    Inserts cleaned data from DataFrame into the SQLite database with chunked
+    executemany calls inside one transaction, then restores synchronous.
+    """
     if df is None or df.empty:
         print("No data to insert.")
         return
 
-    conn = sqlite3.connect(DB_FILE_PATH)
-    cursor = conn.cursor()
+    conn = _open_bulk_load_connection()
     print(f"Inserting {len(df)} rows into database...")
 
-    inserted_count = 0
-    skipped_count = 0
-
-    for index, row in df.iterrows():
-        val_db_isbn13 = row.get('db_isbn13')
-        val_db_isbn10 = row.get('db_isbn10')
-        # ... get other values for the tuple ...
-
-        # --- Add this DEBUG print block ---
-        if index < 5: # Print for the first 5 rows
-            print(f"DEBUG INSERTING: Index: {index}")
-            print(f"  Raw db_isbn13 from DataFrame: '{val_db_isbn13}' (Type: {type(val_db_isbn13)})")
-            print(f"  Raw db_isbn10 from DataFrame: '{val_db_isbn10}' (Type: {type(val_db_isbn10)})")
-            print(f"  Title: {row.get('Book-Title')}")
-        # --- End DEBUG print block ---
-        data_tuple = (
-            row.get('db_isbn13'),       # PRIMARY KEY
-            row.get('db_isbn10'),       # May be None if original was ISBN-13
-            row.get('Book-Title'),
-            row.get('authors_json'),
-            None, # language_code
-            None, # num_pages
-            str(row.get('Year-Of-Publication', '')),
-            None, # average_rating
-            None, # ratings_count
-            None, # text_reviews_count
-            str(row.get('Publisher', ''))
-        )
+    start = time.perf_counter()
+    try:
+        with conn: # one transaction; rolled back on error
+            inserted_count = _insert_rows(conn, df, chunk_size)
+    except sqlite3.Error as e:
+        print(f"ERROR: Bulk insert failed and was rolled back: {e}")
+        conn.close()
+        return
+    elapsed = time.perf_counter() - start
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.close()
+    print(f"Database insertion complete. Inserted: {inserted_count}, Skipped (duplicates): {len(df) - inserted_count} "
+          f"({len(df) / elapsed if elapsed else 0:.0f} rows/sec)")
 
-        try:
-            cursor.execute("""
-                INSERT OR IGNORE INTO books (
-                    isbn13, isbn10, title, authors, language_code, num_pages,
-                    publication_date, average_rating, ratings_count, text_reviews_count, publisher
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, data_tuple)
-            if cursor.rowcount > 0:
-                inserted_count += 1
-            else:
-                skipped_count += 1
-        except sqlite3.Error as e:
-            print(f"Error inserting row {index} (ISBN13: {row.get('isbn13')}): {e}")
-            skipped_count += 1
-
-        # Commit periodically for large datasets
-        if (index + 1) % 1000 == 0:
-            conn.commit()
-            print(f"Processed {index + 1} rows...")
 
-    conn.commit()
-    conn.close()
-    print(f"Database insertion complete. Inserted: {inserted_count}, Skipped (duplicates/errors): {skipped_count}")
+def stream_csv_to_db(chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Streaming ingestion: reads the CSV `chunk_size` rows at a time and cleans,
+    validates and inserts each chunk (one transaction per chunk) before reading the
+    next, so peak memory depends on the chunk size, not the file size. Progress and
+    throughput are reported per chunk.
+    """
+    print(f"Streaming '{CSV_FILE_PATH}' into '{DB_FILE_PATH}' in chunks of {chunk_size} rows...")
+    try:
+        reader = pd.read_csv(CSV_FILE_PATH, chunksize=chunk_size, **CSV_READ_OPTIONS)
+    except FileNotFoundError:
+        print(f"ERROR: CSV file not found at '{CSV_FILE_PATH}'. Please update the path.")
+        return None
+
+    conn = _open_bulk_load_connection()
+    totals = {'read': 0, 'valid': 0, 'inserted': 0, 'chunks': 0}
+    start = time.perf_counter()
+    try:
+        for chunk in reader:
+            chunk_start = time.perf_counter()
+            if totals['chunks'] == 0 and not _has_required_columns(chunk):
+                return None
+            cleaned = clean_books_frame(chunk, verbose=False)
+            with conn:
+                inserted = _insert_rows(conn, cleaned, report_progress=False)
+
+            totals['chunks'] += 1
+            totals['read'] += len(chunk)
+            totals['valid'] += len(cleaned)
+            totals['inserted'] += inserted
+            chunk_elapsed = time.perf_counter() - chunk_start
+            elapsed = time.perf_counter() - start
+            print(f"Chunk {totals['chunks']}: {len(chunk)} rows read, {len(cleaned)} valid, {inserted} inserted "
+                  f"in {chunk_elapsed:.2f}s ({len(chunk) / chunk_elapsed if chunk_elapsed else 0:.0f} rows/sec) | "
+                  f"total {totals['read']} rows, {totals['read'] / elapsed if elapsed else 0:.0f} rows/sec")
+    except sqlite3.Error as e:
+        print(f"ERROR: Insert failed in chunk {totals['chunks'] + 1} (earlier chunks are committed): {e}")
+    except Exception as e:
+        print(f"ERROR: Failed to read CSV: {e}")
+    finally:
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"Streaming ingestion complete. Read: {totals['read']}, valid: {totals['valid']}, "
+          f"inserted: {totals['inserted']}, skipped (invalid/duplicates): {totals['read'] - totals['inserted']} "
+          f"in {elapsed:.1f}s ({totals['read'] / elapsed if elapsed else 0:.0f} rows/sec)")
+    return totals
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Populate books.db from the book CSV.")
+    parser.add_argument('--stream', action='store_true',
+                        help="read, clean and insert the CSV chunk by chunk with bounded memory")
+    parser.add_argument('--chunk-size', type=int, default=STREAM_CHUNK_SIZE)
+    args = parser.parse_args()
+
     setup_database()
-    cleaned_df = load_and_clean_data()
-    insert_data_to_db(cleaned_df)
\ No newline at end of file
+    if args.stream:
+        stream_csv_to_db(args.chunk_size)
+    else:
+        cleaned_df = load_and_clean_data()
+        insert_data_to_db(cleaned_df)
\ No newline at end of file
@@ -0,0 +1,128 @@
+"""
+Named RQ queues, in priority order, and per-queue depth/wait-time metrics.
+
+Workers take jobs from the first non-empty queue they listen on, so a worker started
+on SEARCH, INTERACTIVE and BULK always finishes pending title searches before
+analysis jobs, and those before enrichment shards. WORKER_POOLS are the launch
+configurations worker.py accepts. Dedicated pools keep a long-running shard from
+occupying the workers that serve interactive users.
+
+MetricsWorker records how long each job waited between being enqueued and starting,
+which get_queue_metrics (served at /stats/queues) reports alongside the queue depths.
+"""
+import time
+from datetime import datetime, timezone
+
+from redis import RedisError
+from rq import Queue, Worker
+from rq.exceptions import NoSuchJobError
+from rq.job import Job
+from rq.registry import FailedJobRegistry, StartedJobRegistry
+
+from user_profiles import decode
+
+# --- Configuration ---
+SEARCH_QUEUE = 'search' # Google Books searches and lookups: seconds, a user is waiting on the page
+INTERACTIVE_QUEUE = 'interactive' # a user's LLM analysis, recommendations and profile updates
+BULK_QUEUE = 'bulk' # catalogue enrichment shards: hours, nobody waiting
+QUEUE_PRIORITY = [SEARCH_QUEUE, INTERACTIVE_QUEUE, BULK_QUEUE]
+
+# Queues each kind of worker listens on, highest priority first
+WORKER_POOLS = {
+    'all': QUEUE_PRIORITY,
+    'interactive': [SEARCH_QUEUE, INTERACTIVE_QUEUE],
+    'search': [SEARCH_QUEUE],
+    'bulk': [BULK_QUEUE],
+}
+
+METRICS_KEY_PREFIX = 'queue_metrics'
+WAIT_SAMPLE_SIZE = 1000 # most recent wait times kept per queue for the percentiles
+
+
+def get_queue(name, redis_conn):
+    return Queue(name, connection=redis_conn)
+
+
+def fetch_job(job_id, redis_conn):
+    """The job with this id on any queue, or None. (Queue.fetch_job only finds its own queue's jobs.)"""
+    try:
+        return Job.fetch(job_id, connection=redis_conn)
+    except NoSuchJobError:
+        return None
+
+
+def _waits_key(queue_name):
+    return f"{METRICS_KEY_PREFIX}:{queue_name}:waits"
+
+
+def _totals_key(queue_name):
+    return f"{METRICS_KEY_PREFIX}:{queue_name}:totals"
+
+
+def _as_utc(moment):
+    # RQ < 2 stores naive UTC datetimes
+    return moment.replace(tzinfo=timezone.utc) if moment.tzinfo is None else moment
+
+
+def record_wait(redis_conn, queue_name, wait_seconds):
+    try:
+        pipe = redis_conn.pipeline()
+        pipe.lpush(_waits_key(queue_name), f"{wait_seconds:.3f}")
+        pipe.ltrim(_waits_key(queue_name), 0, WAIT_SAMPLE_SIZE - 1)
+        pipe.hincrby(_totals_key(queue_name), 'started', 1)
+        pipe.hincrbyfloat(_totals_key(queue_name), 'wait_seconds', wait_seconds)
+        pipe.execute()
+    except RedisError as e:
+        print(f"Warning: Could not record queue wait time for {queue_name}: {e}")
+
+
+class MetricsWorker(Worker):
+    """An RQ worker that records each job's queue wait time as it picks the job up."""
+
+    def execute_job(self, job, queue):
+        if job.enqueued_at is not None:
+            wait_seconds = (datetime.now(timezone.utc) - _as_utc(job.enqueued_at)).total_seconds()
+            record_wait(self.connection, queue.name, max(wait_seconds, 0.0))
+        return super().execute_job(job, queue)
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(int(fraction * len(sorted_values)), len(sorted_values) - 1)]
+
+
+def get_queue_metrics(redis_conn):
+    """
+    Per queue: jobs waiting, running and failed; how long the oldest waiting job has
+    been queued; wait-time percentiles over the last WAIT_SAMPLE_SIZE started jobs;
+    and the number of workers listening.
+    """
+    workers = Worker.all(connection=redis_conn)
+    metrics = {}
+    for name in QUEUE_PRIORITY:
+        queue = get_queue(name, redis_conn)
+        oldest_wait = None
+        oldest_ids = queue.get_job_ids(0, 1)
+        oldest_job = fetch_job(oldest_ids[0], redis_conn) if oldest_ids else None
+        if oldest_job is not None and oldest_job.enqueued_at is not None:
+            oldest_wait = (datetime.now(timezone.utc) - _as_utc(oldest_job.enqueued_at)).total_seconds()
+
+        waits = sorted(float(value) for value in redis_conn.lrange(_waits_key(name), 0, -1))
+        totals = {decode(k): float(v) for k, v in (redis_conn.hgetall(_totals_key(name)) or {}).items()}
+        started_total = int(totals.get('started', 0))
+        metrics[name] = {
+            'depth': len(queue),
+            'running': StartedJobRegistry(name, connection=redis_conn).count,
+            'failed': FailedJobRegistry(name, connection=redis_conn).count,
+            'oldest_wait_seconds': oldest_wait,
+            'jobs_started': started_total,
+            'mean_wait_seconds': totals.get('wait_seconds', 0) / started_total if started_total else None,
+            'recent_wait_seconds': {
+                'p50': _percentile(waits, 0.5),
+                'p95': _percentile(waits, 0.95),
+                'max': waits[-1] if waits else None,
+            },
+            'workers': sum(1 for worker in workers if name in worker.queue_names()),
+        }
+    return {'queues': metrics, 'generated_at': time.time()}
@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import time
+from datetime import timedelta
+
+from redis import Redis, RedisError
+
+import feature_index
+import queues
+from user_profiles import PROFILE_FEATURES, decode
+
+# --- Configuration ---
+REC_CACHE_KEY_PREFIX = 'rec_cache'
+REC_CACHE_LRU_KEY = 'rec_cache_lru' # zset of cache keys scored by last access time
+REC_CACHE_STATS_KEY = 'rec_cache_stats'
+REC_CACHE_MAX_ENTRIES = int(os.environ.get('RECOMMENDATION_CACHE_MAX_ENTRIES', 10000))
+REC_CACHE_TTL_SECONDS = int(os.environ.get('RECOMMENDATION_CACHE_TTL', 3600 * 24 * 7))
+# Bumped whenever enrichment changes the catalogue; part of every cache key, so a bump
+# makes all earlier entries unreachable and the LRU trims them away.
+CATALOGUE_VERSION_KEY = 'catalogue_version'
+# Analysis jobs that add books only mark the catalogue dirty; one refresh job on the bulk
+# queue, delayed by the debounce, rebuilds the feature store and bumps the version for all of them
+CATALOGUE_REFRESH_PENDING_KEY = 'catalogue_refresh_pending'
+CATALOGUE_REFRESH_DEBOUNCE_SECONDS = int(os.environ.get('CATALOGUE_REFRESH_DEBOUNCE', 600))
+CATALOGUE_REFRESH_PENDING_TTL = CATALOGUE_REFRESH_DEBOUNCE_SECONDS + 3600 # in case the job is lost
+WEIGHT_PRECISION = 3 # decimals kept from the normalised weights, so near-identical lists share an entry
+
+# generate_user_profile counters that drive scoring
+_PROFILE_WEIGHT_KEYS = tuple(weighted_key for _, _, _, weighted_key in PROFILE_FEATURES.values())
+
+
+def get_catalogue_version(redis_conn):
+    value = redis_conn.get(CATALOGUE_VERSION_KEY)
+    return int(value) if value else 0
+
+
+def bump_catalogue_version(redis_conn):
+    """Invalidates every cached recommendation. Called by enrichment after it writes books.db."""
+    try:
+        version = redis_conn.incr(CATALOGUE_VERSION_KEY)
+        print(f"Catalogue version is now {version}; cached recommendations invalidated.")
+        return version
+    except RedisError as e:
+        print(f"Warning: Could not bump the catalogue version: {e}")
+        return None
+
+
+def refresh_recommendation_artifacts(db_path, redis_conn=None):
+    """
+    Rebuilds the derived scoring structures after books.db gained analysed books and
+    bumps the catalogue version, which invalidates cached recommendations. Called by
+    enrichment and by refresh_catalogue_task; analysis jobs use schedule_catalogue_refresh.
+    """
+    try:
+        import feature_matrix
+    except ImportError:
+        feature_matrix = None
+    if feature_matrix:
+        feature_matrix.build_feature_matrix(db_path)
+    if redis_conn is not None:
+        bump_catalogue_version(redis_conn)
+
+
+def schedule_catalogue_refresh(redis_conn, db_path):
+    """
+    Marks the catalogue dirty after an analysis job added books. Only the first call
+    while no refresh is pending enqueues refresh_catalogue_task, delayed by the
+    debounce, so a burst of jobs leads to one rebuild. Returns the job, or None.
+    """
+    try:
+        if not redis_conn.set(CATALOGUE_REFRESH_PENDING_KEY, int(time.time()), nx=True,
+                              ex=CATALOGUE_REFRESH_PENDING_TTL):
+            return None
+        # RQ needs a connection without decode_responses
+        bulk_queue = queues.get_queue(queues.BULK_QUEUE, Redis())
+        job = bulk_queue.enqueue_in(timedelta(seconds=CATALOGUE_REFRESH_DEBOUNCE_SECONDS),
+                                    refresh_catalogue_task, db_path)
+        print(f"Catalogue refresh scheduled in {CATALOGUE_REFRESH_DEBOUNCE_SECONDS}s (job {job.id}).")
+        return job
+    except RedisError as e:
+        print(f"Warning: Could not schedule a catalogue refresh: {e}")
+        return None
+
+
+def refresh_catalogue_task(db_path):
+    """Bulk-queue job: clears the dirty flag first (so later write-backs schedule another run), then refreshes."""
+    redis_conn = Redis()
+    redis_conn.delete(CATALOGUE_REFRESH_PENDING_KEY)
+    refresh_recommendation_artifacts(db_path, redis_conn)
+
+
+def profile_fingerprint(user_profile, top_n, engine):
+    """
+    Stable hash of what a recommendation depends on: the profile's weighted features
+    (each counter scaled to its largest weight and rounded, keys normalised), the read
+    authors and ISBNs, the number of results and the scoring engine.
+    """
+    normalised = {}
+    for key in _PROFILE_WEIGHT_KEYS:
+        counter = user_profile.get(key) or {}
+        max_weight = max(counter.values(), default=0) or 1.0
+        normalised[key] = sorted(
+            (feature_index.normalise_value(value), round(weight / max_weight, WEIGHT_PRECISION))
+            for value, weight in counter.items()
+        )
+    normalised['read_authors'] = sorted({feature_index.normalise_value(a) for a in user_profile.get('read_authors') or []})
+    normalised['read_isbns'] = sorted(set(user_profile.get('read_isbns') or []))
+    normalised['top_n'] = top_n
+    normalised['engine'] = engine
+    encoded = json.dumps(normalised, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    return hashlib.sha1(encoded).hexdigest()
+
+
+def cache_key(catalogue_version, fingerprint):
+    return f"{REC_CACHE_KEY_PREFIX}:{catalogue_version}:{fingerprint}"
+
+
+def _record_event(redis_conn, event):
+    try:
+        redis_conn.hincrby(REC_CACHE_STATS_KEY, event, 1)
+    except RedisError:
+        pass
+
+
+def get_cached_recommendations(redis_conn, key):
+    """Cached recommendation list for `key`, or None. Marks the entry as recently used."""
+    stored_value = redis_conn.get(key)
+    if stored_value is None:
+        _record_event(redis_conn, 'misses')
+        return None
+    redis_conn.zadd(REC_CACHE_LRU_KEY, {key: time.time()})
+    _record_event(redis_conn, 'hits')
+    return json.loads(stored_value)
+
+
+def store_recommendations(redis_conn, key, recommendations, max_entries=REC_CACHE_MAX_ENTRIES):
+    """Caches a recommendation list, then evicts the least recently used entries beyond max_entries."""
+    pipe = redis_conn.pipeline()
+    pipe.set(key, json.dumps(recommendations), ex=REC_CACHE_TTL_SECONDS or None)
+    pipe.zadd(REC_CACHE_LRU_KEY, {key: time.time()})
+    pipe.zcard(REC_CACHE_LRU_KEY)
+    size = pipe.execute()[-1]
+    if size > max_entries:
+        evicted = [member for member, _ in redis_conn.zpopmin(REC_CACHE_LRU_KEY, size - max_entries)]
+        if evicted:
+            redis_conn.unlink(*evicted)
+
+
+def get_recommendation_cache_stats(redis_conn):
+    stats = {}
+    for field, value in (redis_conn.hgetall(REC_CACHE_STATS_KEY) or {}).items():
+        stats[decode(field)] = int(value)
+    lookups = stats.get('hits', 0) + stats.get('misses', 0)
+    stats['hit_rate'] = stats.get('hits', 0) / lookups if lookups else None
+    stats['entries'] = redis_conn.zcard(REC_CACHE_LRU_KEY)
+    stats['max_entries'] = REC_CACHE_MAX_ENTRIES
+    stats['catalogue_version'] = get_catalogue_version(redis_conn)
+    return stats
@@ -0,0 +1,59 @@
+import json
+
+from user_profiles import decode
+
+# Scored recommendation lists, stored once per request and served a page at a time by
+# /recommendations/<result_id>, so asking for page 2 never re-scores the catalogue.
+RESULTS_KEY_PREFIX = 'rec_results'
+RESULTS_TTL_SECONDS = 3600
+DEFAULT_PAGE_SIZE = 10
+MAX_PAGE_SIZE = 50
+
+
+def _items_key(result_id):
+    return f"{RESULTS_KEY_PREFIX}:{result_id}:items"
+
+
+def _meta_key(result_id):
+    return f"{RESULTS_KEY_PREFIX}:{result_id}:meta"
+
+
+def store_results(redis_conn, result_id, recommendations, timings):
+    """Stores the full ranked list (one JSON item per list entry) and its stage timings."""
+    items_key = _items_key(result_id)
+    meta_key = _meta_key(result_id)
+    pipe = redis_conn.pipeline()
+    pipe.delete(items_key)
+    if recommendations:
+        pipe.rpush(items_key, *[json.dumps(item) for item in recommendations])
+    pipe.hset(meta_key, mapping={'total': len(recommendations), 'timings_ms': json.dumps(timings)})
+    pipe.expire(items_key, RESULTS_TTL_SECONDS)
+    pipe.expire(meta_key, RESULTS_TTL_SECONDS)
+    pipe.execute()
+
+
+def read_page(redis_conn, result_id, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    One page of stored results. `cursor` is the opaque next_cursor from the previous
+    page (None for the first). Returns None if the results don't exist (yet, or any more).
+    """
+    meta = redis_conn.hgetall(_meta_key(result_id))
+    if not meta:
+        return None
+    meta = {decode(k): v for k, v in meta.items()}
+    total = int(meta['total'])
+    try:
+        offset = max(int(cursor), 0) if cursor else 0
+    except ValueError:
+        offset = 0
+    limit = min(max(limit, 1), MAX_PAGE_SIZE)
+
+    items = [json.loads(item) for item in redis_conn.lrange(_items_key(result_id), offset, offset + limit - 1)]
+    next_offset = offset + len(items)
+    return {
+        'result_id': result_id,
+        'recommendations': items,
+        'total': total,
+        'next_cursor': str(next_offset) if next_offset < total else None,
+        'timings_ms': json.loads(meta['timings_ms']),
+    }
@@ -167,21 +167,52 @@ function submitConfirmedBooks() {
     })
     .then(response => response.json())
     .then(data => {
-        console.log("Book data fetched:", data);
-        
-        document.getElementById('status').innerHTML = 'Book details received. Starting background analysis...';
-        document.getElementById('confirmed_books').style.display = 'block';
-
-        enqueueLLMAnalysis(data);
-
-        const confirmBtn = document.getElementById('confirmBtn');
-        if(confirmBtn) confirmBtn.disabled = true;
+        if (data.job_id) {
+            console.log('Book details job enqueued with ID:', data.job_id);
+            document.getElementById('status').innerHTML = 'Fetching book details...';
+            const confirmBtn = document.getElementById('confirmBtn');
+            if(confirmBtn) confirmBtn.disabled = true;
+            checkBookDataJobStatus(data.job_id);
+        } else {
+            console.error('Error: No job ID received for book details task.', data.error);
+            document.getElementById('status').innerHTML = `Error fetching book details: ${data.error || 'unknown error'}`;
+        }
     })
     .catch(error => {
         console.error("Error fetching book data:", error);
     });
 }
 
+function checkBookDataJobStatus(jobId) {
+    fetch(`/results/${jobId}`)
+        .then(response => response.json())
+        .then(data => {
+            const statusDiv = document.getElementById('status');
+            if (data.status === 'finished') {
+                console.log("Book data fetched:", data.result);
+
+                statusDiv.innerHTML = 'Book details received. Starting background analysis...';
+                document.getElementById('confirmed_books').style.display = 'block';
+
+                enqueueLLMAnalysis(data.result);
+            } else if (data.status === 'failed') {
+                statusDiv.innerHTML = `Fetching book details failed: ${data.error}`;
+                console.error("Book details job failed:", data.error);
+                const confirmBtn = document.getElementById('confirmBtn');
+                if(confirmBtn) confirmBtn.disabled = false;
+            } else {
+                if (data.total) {
+                    statusDiv.innerHTML = `Fetching book details... (${data.completed || 0}/${data.total})`;
+                }
+                setTimeout(() => checkBookDataJobStatus(jobId), 1000);
+            }
+        })
+        .catch(error => {
+            console.error('Error checking book details job status:', error);
+            document.getElementById('status').innerHTML = 'Error checking book details job status.';
+        });
+}
+
 document.addEventListener('DOMContentLoaded', function() {
     const jobIdElement = document.getElementById('job_id');
     if (jobIdElement && jobIdElement.value){
@@ -218,7 +249,7 @@ function enqueueLLMAnalysis(detailedBookData) {
         if (data.job_id) {
             console.log('LLM analysis job enqueued with ID:', data.job_id);
             if(statusDiv) statusDiv.innerHTML = 'Background LLM analysis started... waiting for results.';
-            checkLLMJobStatus(data.job_id);
+            streamLLMJobResults(data.job_id);
         } else {
             console.error('Error: No job ID received for LLM task.');
             if(statusDiv) statusDiv.innerHTML = 'Error: Could not get analysis job ID.';
@@ -232,41 +263,52 @@ function enqueueLLMAnalysis(detailedBookData) {
     });
 }
 
-function checkLLMJobStatus(jobId) {
-    fetch(`/results/${jobId}`)
-        .then(response => response.json())
-        .then(data => {
-            const statusDiv = document.getElementById('status');
-            if (!statusDiv) return;
+function streamLLMJobResults(jobId) {
+    // Server-Sent Events: each book is pushed as soon as it's analysed, then a final 'done' event
+    const statusDiv = document.getElementById('status');
+    const source = new EventSource(`/results/${jobId}/stream`);
+    const partialResults = {};
+
+    source.addEventListener('book', event => {
+        const data = JSON.parse(event.data);
+        partialResults[data.isbn] = data.book;
+        if (statusDiv) statusDiv.innerHTML = `LLM analysis in progress... (${data.completed}/${data.total} books analysed)`;
+        displayFinalResults(partialResults);
+    });
 
-            if (data.status === 'finished') {
-                statusDiv.innerHTML = 'Analysis complete!';
-                console.log("LLM Analysis and Profile results received:", data.result);
+    source.addEventListener('done', event => {
+        source.close();
+        const result = JSON.parse(event.data);
+        if (statusDiv) statusDiv.innerHTML = 'Analysis complete!';
+        console.log("LLM Analysis and Profile results received:", result);
 
-                // data.result now contains { analyzed_books_map: {...}, user_profile_details: {...} }
-                if (data.result && data.result.analyzed_books_map) {
-                    displayFinalResults(data.result.analyzed_books_map); // Shows individual book sentiments
-                }
-                if (data.result && data.result.user_profile_details) {
-                    displayUserProfile(data.result.user_profile_details); // New function for profile
-                }
+        // result contains { analysed_books_map: {...}, user_profile_details: {...} }
+        if (result && result.analysed_books_map) {
+            displayFinalResults(result.analysed_books_map); // Shows individual book sentiments
+        }
+        if (result && result.user_profile_details) {
+            displayUserProfile(result.user_profile_details);
+        }
+        // The 'done' event is published before RQ marks the job finished, so use the profile it carries
+        requestRecommendations(result && result.profile_id ? { profile_id: result.profile_id } : { analysis_job_id: jobId });
+    });
 
-            } else if (data.status === 'failed') {
-                statusDiv.innerHTML = `LLM analysis job failed: ${data.error}`;
-                console.error("LLM Job Failed:", data.error);
-                const resultDiv = document.getElementById('result');
-                if(resultDiv) resultDiv.innerHTML = '<p>Analysis failed. Please try again.</p>';
+    source.addEventListener('failed', event => {
+        source.close();
+        const data = JSON.parse(event.data);
+        if (statusDiv) statusDiv.innerHTML = `LLM analysis job failed: ${data.error}`;
+        console.error("LLM Job Failed:", data.error);
+        const resultDiv = document.getElementById('result');
+        if(resultDiv) resultDiv.innerHTML = '<p>Analysis failed. Please try again.</p>';
+    });
 
-            } else {
-                statusDiv.innerHTML = 'LLM analysis in progress... This may take a minute.';
-                setTimeout(() => checkLLMJobStatus(jobId), 5000);
-            }
-        })
-        .catch(error => {
-            console.error('Error checking LLM job status:', error);
-            const statusDiv = document.getElementById('status');
-            if (statusDiv) statusDiv.innerHTML = 'Error checking analysis job status.';
-        });
+    source.onerror = error => {
+        // EventSource reconnects by itself (resuming via Last-Event-ID); only report a closed stream
+        if (source.readyState === EventSource.CLOSED) {
+            console.error('Error streaming LLM job results:', error);
+            if (statusDiv) statusDiv.innerHTML = 'Error streaming analysis results.';
+        }
+    };
 }
 
 function displayFinalResults(finalBookData) {
@@ -409,4 +451,87 @@ function displayTopKeyWords(sortedKeywords) {
     keywordsDiv.appendChild(list)
     keywordsDiv.style.display = 'block';
 }
-*/
\ No newline at end of file
+*/
+
+function requestRecommendations(requestBody, attempt = 0) {
+    // requestBody is { profile_id } or { analysis_job_id }
+    const recommendationsDiv = document.getElementById('recommendations');
+    if (!recommendationsDiv) return;
+    if (attempt === 0) {
+        recommendationsDiv.style.display = 'block';
+        recommendationsDiv.innerHTML = '<h3>Recommended for you:</h3><p>Finding recommendations...</p><ul></ul>';
+    }
+
+    fetch('/recommendations', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(requestBody),
+    })
+    .then(response => {
+        // 409: the analysis job hasn't been marked finished yet; try again shortly
+        if (response.status === 409 && attempt < 20) {
+            setTimeout(() => requestRecommendations(requestBody, attempt + 1), 500);
+            return null;
+        }
+        return response.json();
+    })
+    .then(data => {
+        if (!data) return;
+        if (data.error) throw new Error(data.error);
+        if (data.status === 'finished') {
+            displayRecommendationsPage(data);
+        } else {
+            pollRecommendations(data.result_id);
+        }
+    })
+    .catch(error => {
+        console.error('Error requesting recommendations:', error);
+        recommendationsDiv.querySelector('p').textContent = `Could not get recommendations: ${error.message}`;
+    });
+}
+
+function pollRecommendations(resultId, cursor) {
+    const url = `/recommendations/${resultId}` + (cursor ? `?cursor=${encodeURIComponent(cursor)}` : '');
+    fetch(url)
+    .then(response => response.json())
+    .then(data => {
+        if (data.error) throw new Error(data.error);
+        if (data.status === 'pending') {
+            setTimeout(() => pollRecommendations(resultId, cursor), 1000);
+        } else {
+            displayRecommendationsPage(data);
+        }
+    })
+    .catch(error => {
+        console.error('Error fetching recommendations:', error);
+        const recommendationsDiv = document.getElementById('recommendations');
+        if (recommendationsDiv) recommendationsDiv.querySelector('p').textContent = `Could not get recommendations: ${error.message}`;
+    });
+}
+
+function displayRecommendationsPage(page) {
+    // Appends one page; "More" fetches the next page of the stored results (no re-scoring)
+    const recommendationsDiv = document.getElementById('recommendations');
+    if (!recommendationsDiv) return;
+    const statusParagraph = recommendationsDiv.querySelector('p');
+    const listElement = recommendationsDiv.querySelector('ul');
+    const existingButton = recommendationsDiv.querySelector('button');
+    if (existingButton) existingButton.remove();
+
+    statusParagraph.textContent = page.total ? `${page.total} recommendations` : 'No recommendations found.';
+    console.log('Recommendation timings (ms):', page.timings_ms);
+
+    page.recommendations.forEach(book => {
+        const listItem = document.createElement('li');
+        const authors = Array.isArray(book.authors) && book.authors.length ? book.authors.join(', ') : 'Unknown Author';
+        listItem.textContent = `${book.title || 'Unknown Title'} by ${authors} (ISBN: ${book.isbn})`;
+        listElement.appendChild(listItem);
+    });
+
+    if (page.next_cursor) {
+        const moreButton = document.createElement('button');
+        moreButton.textContent = 'More recommendations';
+        moreButton.onclick = () => pollRecommendations(page.result_id, page.next_cursor);
+        recommendationsDiv.appendChild(moreButton);
+    }
+}
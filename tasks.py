@@ -1,24 +1,88 @@
 import time
-from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
 from redis import Redis, RedisError
-from rq import Queue
+from rq import get_current_job
 import json
 import os
 import requests
-import spacy
-from spacy.lang.en.stop_words import STOP_WORDS
 import sqlite3
-import math
+import threading
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from isbnlib import canonical, is_isbn10, is_isbn13, to_isbn13
+import feature_index
+import google_books
+import job_progress
+import llm_cache
+import ollama_client
+import recommendation_cache
+import recommendation_pages
+import user_profiles
+
+# Keyword extraction only needs POS tags and lemmas, so the parser and NER are never loaded
+KEYWORD_PIPELINE_EXCLUDE = ["parser", "ner", "senter"]
+KEYWORD_BATCH_SIZE = 64
+KEYWORD_N_PROCESS = int(os.environ.get('SPACY_N_PROCESS', 1))
+
+OLLAMA_MODEL = os.environ.get('OLLAMA_MODEL', 'llama3.1:8b')
+
+# 'auto' uses the feature matrix when it's built (and numpy/scipy are installed), 'index' forces the SQL index,
+# 'embedding' uses the approximate nearest-neighbour index over analysis embeddings (see embedding_index)
+RECOMMENDATION_ENGINE = os.environ.get('RECOMMENDATION_ENGINE', 'auto')
+# Concurrent Ollama calls per analysis job for books that miss the cache (match Ollama's OLLAMA_NUM_PARALLEL)
+LLM_ANALYSIS_MAX_WORKERS = int(os.environ.get('LLM_ANALYSIS_MAX_WORKERS', 4))
+# Books per Ollama prompt for cache misses; 1 keeps the single-book prompt (see get_llm_analyses_batched)
+LLM_BATCH_SIZE = int(os.environ.get('LLM_BATCH_SIZE', 1))
+
+# How long a job waits for the books.db write lock held by another worker
+SQLITE_BUSY_TIMEOUT_SECONDS = 30
+
+# How many ranked recommendations a /recommendations request scores and stores for paging
+RECOMMENDATION_RESULT_SIZE = int(os.environ.get('RECOMMENDATION_RESULT_SIZE', 100))
 
-analyser = SentimentIntensityAnalyzer()
-nlp = spacy.load("en_core_web_sm")
 custom_stop_words = ['book', 'novel', 'story', 'page', 'read', 'author', 'world', 'new', 'man', 'woman', 'time']
-all_stop_words = STOP_WORDS.union(custom_stop_words)
+
+# spaCy and VADER are loaded on first use (or by warm_up_models) so importing this module stays cheap
+_nlp = None
+_all_stop_words = None
+_analyser = None
+_model_lock = threading.Lock()
+
+def get_nlp():
+    """Returns the trimmed spaCy pipeline used for keyword extraction, loading it on first call."""
+    global _nlp, _all_stop_words
+    if _nlp is None:
+        with _model_lock:
+            if _nlp is None:
+                import spacy
+                from spacy.lang.en.stop_words import STOP_WORDS
+                print("Loading spaCy model en_core_web_sm...")
+                _all_stop_words = STOP_WORDS.union(custom_stop_words)
+                _nlp = spacy.load("en_core_web_sm", exclude=KEYWORD_PIPELINE_EXCLUDE)
+    return _nlp
+
+def get_sentiment_analyser():
+    """Returns the VADER SentimentIntensityAnalyzer, building it on first call."""
+    global _analyser
+    if _analyser is None:
+        with _model_lock:
+            if _analyser is None:
+                from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+                _analyser = SentimentIntensityAnalyzer()
+    return _analyser
+
+def warm_up_models():
+    """
+    Loads every lazily-initialised model up front. Call this in a worker's parent
+    process before it starts taking jobs, so forked job processes inherit the models.
+    """
+    start = time.perf_counter()
+    get_nlp()
+    get_sentiment_analyser()
+    print(f"Models warmed up in {time.perf_counter() - start:.2f}s")
 
 def analyse_review(review_text):
     print(f"Processing review in background: {review_text}")
-    vs = analyser.polarity_scores(review_text)
+    vs = get_sentiment_analyser().polarity_scores(review_text)
     compound_score = vs['compound']
 
     if compound_score >= 0.05:
@@ -33,55 +97,21 @@ def analyse_review(review_text):
     print(result)
     return result
 
-def find_books_via_google_search(user_book_titles):
-    """Searches Google Books API for potential matches for user-entered titles."""
+def find_books_via_google_search(user_book_titles, max_workers=google_books.SEARCH_MAX_WORKERS):
+    """
+    Searches Google Books API for potential matches for user-entered titles.
+    Titles are searched concurrently (bounded by max_workers and a per-host limit);
+    pass max_workers=1 for sequential searching. Results keep the input order.
+    """
     results_list = []
     print(f"Starting Google Books search for: {user_book_titles}")
 
-    for user_title in user_book_titles:
-        user_title_processed = user_title.strip()
-        if not user_title_processed:
-            continue
+    redis_connection = Redis(decode_responses=True)
+    titles_to_search = [title for title in user_book_titles if title.strip()]
+    matches_per_title = google_books.search_titles([title.strip() for title in titles_to_search],
+                                                   max_workers=max_workers, redis_conn=redis_connection)
 
-        possible_matches = []
-        print(f" - Searching for: '{user_title_processed}'")
-        search_url = f"https://www.googleapis.com/books/v1/volumes?q=intitle:{requests.utils.quote(user_title_processed)}&langRestrict=en&maxResults=5&projection-lite"
-        
-        try:
-            response = requests.get(search_url, timeout=10)
-            response.raise_for_status()
-            data = response.json()
-
-            if data.get("totalItems", 0) > 0 and "items" in data:
-                for item in data["items"]:
-                    volume_info = item.get("volumeInfo", {})
-                    title = volume_info.get("title")
-                    authors = volume_info.get("authors", ["Unknown Author"])
-                    isbn13 = None
-                    isbn10 = None
-
-                    identifiers = volume_info.get("industryIdentifiers", [])
-                    for identifier in identifiers:
-                        if identifier.get("type") == "ISBN_13":
-                            isbn13 = identifier.get("identifier")
-                        elif identifier.get("type") == "ISBN_10":
-                            isbn10 = identifier.get("identifier")
-                    
-                    if isbn13 or isbn10:
-                        match_data = {
-                            "match": {
-                                "title": title,
-                                "authors": authors,
-                                "isbn": isbn13 if isbn13 else isbn10
-                            },
-                        }
-                        possible_matches.append(match_data)
-
-        except requests.exceptions.RequestException as e:
-            print(f"   - Error searching Google Books for '{user_title_processed}': {e}")
-        except Exception as e:
-            print(f"   - Unexpected error processing results for '{user_title_processed}': {e}")
-        
+    for user_title, possible_matches in zip(titles_to_search, matches_per_title):
         results_list.append({
             "user_title": user_title,
             "possible_matches": possible_matches
@@ -91,150 +121,405 @@ def find_books_via_google_search(user_book_titles):
     return {"results_per_title": results_list}
 
 
-def extract_keywords_from_text(text):
+def fetch_book_details_task(isbn_list, max_workers=google_books.SEARCH_MAX_WORKERS):
+    """
+    Fetches Google Books details (plus batched spaCy keywords) for the confirmed ISBNs.
+    Lookups run concurrently over the shared connection pool; each finished book is
+    published to the job's meta['partial_results'] straight away so the frontend can
+    show progress before the whole list is done.
+    """
+    job = get_current_job()
+    redis_connection = Redis(decode_responses=True)
+    book_data = {}
+    print(f"Fetching book details for {len(isbn_list)} ISBNs...")
+
+    def publish_progress():
+        if job:
+            job.meta['partial_results'] = book_data
+            job.meta['completed'] = len(book_data)
+            job.meta['total'] = len(isbn_list)
+            job.save_meta()
+
+    publish_progress()
+    if not isbn_list:
+        return book_data
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(isbn_list))) as executor:
+        futures = {executor.submit(google_books.fetch_volume_details, isbn, redis_connection): isbn for isbn in isbn_list}
+        for future in as_completed(futures):
+            isbn = futures[future]
+            book_data[isbn] = future.result()
+            publish_progress()
+
+    # Keywords for every found book in a single spaCy batch, once the network work is done
+    found_isbns = [isbn for isbn, details in book_data.items() if not details.get('not_found') and not details.get('error')]
+    keywords_per_book = extract_keywords_batch([book_data[isbn].get('description') for isbn in found_isbns])
+    for isbn, keywords in zip(found_isbns, keywords_per_book):
+        book_data[isbn]['keywords'] = keywords
+    publish_progress()
+
+    print("Finished fetching book details.")
+    # Return in the order the user confirmed the books
+    return {isbn: book_data[isbn] for isbn in isbn_list if isbn in book_data}
+
+
+def _keywords_from_doc(doc):
     keywords = []
-    doc = nlp(text.lower())
-
     for token in doc:
         if (token.pos_ in ['NOUN', 'ADJ'] and
-            token.lemma_ not in all_stop_words and
+            token.lemma_ not in _all_stop_words and
             not token.is_punct and
             token.pos_ != 'PROPN' and
             len(token.lemma_) > 2):
             keywords.append(token.lemma_)
-    
     return keywords
 
+def extract_keywords_batch(texts, batch_size=KEYWORD_BATCH_SIZE, n_process=KEYWORD_N_PROCESS):
+    """
+    Extracts keywords for many descriptions in one nlp.pipe pass.
+    Returns one keyword list per input text, in order; empty/None texts give [].
+    """
+    keywords_per_text = [[] for _ in texts]
+    indexed_texts = [(i, text.lower()) for i, text in enumerate(texts) if text]
+    if not indexed_texts:
+        return keywords_per_text
+
+    docs = get_nlp().pipe((text for _, text in indexed_texts), batch_size=batch_size, n_process=n_process)
+    for (i, _), doc in zip(indexed_texts, docs):
+        keywords_per_text[i] = _keywords_from_doc(doc)
+    return keywords_per_text
+
+def extract_keywords_from_text(text):
+    return extract_keywords_batch([text])[0]
+
+# The instructions shared by the single-book and batched prompts (the single-book prompt's
+# text is unchanged by the split, so existing cache entries stay valid)
+LLM_ANALYSIS_FIELDS = (
+    "1. genre: List the primary genre(s). These should be broad genres so that similar stories can be easily grouped together, so avoid compound genre titles \
+                (e.g., 'science fiction, 'historical fantasy', 'thriller').\n"
+    "2. setting_period: State the primary time period \
+                (e.g., 'contemporary', 'Victorian era', 'futuristic')\n"
+    "3. setting_location: Describe the primary location or type of setting \
+                (e.g., 'London, England', 'Small town USA', 'space station', 'fictional kingdom')\n"
+    "4. tone: List up to three primary tones (e.g. 'humourous', 'suspenseful', 'bleak', 'nostalgic', 'satirical')\n"
+    "5. target_audience: State the primary target audience \
+                (e.g. 'children', 'young adult')\n"
+    "6. themes: a list of the top 5-7 recurring themes or key aspects frequently discussed by readers, in single words or commonly used two-word phrases (e.g., 'vanity', 'hedonism', 'freedom') \n"
+    "7. sentiment: A brief (one-sentence) summary of the overall reader sentiment towards the book \
+                (e.g., beloved classic, controversial, thought-provoking, enjoyable adventure, etc.).\n"
+)
+LLM_OUTPUT_KEYS = (
+    "\
+                'genre': (list of strings), \
+                'setting_period': (string), \
+                'setting_location': (string), \
+                'tone': (list of strings), \
+                'target_audience': string, \
+                'themes': (a list of strings) and \
+                'sentiment': (a string). \
+                Do not include any text outside of the JSON object. The output will be used to categorise and compare books, so all of the data should be broad enough to allow for this."
+)
+
+LLM_PROMPT_TEMPLATE = (
+    "Analyse the book '{title} by {author}. Based on public knowledge and common reader discussions, please provide:\n"
+    + LLM_ANALYSIS_FIELDS
+    + "Format the output ONLY as a valid JSON object with these exact keys: "
+    + LLM_OUTPUT_KEYS
+)
+
+# One request for several books: the instruction block is sent (and prefilled) once per batch
+LLM_BATCH_PROMPT_TEMPLATE = (
+    "Analyse each of the books listed below. Based on public knowledge and common reader discussions, provide for each book:\n"
+    + LLM_ANALYSIS_FIELDS
+    + "Format the output ONLY as a valid JSON object with one entry per book, keyed by the book's ISBN exactly as given. "
+    "Each entry must be a JSON object with these exact keys: "
+    + LLM_OUTPUT_KEYS
+    + "\nBooks:\n{books}"
+)
+
+def build_llm_prompt(title, author):
+    return LLM_PROMPT_TEMPLATE.format(title=title, author=author)
+
+def build_llm_batch_prompt(books):
+    """books is a list of (isbn, title, author) tuples."""
+    listing = "\n".join(f"- ISBN {isbn}: '{title}' by {author}" for isbn, title, author in books)
+    return LLM_BATCH_PROMPT_TEMPLATE.format(books=listing)
+
+# The single-book and batched prompts deliberately share one cache namespace, fingerprinted
+# from LLM_PROMPT_TEMPLATE: both carry the same LLM_ANALYSIS_FIELDS/LLM_OUTPUT_KEYS
+# instructions and their results pass the same validate_llm_results check, so an analysis
+# is interchangeable whichever prompt produced it. Changing the shared instructions changes
+# LLM_PROMPT_TEMPLATE and so still invalidates every entry; a change to the batch framing
+# alone does not.
+def current_llm_cache_namespace():
+    return llm_cache.cache_namespace(OLLAMA_MODEL, LLM_PROMPT_TEMPLATE)
+
+def llm_cache_key(isbn):
+    return llm_cache.cache_key(isbn, OLLAMA_MODEL, LLM_PROMPT_TEMPLATE)
+
 def get_llm_analysis_for_book_local(book_data, redis_conn):
-    isbn = book_data.get('isbn')
-    title = book_data.get('title')
+    llm_results, _ = get_llm_analysis_with_source(book_data, redis_conn)
+    return llm_results
 
-    authors_list = []
-    authors_data = book_data.get('authors') # Could be list or JSON string
+def analyse_books_concurrently(books, redis_conn, max_workers=LLM_ANALYSIS_MAX_WORKERS, batch_size=LLM_BATCH_SIZE):
+    """
+    Yields (index, llm_results) for each book as soon as its analysis is available:
+    every cache hit first, resolved with a single MGET, then the misses in completion
+    order as up to `max_workers` concurrent Ollama calls finish. With batch_size > 1 the
+    misses are sent `batch_size` books per prompt (see get_llm_analyses_batched). Callers
+    that need input order place results by index.
+    """
+    cache_keys = [llm_cache_key(book.get('isbn')) for book in books]
+    try:
+        cached = llm_cache.get_cached_analyses(redis_conn, cache_keys)
+    except RedisError as e:
+        print(f"Redis error during batch cache lookup: {e}. Checking books individually.")
+        cached = [None] * len(books)
+
+    misses = []
+    for index, (book, llm_results) in enumerate(zip(books, cached)):
+        if llm_results is not None:
+            print(f"Cache HIT for ISBN {book.get('isbn')}")
+            yield index, llm_results
+        else:
+            misses.append(index)
+    if not misses:
+        return
+
+    print(f"{len(misses)} of {len(books)} book(s) need Ollama; analysing up to {max_workers} at a time...")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        if batch_size > 1:
+            batches = [misses[i:i + batch_size] for i in range(0, len(misses), batch_size)]
+            futures = {executor.submit(get_llm_analyses_batched, [books[index] for index in batch], redis_conn): batch
+                       for batch in batches}
+            for future in as_completed(futures):
+                yield from zip(futures[future], future.result())
+        else:
+            futures = {executor.submit(get_llm_analysis_with_source, books[index], redis_conn, False): index
+                       for index in misses}
+            for future in as_completed(futures):
+                llm_results, _ = future.result() # never raises; errors come back as None
+                yield futures[future], llm_results
 
+def get_llm_analyses_batched(books, redis_conn):
+    """
+    Analyses several cache-missing books with one batched prompt. Each book's in-flight
+    lock is taken first, as in get_llm_analysis_with_source, and the cache re-checked
+    for the books we hold; only the rest are sent. Valid entries are cached under the
+    shared namespace (see llm_cache_key). Once the locks are released, books the batch
+    didn't answer validly, and books another worker was already analysing, go through
+    get_llm_analysis_with_source one at a time, which waits for the other worker or
+    calls Ollama singly. Returns a list of analyses (or None) aligned with `books`.
+    """
+    results = [None] * len(books)
+    tokens = {} # index -> (cache key, in-flight token)
+    to_send = []
+    try:
+        for index, book in enumerate(books):
+            cache_key = llm_cache_key(book.get('isbn'))
+            token = llm_cache.acquire_inflight(redis_conn, cache_key)
+            if token is None:
+                continue # another worker has it; waited on below
+            tokens[index] = (cache_key, token)
+            cached_results = llm_cache.get_cached_analysis(redis_conn, cache_key, record=False)
+            if cached_results is not None:
+                llm_cache.record_event(redis_conn, 'coalesced')
+                results[index] = cached_results
+            else:
+                to_send.append(index)
+
+        if to_send:
+            batch = []
+            for index in to_send:
+                isbn = books[index].get('isbn')
+                authors_list = _parse_authors(books[index].get('authors'), isbn)
+                batch.append((isbn, books[index].get('title'), authors_list[0] if authors_list else 'Unknown Author'))
+            print(f"Calling local Ollama API ({OLLAMA_MODEL}) with a batched prompt for {len(batch)} books...")
+            llm_cache.record_event(redis_conn, 'ollama_calls')
+            llm_cache.record_event(redis_conn, 'batched_books', len(batch))
+            batch_results = _call_ollama_for_batch(batch)
+            for index in to_send:
+                llm_results = batch_results.get(books[index].get('isbn'))
+                if llm_results is not None:
+                    llm_cache.store_analysis(redis_conn, tokens[index][0], llm_results)
+                    results[index] = llm_results
+    except RedisError as e:
+        print(f"Redis error during batched LLM analysis: {e}. Falling back to single-book calls.")
+    except requests.exceptions.RequestException as e:
+        print(f"Error calling local Ollama API at {ollama_client.OLLAMA_URL} for a batch: {e}. Falling back to single-book calls.")
+    except Exception as e:
+        print(f"An unexpected error occured in get_llm_analyses_batched: {e}. Falling back to single-book calls.")
+    finally:
+        # Released before the fallbacks, which take the locks again themselves (and wake waiters now)
+        for cache_key, token in tokens.values():
+            llm_cache.release_inflight(redis_conn, cache_key, token)
+
+    for index, book in enumerate(books):
+        if results[index] is None:
+            print(f"No batched analysis for ISBN {book.get('isbn')}. Analysing it on its own...")
+            results[index], _ = get_llm_analysis_with_source(book, redis_conn, check_cache=False)
+    return results
+
+def _parse_authors(authors_data, isbn):
+    """Authors may arrive as a list (Google Books) or a JSON list string (books.db)."""
     if isinstance(authors_data, list):
-        authors_list = authors_data
+        return authors_data
     elif isinstance(authors_data, str):
         if authors_data.strip():
             try:
                 parsed_authors = json.loads(authors_data)
                 if isinstance(parsed_authors, list):
-                    authors_list = parsed_authors
-                else:
-                    print(f"Warning: Parsed authors JSON string for ISBN {isbn} was not a list: {parsed_authors}")
-                    authors_list = [] 
+                    return parsed_authors
+                print(f"Warning: Parsed authors JSON string for ISBN {isbn} was not a list: {parsed_authors}")
             except json.JSONDecodeError:
                 print(f"Warning: Could not parse authors as JSON for ISBN {isbn}. Input: '{authors_data}'")
-                authors_list = []
-        else: 
-            authors_list = []
+        return []
     elif authors_data is None:
-         authors_list = []
-    else:
-         print(f"Warning: Unexpected type for authors field for ISBN {isbn}: {type(authors_data)}")
-         authors_list = []
+        return []
+    print(f"Warning: Unexpected type for authors field for ISBN {isbn}: {type(authors_data)}")
+    return []
+
+def _call_ollama_for_analysis(isbn, title, author):
+    """
+    Sends the analysis prompt for one book to Ollama and validates the JSON it returns.
+    Returns the analysis dict, or None for empty/invalid output. Request errors propagate.
+    """
+    try:
+        llm_output_str = ollama_client.generate(build_llm_prompt(title, author), OLLAMA_MODEL)
+    except ollama_client.GenerationAborted as e:
+        print(f"Error: Ollama generation for {isbn} was aborted: {e}")
+        return None
+
+    if not llm_output_str:
+        print(f"Warning: Empty response content from Ollama for {isbn}")
+        return None
+
+    try:
+        llm_results = json.loads(llm_output_str)
+    except json.JSONDecodeError:
+        print(f"Error: LLM output for {isbn} was not valid json despite requesting JSON format.")
+        print(f"Raw output string was: {llm_output_str}")
+        return None
+
+    return validate_llm_results(llm_results, isbn)
+
+def validate_llm_results(llm_results, isbn):
+    """
+    The expected-keys check for one book's analysis. Coerces the list fields to lists and
+    returns the analysis, or None if it isn't a dict with every expected key.
+    """
+    expected_keys = {'genre', 'setting_period', 'setting_location', 'tone', 'target_audience', 'themes', 'sentiment'}
+    if isinstance(llm_results, dict) and expected_keys.issubset(llm_results.keys()):
+        if not isinstance(llm_results.get('genre'), list): llm_results['genre'] = [str(llm_results.get('genre'))]
+        if not isinstance(llm_results.get('tone'), list): llm_results['tone'] = [str(llm_results.get('tone'))]
+        if not isinstance(llm_results.get('themes'), list): llm_results['themes'] = [str(llm_results.get('themes'))]
+        return llm_results
 
+    print(f"Warning: LLM response for {isbn} lacked expected keys. Parse: {llm_results}")
+    return None
+
+def _call_ollama_for_batch(books):
+    """
+    Sends one batched prompt for several books, given as (isbn, title, author) tuples.
+    Returns {isbn: analysis} for the entries that pass validate_llm_results; books that
+    are missing or invalid are left out for the caller to retry singly. Request errors propagate.
+    """
+    try:
+        llm_output_str = ollama_client.generate(build_llm_batch_prompt(books), OLLAMA_MODEL,
+                                                num_predict=ollama_client.OLLAMA_NUM_PREDICT * len(books))
+    except ollama_client.GenerationAborted as e:
+        print(f"Error: Batched Ollama generation for {len(books)} books was aborted: {e}")
+        return {}
+    try:
+        batch_results = json.loads(llm_output_str) if llm_output_str else None
+    except json.JSONDecodeError:
+        print(f"Error: Batched LLM output for {len(books)} books was not valid json.")
+        return {}
+    if not isinstance(batch_results, dict):
+        print(f"Warning: Batched LLM output for {len(books)} books was not a JSON object keyed by ISBN.")
+        return {}
+
+    valid_results = {}
+    for isbn, _, _ in books:
+        llm_results = validate_llm_results(batch_results.get(isbn), isbn)
+        if llm_results is not None:
+            valid_results[isbn] = llm_results
+    return valid_results
+
+def get_llm_analysis_with_source(book_data, redis_conn, check_cache=True):
+    """
+    Same as get_llm_analysis_for_book_local, but returns (llm_results, cache_hit) so
+    callers that pace Ollama calls can tell a cache hit from a real model call.
+    check_cache=False skips the initial lookup, for callers that already batch-checked it.
+
+    Concurrent misses for the same cache key are coalesced: the first worker takes an
+    in-flight lock and calls Ollama, the others wait for its result (counted as
+    'coalesced' in the cache stats) instead of repeating the call.
+    """
+    isbn = book_data.get('isbn')
+    title = book_data.get('title')
+
+    authors_list = _parse_authors(book_data.get('authors'), isbn)
     author = authors_list[0] if authors_list else 'Unknown Author'
 
     if not isbn or not title:
         print("Warning: Missing ISBN or Title, cannot cache or analyse.")
-        return None
+        return None, False
     
-    cache_key = f"llm_cache:{isbn}"
-    ollama_url = "http://localhost:11434/api/generate"
-    model_name = "llama3.1:8b"
+    cache_key = llm_cache_key(isbn)
     llm_results = None
+    inflight_token = None
 
     try:
-        cached_data = redis_conn.get(cache_key)
-        if cached_data:
+        cached_results = llm_cache.get_cached_analysis(redis_conn, cache_key) if check_cache else None
+        if cached_results is not None:
             print(f"Cache HIT for ISBN {isbn}")
-            try:
-                llm_results = json.loads(cached_data)
-                return llm_results
-            except json.JSONDecodeError:
-                print(f"Warning: Could not parse cached JSON for {isbn}. Fetching fresh.")
-        
-        print(f"Cache MISS for ISBN {isbn}. Calling local Ollama API ({model_name})...")
-
-        prompt = (
-            f"Analyse the book '{title} by {author}. Based on public knowledge and common reader discussions, please provide:\n"
-            f"1. genre: List the primary genre(s). These should be broad genres so that similar stories can be easily grouped together, so avoid compound genre titles \
-                (e.g., 'science fiction, 'historical fantasy', 'thriller').\n"
-            f"2. setting_period: State the primary time period \
-                (e.g., 'contemporary', 'Victorian era', 'futuristic')\n"
-            f"3. setting_location: Describe the primary location or type of setting \
-                (e.g., 'London, England', 'Small town USA', 'space station', 'fictional kingdom')\n"
-            f"4. tone: List up to three primary tones (e.g. 'humourous', 'suspenseful', 'bleak', 'nostalgic', 'satirical')\n"
-            f"5. target_audience: State the primary target audience \
-                (e.g. 'children', 'young adult')\n"
-            f"6. themes: a list of the top 5-7 recurring themes or key aspects frequently discussed by readers, in single words or commonly used two-word phrases (e.g., 'vanity', 'hedonism', 'freedom') \n"
-            f"7. sentiment: A brief (one-sentence) summary of the overall reader sentiment towards the book \
-                (e.g., beloved classic, controversial, thought-provoking, enjoyable adventure, etc.).\n"
-            f"Format the output ONLY as a valid JSON object with these exact keys: \
-                'genre': (list of strings), \
-                'setting_period': (string), \
-                'setting_location': (string), \
-                'tone': (list of strings), \
-                'target_audience': string, \
-                'themes': (a list of strings) and \
-                'sentiment': (a string). \
-                Do not include any text outside of the JSON object. The output will be used to categorise and compare books, so all of the data should be broad enough to allow for this."
-        )
-
-        payload = {
-            "model": model_name,
-            "prompt": prompt,
-            "stream": False,
-            "format": "json"
-        }
-        headers = {'Content-Type': 'application/json'}
-
-        response = requests.post(ollama_url, headers=headers, data=json.dumps(payload), timeout=300)
-        response.raise_for_status()
-
-        ollama_response_data = response.json()
-        llm_output_str = ollama_response_data.get("response", "")
-
-        if not llm_output_str:
-            print(f"Warning: Empty response content from Ollama for {isbn}")
-            return None
-        
-        try:
-            llm_results = json.loads(llm_output_str)
-            expected_keys = {'genre', 'setting_period', 'setting_location', 'tone', 'target_audience', 'themes', 'sentiment'}
-            if isinstance(llm_results, dict) and expected_keys.issubset(llm_results.keys()):
-                if not isinstance(llm_results.get('genre'), list): llm_results['genre'] = [str(llm_results.get('genre'))]
-                if not isinstance(llm_results.get('tone'), list): llm_results['tone'] = [str(llm_results.get('tone'))]
-                if not isinstance(llm_results.get('themes'), list): llm_results['themes'] = [str(llm_results.get('themes'))]
-
-                redis_conn.set(cache_key, llm_output_str)
-                # redis_conn.expire(cache_key, 3600 * 24 * 30) # expire in 30 days
-                print(f"Stored LLM response in cache for ISBN {isbn}")
-            else:
-                print(f"Warning: LLM response for {isbn} lacked expected keys. Parse: {llm_results}")
-                llm_results = None
-        except json.JSONDecodeError:
-            print(f"Error: LLM output for {isbn} was not valid json despite requesting JSON format.")
-            print(f"Raw output string was: {llm_output_str}")
-            llm_results = None
+            return cached_results, True
+
+        inflight_token = llm_cache.acquire_inflight(redis_conn, cache_key)
+        if inflight_token is None:
+            print(f"ISBN {isbn} is already being analysed by another worker. Waiting for its result...")
+            llm_results = llm_cache.wait_for_inflight(redis_conn, cache_key)
+            if llm_results is not None:
+                llm_cache.record_event(redis_conn, 'coalesced')
+                return llm_results, True
+            # The other worker gave up or failed; take over (or call without the lock if someone else did)
+            inflight_token = llm_cache.acquire_inflight(redis_conn, cache_key)
+
+        if inflight_token is not None:
+            # Another worker may have stored the analysis since our lookup (or just released the lock)
+            cached_results = llm_cache.get_cached_analysis(redis_conn, cache_key, record=False)
+            if cached_results is not None:
+                llm_cache.record_event(redis_conn, 'coalesced')
+                return cached_results, True
+
+        print(f"Cache MISS for ISBN {isbn}. Calling local Ollama API ({OLLAMA_MODEL})...")
+        llm_cache.record_event(redis_conn, 'ollama_calls')
+        llm_results = _call_ollama_for_analysis(isbn, title, author)
+
+        if llm_results is not None:
+            llm_cache.store_analysis(redis_conn, cache_key, llm_results)
+            print(f"Stored LLM response in cache for ISBN {isbn}")
     
     except RedisError as e:
         print(f"Redis error for key {cache_key}: {e}. Cannot use cache.")
         llm_results = None
     except requests.exceptions.RequestException as e:
-        print(f"Error calling local Ollama API at {ollama_url}: {e}")
+        print(f"Error calling local Ollama API at {ollama_client.OLLAMA_URL}: {e}")
         print("Is the Ollama service running?")
         llm_results = None
     except Exception as e:
         print(f"An unexpected error occured in get_llm_analysis_for_book_local for {isbn}: {e}")
         llm_results = None
+    finally:
+        if inflight_token is not None:
+            llm_cache.release_inflight(redis_conn, cache_key, inflight_token)
     
-    return llm_results
+    return llm_results, False
 
 # --- Gathers LLM derived data in books.db as well as Google Books API data to make profile of user's preferences ---
 # Weights books based on their Google Books API averageRating and ratingCount data
-# Raw weighted counts stored for later use in calculate_similarity function
+# Raw weighted counts are kept in the profile; recommendation scoring (feature_index / feature_matrix) weights candidates by them
 def generate_user_profile(analysed_user_books):
     """
     Processes data from the user's analysed books to create a preference profile
@@ -251,359 +536,342 @@ def generate_user_profile(analysed_user_books):
         print("Warning: generate_user_profile received invalid or empty input.")
         return {}
     
-    feature_aggregation = {
-        'genre': Counter(),
-        'tone': Counter(),
-        'theme': Counter(),
-        'setting_period': Counter(),
-        'setting_location': Counter(),
-        'target_audience': Counter()
-    }
+    feature_aggregation = {kind: Counter() for kind in user_profiles.PROFILE_FEATURES}
     all_authors = []
     read_isbns = list(analysed_user_books.keys())
     
     total_google_rating_points = 0
     total_google_ratings_count_for_avg = 0
-    books_with_google_rating_data = 0
 
     for isbn, book_details in analysed_user_books.items():
         if not book_details or not isinstance(book_details, dict):
             continue
 
-        book_weight = 1.0
-        avg_rating = book_details.get('averageRating')
-        ratings_count = book_details.get('ratingsCount')
-
-        if avg_rating is not None and ratings_count is not None:
-            try:
-                r = float(avg_rating)
-                c = int(ratings_count)
-                if r > 0 and c > 0:
-                    # ensure that rating is between 1 and 5
-                    clamped_rating = max(1, min(r, 5))
-                    # use logarithmic scale to valance ratings counts for books of vastly differing popularity
-                    # examples:
-                    #   log10(10 + 1) ≈ 1.04
-                    #   log10(100 + 1) ≈ 2.00
-                    #   log10(1000 + 1) ≈ 3.00
-                    #   log10(100000 + 1) ≈ 5.00
-                    book_weight = clamped_rating * math.log10(c+1) # +1 for books that might have 0 ratings
-
-                    total_google_rating_points += r * c
-                    total_google_ratings_count_for_avg += c
-                    books_with_google_rating_data += 1
-            except (ValueError, TypeError):
-                book_weight = 1.0
-
-        def aggregate_list_feature(items, feature_name):
-            if items and isinstance(items, list):
-                for item in items:
-                    if item and isinstance(item, str):
-                        feature_aggregation[feature_name][item.lower()] += book_weight
-        
-        def aggregate_string_feature(item_value, feature_name):
-            if item_value and isinstance(item_value, str):
-                feature_aggregation[feature_name][item_value.lower()] += book_weight
-        
-        aggregate_list_feature(book_details.get('llm_genre'), 'genre')
-        aggregate_list_feature(book_details.get('llm_tone'), 'tone')
-        aggregate_list_feature(book_details.get('llm_themes'), 'theme')
-
-        aggregate_string_feature(book_details.get('llm_setting_period'),'setting_period')
-        aggregate_string_feature(book_details.get('llm_setting_location'),'setting_location')
-        aggregate_string_feature(book_details.get('llm_target_audience'),'target_audience')
-
-        authors_list = book_details.get('authors', [])
-        if isinstance(authors_list, list):
-            all_authors.extend(a.lower() for a in authors_list if a and isinstance(a, str))
-
-    user_profile = {
-        'top_genres': [item[0] for item in  feature_aggregation['genre'].most_common(3)],
-        'top_tones': [item[0] for item in  feature_aggregation['tone'].most_common(3)],
-        'top_themes': [item[0] for item in  feature_aggregation['theme'].most_common(10)],
-        'top_periods': [item[0] for item in  feature_aggregation['setting_period'].most_common(2)],
-        'top_locations': [item[0] for item in  feature_aggregation['setting_location'].most_common(2)],
-        'top_audiences': [item[0] for item in  feature_aggregation['target_audience'].most_common(2)],
+        # Same per-book weighting and features the incremental Redis profiles use
+        contribution = user_profiles.book_contribution(book_details)
+        for kind, items in contribution['features'].items():
+            for item in items:
+                feature_aggregation[kind][item] += contribution['weight']
+        all_authors.extend(contribution['authors'])
+        if contribution['rating']:
+            rating_points, ratings_count = contribution['rating']
+            total_google_rating_points += rating_points
+            total_google_ratings_count_for_avg += ratings_count
+
+    user_profile = {}
+    for kind, (_, top_key, top_k, _) in user_profiles.PROFILE_FEATURES.items():
+        user_profile[top_key] = [item[0] for item in feature_aggregation[kind].most_common(top_k)]
+    user_profile.update({
         'read_authors': list(set(all_authors)),
         'read_isbns': read_isbns,
 
         'avg_input_google_rating': (total_google_rating_points / total_google_ratings_count_for_avg) if total_google_ratings_count_for_avg > 0 else None,
         'total_input_google_ratings_count': total_google_ratings_count_for_avg,
-
-        'weighted_genres': dict(feature_aggregation['genre']),
-        'weighted_tones': dict(feature_aggregation['tone']),
-        'weighted_themes': dict(feature_aggregation['theme']),
-        'weighted_setting_periods': dict(feature_aggregation['setting_period']),
-        'weighted_setting_locations': dict(feature_aggregation['setting_location']),
-        'weighted_target_audiences': dict(feature_aggregation['target_audience'])
-    }
+    })
+    for kind, (_, _, _, weighted_key) in user_profiles.PROFILE_FEATURES.items():
+        user_profile[weighted_key] = dict(feature_aggregation[kind])
 
     print(f"Generated User Profile: {json.dumps(user_profile, indent=2)}")
     return user_profile
 
 def background_book_analysis_task(book_list_data):
+    """
+    Analyses the user's confirmed books and builds their profile. Each book's result is
+    published to the job's progress stream as soon as it is ready (see job_progress),
+    followed by a final 'done' event carrying the full result.
+    """
     redis_connection = Redis(decode_responses=True)
-    db_path = 'data/books.db'
+    job = get_current_job()
+    job_id = job.id if job else None
+    try:
+        result = _analyse_books(book_list_data, redis_connection, job_id)
+    except Exception as e:
+        if job_id:
+            job_progress.publish_event(redis_connection, job_id, 'failed', {'error': str(e)})
+        raise
+    if job_id:
+        job_progress.publish_event(redis_connection, job_id, 'done', result)
+    return result
 
-    analysed_books_dict = {}
+# books.db / profile field -> key in the LLM analysis
+LLM_RESULT_FIELDS = {
+    'llm_genre': 'genre',
+    'llm_setting_period': 'setting_period',
+    'llm_setting_location': 'setting_location',
+    'llm_tone': 'tone',
+    'llm_target_audience': 'target_audience',
+    'llm_themes': 'themes',
+    'llm_sentiment': 'sentiment',
+}
+
+def book_with_llm_analysis(book, llm_analysis):
+    """Copy of the book's details with its llm_* fields set from the analysis (all None without one)."""
+    result = book.copy()
+    for field, analysis_key in LLM_RESULT_FIELDS.items():
+        result[field] = llm_analysis.get(analysis_key) if llm_analysis else None
+    return result
+
+def _isbn13_key(isbn):
+    """The books.isbn13 key for an ISBN from Google Books (which may be an ISBN-10), or None."""
+    if isbn and is_isbn13(isbn):
+        return canonical(isbn)
+    if isbn and is_isbn10(isbn):
+        converted_isbn13 = to_isbn13(isbn)
+        return canonical(converted_isbn13) if is_isbn13(converted_isbn13) else None
+    return None
 
+def write_back_analyses(db_path, rows, redis_conn=None):
+    """
+    Stores a job's analysed books, given as (book, llm_analysis) pairs, in books.db:
+    one executemany UPSERT plus their feature index rows in a single IMMEDIATE
+    transaction. WAL mode lets readers carry on meanwhile, and busy_timeout makes
+    concurrent workers queue for the write lock instead of failing. Books are keyed
+    by their canonical ISBN-13 (ISBN-10s are converted; anything else is skipped).
+
+    If any book was new to the analysed catalogue, a debounced refresh (feature store
+    rebuild and catalogue version bump) is scheduled on the bulk queue; nothing is
+    rebuilt inside the job.
+    """
+    keyed_rows = []
+    for book, llm_analysis in rows:
+        isbn13 = _isbn13_key(book.get('isbn'))
+        if isbn13 is None:
+            print(f"Warning: Not writing back ISBN {book.get('isbn')!r}; it isn't a valid ISBN-13 or ISBN-10.")
+            continue
+        isbn10 = canonical(book['isbn']) if is_isbn10(book['isbn']) else None
+        keyed_rows.append((isbn13, isbn10, book, llm_analysis))
+    if not keyed_rows:
+        return 0
     sqlite_conn = None
     try:
-        sqlite_conn = sqlite3.connect(db_path)
-        sqlite_cursor = sqlite_conn.cursor()
-        print(f"Connected to SQLite DB: {db_path} for updates.")
+        sqlite_conn = sqlite3.connect(db_path, timeout=SQLITE_BUSY_TIMEOUT_SECONDS, isolation_level=None)
+        sqlite_conn.execute("PRAGMA journal_mode=WAL")
+        sqlite_conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_SECONDS * 1000}")
+        feature_index.ensure_schema(sqlite_conn)
+
+        sqlite_conn.execute("BEGIN IMMEDIATE")
+        isbns = [isbn13 for isbn13, _, _, _ in keyed_rows]
+        already_analysed = {row[0] for row in sqlite_conn.execute(
+            f"SELECT isbn13 FROM books WHERE llm_genre IS NOT NULL AND isbn13 IN ({','.join('?' * len(isbns))})",
+            isbns)}
+        sqlite_conn.executemany("""
+            INSERT INTO books (
+                isbn13, isbn10, title, authors, description, google_categories,
+                llm_genre, llm_themes, llm_tone, llm_setting_period,
+                llm_setting_location, llm_target_audience, llm_sentiment
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(isbn13) DO UPDATE SET
+                isbn10 = COALESCE(books.isbn10, excluded.isbn10),
+                description = COALESCE(excluded.description, books.description),
+                google_categories = excluded.google_categories,
+                llm_genre = excluded.llm_genre,
+                llm_themes = excluded.llm_themes,
+                llm_tone = excluded.llm_tone,
+                llm_setting_period = excluded.llm_setting_period,
+                llm_setting_location = excluded.llm_setting_location,
+                llm_target_audience = excluded.llm_target_audience,
+                llm_sentiment = excluded.llm_sentiment
+        """, [
+            (
+                isbn13,
+                isbn10,
+                book.get('title') or '',
+                json.dumps(book.get('authors') or []),
+                book.get('description'),
+                json.dumps(book.get('categories') or []),
+                json.dumps(llm_analysis.get('genre', [])),
+                json.dumps(llm_analysis.get('themes', [])),
+                json.dumps(llm_analysis.get('tone', [])),
+                llm_analysis.get('setting_period'),
+                llm_analysis.get('setting_location'),
+                llm_analysis.get('target_audience'),
+                llm_analysis.get('sentiment'),
+            )
+            for isbn13, isbn10, book, llm_analysis in keyed_rows
+        ])
+        feature_index.replace_book_features(sqlite_conn, {
+            isbn13: feature_index.features_from_analysis(llm_analysis, book.get('authors'))
+            for isbn13, _, book, llm_analysis in keyed_rows
+        })
+        sqlite_conn.execute("COMMIT")
+        newly_analysed = len(set(isbns) - already_analysed)
+        print(f"Wrote {len(keyed_rows)} analysed book(s) to {db_path} in one transaction "
+              f"({newly_analysed} new to the analysed catalogue).")
     except sqlite3.Error as e:
-        print(f"ERROR: Could not connect to SQLite DB {db_path} in background_book_analysis_task: {e}")
-
-    for book in book_list_data:
-        isbn = book.get('isbn')
-        if not isbn:
-            continue
+        print(f"ERROR: Failed to write analysed books to {db_path}: {e}")
+        if sqlite_conn and sqlite_conn.in_transaction:
+            sqlite_conn.execute("ROLLBACK")
+        return 0
+    finally:
+        if sqlite_conn:
+            sqlite_conn.close()
 
-        llm_analysis = get_llm_analysis_for_book_local(book, redis_connection)
+    if newly_analysed and redis_conn is not None:
+        recommendation_cache.schedule_catalogue_refresh(redis_conn, db_path)
+    return len(keyed_rows)
 
-        current_book_result = book.copy()
+def _analyse_books(book_list_data, redis_connection, job_id=None):
+    db_path = 'data/books.db'
 
+    books = [book for book in book_list_data if book.get('isbn')]
+    results = [None] * len(books)
+
+    # Cache hits arrive at once, misses as their Ollama calls finish; each is published straight away
+    for completed, (index, llm_analysis) in enumerate(analyse_books_concurrently(books, redis_connection), start=1):
+        results[index] = book_with_llm_analysis(books[index], llm_analysis), llm_analysis
+        if job_id:
+            job_progress.publish_event(redis_connection, job_id, 'book', {
+                'isbn': books[index]['isbn'],
+                'book': results[index][0],
+                'completed': completed,
+                'total': len(book_list_data)
+            })
+
+    # Assembled in input order, whatever order the analyses finished in
+    analysed_books_dict = {}
+    write_back_rows = []
+    for book, (current_book_result, llm_analysis) in zip(books, results):
+        analysed_books_dict[book['isbn']] = current_book_result
         if llm_analysis:
-            current_book_result['llm_genre'] = llm_analysis.get('genre')
-            current_book_result['llm_setting_period'] = llm_analysis.get('setting_period')
-            current_book_result['llm_setting_location'] = llm_analysis.get('setting_location')
-            current_book_result['llm_tone'] = llm_analysis.get('tone')
-            current_book_result['llm_target_audience'] = llm_analysis.get('target_audience')
-            current_book_result['llm_themes'] = llm_analysis.get('themes')
-            current_book_result['llm_sentiment'] = llm_analysis.get('sentiment')
-
-            if sqlite_conn:
-                try:
-                    sqlite_cursor.execute("SELECT llm_themes FROM books WHERE isbn13 = ?", (isbn,))
-                    existing_llm_data = sqlite_cursor.fetchone()
-
-                    needs_update= True
-                    if existing_llm_data and existing_llm_data[0] is not None:
-                        pass
-                    if needs_update:
-                        print(f"Attempting to update books.db for ISBN: {isbn} with new LLM data.")
-                        sqlite_cursor.execute("""
-                                      UPDATE books
-                                      SET llm_genre = ?,
-                                          llm_themes = ?,
-                                          llm_tone = ?,
-                                          llm_setting_period = ?,
-                                          llm_setting_location = ?,
-                                          llm_target_audience = ?,
-                                          llm_sentiment = ?,
-                                          description = ?,
-                                          google_categories = ?
-                                      WHERE isbn13 = ?
-                                      """, (
-                                          json.dumps(book.get('llm_genre', [])),
-                                          json.dumps(book.get('llm_themes', [])),
-                                          json.dumps(book.get('llm_tone', [])),
-                                          book.get('llm_setting_period'),
-                                          book.get('llm_setting_location'),
-                                          book.get('llm_target_audience'),
-                                          book.get('llm_sentiment'),
-                                          book.get('description'),
-                                          json.dumps(book.get('categories', [])),
-                                          isbn
-                                      ))
-                        if sqlite_cursor.rowcount == 0:
-                            print(f"Warning: ISBN {isbn} not found in books.db for UPDATE.")
-                        else:
-                            sqlite_conn.commit()
-                            print(f"Successfully updated books.db for ISBN: {isbn}")
-                except sqlite3.Error as e:
-                    print(f"ERROR: Failed to update books.db for ISBN: {isbn}: {e}")
-                    if sqlite_conn: sqlite_conn.rollback()
+            write_back_rows.append((book, llm_analysis))
 
-        else:
-            current_book_result['llm_genre'] = None
-            current_book_result['llm_setting_period'] = None
-            current_book_result['llm_setting_location'] = None
-            current_book_result['llm_tone'] = None
-            current_book_result['llm_target_audience'] = None
-            current_book_result['llm_themes'] = None
-            current_book_result['llm_sentiment'] = None
-        
-        analysed_books_dict[isbn] = current_book_result
-            
-    if sqlite_conn:
-        sqlite_conn.close()
-        print("Closed SQLite DB connection.")
+    write_back_analyses(db_path, write_back_rows, redis_connection)
 
     print("Generating user profile based on analysed books...")
     user_profile = generate_user_profile(analysed_books_dict)
 
-    print("Finish background analysis and profile generation.")
-    return {"analysed_books_map": analysed_books_dict, "user_profile_details": user_profile}
+    # Persist it as an incremental profile (keyed by the job id) that books can later be added to or removed from
+    profile_id = None
+    if job_id:
+        try:
+            user_profiles.add_books(redis_connection, job_id, analysed_books_dict)
+            profile_id = job_id
+        except RedisError as e:
+            print(f"Warning: Could not store the incremental profile: {e}")
 
+    print("Finish background analysis and profile generation.")
+    return {"analysed_books_map": analysed_books_dict, "user_profile_details": user_profile, "profile_id": profile_id}
 
-def calculate_similarity(user_profile, candidate_book_db_row):
+def add_books_to_profile_task(profile_id, book_list_data):
     """
-    Calculates a similarity score between the user profile and a candidate book from the database.
-    candidate_book_db_row is a dict-like object (e.g., sqlite3.Row) from books.db.
-    LLM fields like llm_genre, llm_themes, llm_tone are expected to be JSON strings from DB.
+    Analyses books (cache first, then Ollama) and adds them to an existing incremental
+    profile; only the new books are processed, however long the reading history is.
     """
-    score = 0
-    if not user_profile or not candidate_book_db_row:
-        return 0
+    redis_connection = Redis(decode_responses=True)
+    added = {}
+    for book in book_list_data:
+        isbn = book.get('isbn')
+        if isbn:
+            added[isbn] = book_with_llm_analysis(book, get_llm_analysis_for_book_local(book, redis_connection))
+    user_profiles.add_books(redis_connection, profile_id, added)
+    return {"profile_id": profile_id, "analysed_books_map": added,
+            "user_profile_details": user_profiles.get_profile(redis_connection, profile_id)}
 
-    # Helper to safely parse JSON strings (which might be list or single string) from DB fields into lowercase sets
-    def safe_json_loads_to_lowercase_set(json_str):
-        if json_str and isinstance(json_str, str):
-            try:
-                loaded = json.loads(json_str)
-                if isinstance(loaded, list):
-                    return set(item.lower() for item in loaded if isinstance(item, str) and item.strip())
-                elif isinstance(loaded, str) and loaded.strip(): # Handle if LLM returned a single string instead of list
-                    return {loaded.lower()}
-            except json.JSONDecodeError:
-                return set()
-        return set()
-
-    # Candidate's features (parsed from JSON strings stored in DB)
-    candidate_genres = safe_json_loads_to_lowercase_set(candidate_book_db_row.get('llm_genre'))
-    candidate_tones = safe_json_loads_to_lowercase_set(candidate_book_db_row.get('llm_tone'))
-    candidate_themes = safe_json_loads_to_lowercase_set(candidate_book_db_row.get('llm_themes'))
-    candidate_setting_period = (candidate_book_db_row.get('llm_setting_period') or "").lower()
-    candidate_setting_location = (candidate_book_db_row.get('llm_setting_location') or "").lower()
-    candidate_target_audience = (candidate_book_db_row.get('llm_target_audience') or "").lower()
-    # Authors for the candidate book (already a JSON string list in DB from populate_db.py)
+
+def _score_with_embedding_index(user_profile, top_n):
+    """
+    Nearest books to the embedded profile when RECOMMENDATION_ENGINE=embedding.
+    Returns None (so the exact engines take over) if the index or Ollama isn't available.
+    """
+    if RECOMMENDATION_ENGINE != 'embedding':
+        return None
     try:
-        candidate_authors = set(a.lower() for a in json.loads(candidate_book_db_row.get('authors') or "[]"))
-    except json.JSONDecodeError:
-        candidate_authors = set()
-
-
-    # --- Scoring Logic (Weights can be tuned) ---
-    WEIGHTS = {
-        'genre': 7,
-        'tone': 5,
-        'theme': 2,             # Per shared theme
-        'setting_period': 3,
-        'setting_location': 3,
-        'target_audience': 4,
-        'author_match_boost': 5 # If user likes authors, a small boost if candidate matches
-    }
-
-    # User profile features (already lowercase lists/sets)
-    user_top_genres_set = set(user_profile.get('top_genres', []))
-    user_top_tones_set = set(user_profile.get('top_tones', []))
-    user_top_themes_set = set(user_profile.get('top_themes', []))
-    user_top_setting_periods_set = set(user_profile.get('top_setting_periods', []))
-    user_top_setting_locations_set = set(user_profile.get('top_setting_locations', []))
-    user_top_target_audiences_set = set(user_profile.get('top_target_audiences', []))
-    user_read_authors_set = set(user_profile.get('read_authors', []))
-
-
-    # Genre matching
-    score += len(user_top_genres_set.intersection(candidate_genres)) * WEIGHTS['genre']
-
-    # Tone matching
-    score += len(user_top_tones_set.intersection(candidate_tones)) * WEIGHTS['tone']
-    
-    # Theme matching
-    score += len(user_top_themes_set.intersection(candidate_themes)) * WEIGHTS['theme']
-
-    # Setting Period matching
-    if candidate_setting_period and candidate_setting_period in user_top_setting_periods_set:
-        score += WEIGHTS['setting_period']
-            
-    # Setting Location matching
-    if candidate_setting_location and candidate_setting_location in user_top_setting_locations_set:
-        score += WEIGHTS['setting_location']
-
-    # Target Audience matching
-    if candidate_target_audience and candidate_target_audience in user_top_target_audiences_set:
-        score += WEIGHTS['target_audience']
-    
-    # Author Boost (if candidate author is among user's read authors)
-    if not user_read_authors_set.isdisjoint(candidate_authors):
-        score += WEIGHTS['author_match_boost']
+        import embedding_index
+        return embedding_index.recommend(user_profile, exclude_isbns=user_profile['read_isbns'], top_n=top_n)
+    except (ImportError, FileNotFoundError, ValueError, requests.exceptions.RequestException) as e:
+        print(f"Embedding index unavailable ({e}); falling back to exact scoring.")
+        return None
 
-    return score
+def _score_with_feature_matrix(user_profile, top_n):
+    """
+    Scores the whole catalogue with the sparse matrix engine (see feature_matrix).
+    Returns None when that engine isn't usable here (numpy/scipy missing, matrix not
+    built, or RECOMMENDATION_ENGINE=index), so the caller falls back to the index.
+    """
+    if RECOMMENDATION_ENGINE == 'index':
+        return None
+    try:
+        import feature_matrix
+        engine = feature_matrix.get_engine()
+    except (ImportError, FileNotFoundError) as e:
+        print(f"Feature matrix engine unavailable ({e}); using the feature index.")
+        return None
+    return engine.score(user_profile, exclude_isbns=user_profile['read_isbns'], top_n=top_n)
 
+def _elapsed_ms(start):
+    return round((time.perf_counter() - start) * 1000, 2)
 
-def generate_recommendations(analyzed_user_books, db_path='data/books.db', top_n=10):
+def generate_recommendations(analyzed_user_books, db_path='data/books.db', top_n=10, redis_conn=None, timings=None,
+                             user_profile=None):
     """
     Generates book recommendations based on the user's analyzed books.
+    The whole catalogue is scored with the sparse feature matrix when it has been
+    built; otherwise candidates come from the book_features inverted index.
+    With a redis_conn, results are cached per profile fingerprint and catalogue version.
+    If a `timings` dict is passed, it's filled with per-stage milliseconds. Pass an
+    already-built `user_profile` (e.g. from user_profiles) to skip rebuilding it.
     """
-    user_profile = generate_user_profile(analyzed_user_books) # This is already up-to-date
+    timings = {} if timings is None else timings
+    stage_start = time.perf_counter()
+    if user_profile is None:
+        user_profile = generate_user_profile(analyzed_user_books)
+    timings['profile'] = _elapsed_ms(stage_start)
     if not user_profile or not user_profile.get('read_isbns'):
         print("User profile is empty or invalid, cannot generate recommendations.")
         return []
 
-    # print("User Profile for Recommendations:", json.dumps(user_profile, indent=2)) # Already printed in generate_user_profile
+    rec_cache_key = None
+    if redis_conn:
+        stage_start = time.perf_counter()
+        try:
+            fingerprint = recommendation_cache.profile_fingerprint(user_profile, top_n, RECOMMENDATION_ENGINE)
+            rec_cache_key = recommendation_cache.cache_key(
+                recommendation_cache.get_catalogue_version(redis_conn), fingerprint)
+            cached = recommendation_cache.get_cached_recommendations(redis_conn, rec_cache_key)
+            if cached is not None:
+                timings['cache_lookup'] = _elapsed_ms(stage_start)
+                print(f"Recommendation cache hit ({len(cached)} recommendations).")
+                return cached
+        except RedisError as e:
+            print(f"Warning: Recommendation cache unavailable: {e}")
+            rec_cache_key = None
+        timings['cache_lookup'] = _elapsed_ms(stage_start)
 
-    scored_candidates = []
     conn = None
     try:
         conn = sqlite3.connect(db_path)
-        conn.row_factory = sqlite3.Row # Access columns by name, like a dictionary
-        cursor = conn.cursor()
-
-        # Prepare placeholders for excluding read ISBNs
-        placeholders = ','.join('?' for _ in user_profile['read_isbns'])
-        
-        # Query to fetch candidate books that have been enriched by the LLM
-        sql_query = f"""
-            SELECT isbn13, title, authors, 
-                   llm_genre, llm_themes, llm_tone, 
-                   llm_setting_period, llm_setting_location, llm_target_audience
-                   -- Include average_rating, ratings_count if they exist and are populated in your books.db
-                   -- For now, assuming they are mostly NULL for candidates from the new CSV
-                   --, average_rating, ratings_count 
-            FROM books
-            WHERE (llm_themes IS NOT NULL AND llm_themes != '[]') 
-              AND (llm_genre IS NOT NULL AND llm_genre != '[]')
-              AND isbn13 NOT IN ({placeholders})
-        """
-        
-        query_params = user_profile['read_isbns']
-
-        # OPTIONAL: Pre-filter candidates by user's top genre(s) using SQL for efficiency
-        # eg if user_profile['top_genres'] has ['sci-fi', 'fantasy']
-        if user_profile.get('top_genres'):
-            genre_conditions = []
-            # Create a temporary list for query_params because we might add to it
-            current_query_params = list(query_params) # Start with read_isbns
-            for genre_to_match in user_profile['top_genres']:
-                genre_conditions.append(f"llm_genre LIKE ?")
-                current_query_params.append(f'%"{genre_to_match}"%')
-            
-            if genre_conditions:
-                sql_query += " AND (" + " OR ".join(genre_conditions) + ")"
-                query_params = tuple(current_query_params)
-        
-        # Add a LIMIT to the SQL query
-        sql_query += " LIMIT 1000"
-
-        cursor.execute(sql_query, query_params)
-        candidate_rows = cursor.fetchall()
-
-        print(f"Fetched {len(candidate_rows)} candidate books from DB for scoring after genre filter (if any).")
-
-        for candidate_row in candidate_rows:
-            score = calculate_similarity(user_profile, candidate_row)
-            
-            if score > 0: # Only consider books with some similarity
-                try:
-                    authors_list = json.loads(candidate_row['authors'] or "[]")
-                except json.JSONDecodeError:
-                    authors_list = []
-                
-                recommended_book = {
-                    'isbn': candidate_row['isbn13'],
-                    'title': candidate_row['title'],
-                    'authors': authors_list,
-                    'score': score,
-                }
-                scored_candidates.append(recommended_book)
-        
-        scored_candidates.sort(key=lambda x: x['score'], reverse=True)
-
-        print(f"Returning top {min(top_n, len(scored_candidates))} recommendations out of {len(scored_candidates)} scored candidates.")
-        return scored_candidates[:top_n]
+        # Candidate retrieval, scoring and top-N selection all happen inside the engine
+        stage_start = time.perf_counter()
+        top_candidates = _score_with_embedding_index(user_profile, top_n)
+        if top_candidates is None:
+            top_candidates = _score_with_feature_matrix(user_profile, top_n)
+        if top_candidates is None:
+            top_candidates = feature_index.score_candidates(conn, user_profile,
+                                                            exclude_isbns=user_profile['read_isbns'], top_n=top_n)
+        timings['scoring'] = _elapsed_ms(stage_start)
+
+        stage_start = time.perf_counter()
+        summaries = feature_index.fetch_book_summaries(conn, [isbn for isbn, _ in top_candidates])
+        timings['book_details'] = _elapsed_ms(stage_start)
+
+        recommendations = []
+        for isbn, score in top_candidates:
+            summary = summaries.get(isbn, {})
+            recommendations.append({
+                'isbn': isbn,
+                'title': summary.get('title'),
+                'authors': summary.get('authors', []),
+                'score': score,
+            })
+
+        if rec_cache_key:
+            try:
+                recommendation_cache.store_recommendations(redis_conn, rec_cache_key, recommendations)
+            except RedisError as e:
+                print(f"Warning: Could not cache recommendations: {e}")
+
+        print(f"Returning top {len(recommendations)} recommendations.")
+        return recommendations
 
     except sqlite3.Error as e:
         print(f"Database error during recommendation generation: {e}")
@@ -615,4 +883,43 @@ def generate_recommendations(analyzed_user_books, db_path='data/books.db', top_n
         return []
     finally:
         if conn:
-            conn.close()
\ No newline at end of file
+            conn.close()
+
+
+def recommendation_engine_warm():
+    """
+    True when a recommendation request can be answered inline by the web process:
+    the memory-mapped feature store is built, so scoring is a mat-vec with no model
+    or embedding call. Otherwise the request goes through recommendations_task.
+    """
+    if RECOMMENDATION_ENGINE != 'auto':
+        return False
+    try:
+        import feature_matrix
+        feature_matrix.current_version()
+    except (ImportError, FileNotFoundError):
+        return False
+    return True
+
+
+def compute_recommendation_results(analysed_books, result_id, redis_conn, top_n=RECOMMENDATION_RESULT_SIZE,
+                                   profile_id=None):
+    """
+    Scores once and stores the full ranked list for paging; returns a summary with stage
+    timings. With a profile_id the stored incremental profile is used as-is.
+    """
+    timings = {}
+    start = time.perf_counter()
+    user_profile = user_profiles.get_profile(redis_conn, profile_id) if profile_id else None
+    recommendations = generate_recommendations(analysed_books, top_n=top_n, redis_conn=redis_conn, timings=timings,
+                                               user_profile=user_profile)
+    timings['total'] = _elapsed_ms(start)
+    recommendation_pages.store_results(redis_conn, result_id, recommendations, timings)
+    print(f"Recommendations {result_id}: {len(recommendations)} results, timings (ms): {timings}")
+    return {'result_id': result_id, 'total': len(recommendations), 'timings_ms': timings}
+
+
+def recommendations_task(analysed_books=None, top_n=RECOMMENDATION_RESULT_SIZE, profile_id=None):
+    """RQ job behind POST /recommendations when the engine isn't warm; results are stored under the job id."""
+    job = get_current_job()
+    return compute_recommendation_results(analysed_books, job.id, job.connection, top_n=top_n, profile_id=profile_id)
@@ -0,0 +1,48 @@
+import sqlite3
+
+import pytest
+
+import feature_index
+
+
+def _catalogue_db(books):
+    """In-memory DB with book_features filled from {isbn: (llm_analysis, authors)}."""
+    conn = sqlite3.connect(':memory:')
+    feature_index.ensure_schema(conn)
+    feature_index.replace_book_features(conn, {
+        isbn: feature_index.features_from_analysis(analysis, authors)
+        for isbn, (analysis, authors) in books.items()
+    })
+    conn.commit()
+    return conn
+
+
+@pytest.mark.parametrize('analyse', [False, True])
+def test_candidate_query_never_full_scans(analyse):
+    conn = _catalogue_db({
+        f"97800000{i:05d}": ({'genre': ['fantasy' if i % 2 else 'crime'], 'themes': [f"theme {i % 7}"]},
+                             [f"Author {i % 11}"])
+        for i in range(500)
+    })
+    if analyse:
+        conn.execute("ANALYZE")
+    plan = feature_index.explain_candidate_query(conn)
+    assert plan
+    assert feature_index.full_scans_in_plan(plan) == []
+
+
+def test_score_candidates_counts_author_boost_once_and_drops_excluded():
+    conn = _catalogue_db({
+        '9780000000001': ({'genre': ['fantasy']}, ['Ann Writer', 'Bob Writer']),
+        '9780000000002': ({'genre': ['fantasy']}, ['Ann Writer']),
+        '9780000000003': ({'genre': ['fantasy']}, ['Cat Writer']),
+    })
+    user_profile = {'top_genres': ['Fantasy'], 'read_authors': ['ann writer', 'bob writer']}
+
+    scores = dict(feature_index.score_candidates(conn, user_profile, exclude_isbns=['9780000000002']))
+
+    weights = feature_index.FEATURE_WEIGHTS
+    assert scores == {
+        '9780000000001': weights['genre'] + weights['author'], # two matching authors, one boost
+        '9780000000003': weights['genre'],
+    }
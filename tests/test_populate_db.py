@@ -0,0 +1,27 @@
+import pytest
+
+pd = pytest.importorskip("pandas")
+pytest.importorskip("isbnlib")
+
+import populate_db
+
+
+def _frame(isbns):
+    return pd.DataFrame({
+        'ISBN': isbns,
+        'Book-Title': [f"Title {i}" for i in range(len(isbns))],
+        'Book-Author': [f"Author {i}" for i in range(len(isbns))],
+        'Year-Of-Publication': ['2001'] * len(isbns),
+        'Publisher': ['Publisher'] * len(isbns),
+    })
+
+
+def test_blank_isbn_row_is_dropped_not_fatal():
+    df = populate_db.clean_books_frame(_frame([None, '0195153448']), verbose=False)
+    assert list(df['db_isbn13']) == ['9780195153446']
+
+
+def test_isbns_are_stored_in_canonical_form():
+    df = populate_db.clean_books_frame(_frame(['978-3-8453-1980-3', '0-19-515344-8']), verbose=False)
+    assert list(df['db_isbn13']) == ['9783845319803', '9780195153446']
+    assert df['db_isbn10'].iloc[1] == '0195153448'
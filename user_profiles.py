@@ -0,0 +1,188 @@
+import json
+import math
+import os
+
+# --- Configuration ---
+# A persistent profile lives in Redis as one sorted set of weighted feature counts per
+# kind, a hash of each book's contribution (so it can be subtracted again), a sorted set
+# of author book-counts and a hash of rating totals. Adding or removing a book touches
+# only that book's features; top-k lists are ZREVRANGE reads, never a full re-sort.
+PROFILE_KEY_PREFIX = 'user_profile'
+PROFILE_TTL_SECONDS = int(os.environ.get('USER_PROFILE_TTL', 3600 * 24 * 30))
+ZERO_EPSILON = 1e-9 # float residue left after subtracting a book's weight
+
+# kind -> (book field, top-list key, top-k, weighted-counter key), as generate_user_profile reports them
+PROFILE_FEATURES = {
+    'genre': ('llm_genre', 'top_genres', 3, 'weighted_genres'),
+    'tone': ('llm_tone', 'top_tones', 3, 'weighted_tones'),
+    'theme': ('llm_themes', 'top_themes', 10, 'weighted_themes'),
+    'setting_period': ('llm_setting_period', 'top_periods', 2, 'weighted_setting_periods'),
+    'setting_location': ('llm_setting_location', 'top_locations', 2, 'weighted_setting_locations'),
+    'target_audience': ('llm_target_audience', 'top_audiences', 2, 'weighted_target_audiences'),
+}
+# Kinds whose book field is a list; the others are single strings
+LIST_FEATURES = {'genre', 'tone', 'theme'}
+
+
+def decode(value):
+    """A Redis reply as str, whether or not the connection decodes responses."""
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def book_contribution(book_details):
+    """
+    What one analysed book adds to a profile: its weight, its lower-cased features per
+    kind, its lower-cased authors and its Google Books rating data (or None).
+    """
+    book_weight = 1.0
+    rating = None
+    avg_rating = book_details.get('averageRating')
+    ratings_count = book_details.get('ratingsCount')
+
+    if avg_rating is not None and ratings_count is not None:
+        try:
+            r = float(avg_rating)
+            c = int(ratings_count)
+            if r > 0 and c > 0:
+                # ensure that rating is between 1 and 5
+                clamped_rating = max(1, min(r, 5))
+                # use logarithmic scale to valance ratings counts for books of vastly differing popularity
+                # examples:
+                #   log10(10 + 1) ≈ 1.04
+                #   log10(100 + 1) ≈ 2.00
+                #   log10(1000 + 1) ≈ 3.00
+                #   log10(100000 + 1) ≈ 5.00
+                book_weight = clamped_rating * math.log10(c+1) # +1 for books that might have 0 ratings
+                rating = (r * c, c)
+        except (ValueError, TypeError):
+            book_weight = 1.0
+
+    features = {}
+    for kind, (field, _, _, _) in PROFILE_FEATURES.items():
+        value = book_details.get(field)
+        if kind in LIST_FEATURES:
+            items = [item.lower() for item in value if item and isinstance(item, str)] if isinstance(value, list) else []
+        else:
+            items = [value.lower()] if value and isinstance(value, str) else []
+        features[kind] = items
+
+    authors_list = book_details.get('authors', [])
+    authors = [a.lower() for a in authors_list if a and isinstance(a, str)] if isinstance(authors_list, list) else []
+    return {'weight': book_weight, 'features': features, 'authors': authors, 'rating': rating}
+
+
+def _feature_key(profile_id, kind):
+    return f"{PROFILE_KEY_PREFIX}:{profile_id}:{kind}"
+
+
+def _books_key(profile_id):
+    return f"{PROFILE_KEY_PREFIX}:{profile_id}:books"
+
+
+def _authors_key(profile_id):
+    return f"{PROFILE_KEY_PREFIX}:{profile_id}:authors"
+
+
+def _stats_key(profile_id):
+    return f"{PROFILE_KEY_PREFIX}:{profile_id}:stats"
+
+
+def _all_keys(profile_id):
+    return ([_feature_key(profile_id, kind) for kind in PROFILE_FEATURES]
+            + [_books_key(profile_id), _authors_key(profile_id), _stats_key(profile_id)])
+
+
+def _apply(pipe, profile_id, contribution, sign):
+    """Queues ZINCRBY/HINCRBYFLOAT commands adding (sign=1) or subtracting (sign=-1) a contribution."""
+    weight = contribution['weight'] * sign
+    for kind, items in contribution['features'].items():
+        key = _feature_key(profile_id, kind)
+        for item in items:
+            pipe.zincrby(key, weight, item)
+        if sign < 0 and items:
+            pipe.zremrangebyscore(key, '-inf', ZERO_EPSILON)
+    for author in set(contribution['authors']):
+        pipe.zincrby(_authors_key(profile_id), sign, author)
+    if sign < 0 and contribution['authors']:
+        pipe.zremrangebyscore(_authors_key(profile_id), '-inf', 0)
+    if contribution['rating']:
+        points, count = contribution['rating']
+        pipe.hincrbyfloat(_stats_key(profile_id), 'rating_points', points * sign)
+        pipe.hincrby(_stats_key(profile_id), 'ratings_count', count * sign)
+
+
+def add_books(redis_conn, profile_id, analysed_books):
+    """
+    Adds (or replaces) analysed books, given as {isbn: book_details}. Only the added
+    books' features are touched, whatever the size of the existing history.
+    """
+    books = {isbn: details for isbn, details in analysed_books.items() if details and isinstance(details, dict)}
+    if not books:
+        return 0
+    previous = redis_conn.hmget(_books_key(profile_id), list(books))
+    pipe = redis_conn.pipeline(transaction=True)
+    for (isbn, details), stored in zip(books.items(), previous):
+        if stored:
+            _apply(pipe, profile_id, json.loads(stored), -1)
+        contribution = book_contribution(details)
+        _apply(pipe, profile_id, contribution, 1)
+        pipe.hset(_books_key(profile_id), isbn, json.dumps(contribution))
+    for key in _all_keys(profile_id):
+        pipe.expire(key, PROFILE_TTL_SECONDS)
+    pipe.execute()
+    return len(books)
+
+
+def add_book(redis_conn, profile_id, isbn, book_details):
+    return add_books(redis_conn, profile_id, {isbn: book_details})
+
+
+def remove_book(redis_conn, profile_id, isbn):
+    """Subtracts a book's stored contribution. Returns False if the book wasn't in the profile."""
+    stored = redis_conn.hget(_books_key(profile_id), isbn)
+    if stored is None:
+        return False
+    pipe = redis_conn.pipeline(transaction=True)
+    _apply(pipe, profile_id, json.loads(stored), -1)
+    pipe.hdel(_books_key(profile_id), isbn)
+    pipe.execute()
+    return True
+
+
+def delete_profile(redis_conn, profile_id):
+    redis_conn.delete(*_all_keys(profile_id))
+
+
+def profile_exists(redis_conn, profile_id):
+    return bool(redis_conn.exists(_books_key(profile_id)))
+
+
+def get_profile(redis_conn, profile_id):
+    """
+    The profile in the same shape generate_user_profile returns. Top-k lists are read
+    straight off the sorted sets (ties are broken by member name rather than by the
+    order books were added). Returns {} for an unknown or empty profile.
+    """
+    pipe = redis_conn.pipeline(transaction=False)
+    for kind in PROFILE_FEATURES:
+        pipe.zrevrange(_feature_key(profile_id, kind), 0, -1, withscores=True)
+    pipe.zrange(_authors_key(profile_id), 0, -1)
+    pipe.hkeys(_books_key(profile_id))
+    pipe.hgetall(_stats_key(profile_id))
+    *weighted, authors, isbns, stats = pipe.execute()
+    if not isbns:
+        return {}
+
+    user_profile = {}
+    for (kind, (_, top_key, top_k, weighted_key)), entries in zip(PROFILE_FEATURES.items(), weighted):
+        user_profile[top_key] = [decode(member) for member, _ in entries[:top_k]]
+        user_profile[weighted_key] = {decode(member): score for member, score in entries}
+    stats = {decode(k): float(v) for k, v in stats.items()}
+    ratings_count = int(stats.get('ratings_count', 0))
+    user_profile.update({
+        'read_authors': [decode(author) for author in authors],
+        'read_isbns': [decode(isbn) for isbn in isbns],
+        'avg_input_google_rating': stats.get('rating_points', 0) / ratings_count if ratings_count > 0 else None,
+        'total_input_google_ratings_count': ratings_count,
+    })
+    return user_profile
@@ -0,0 +1,49 @@
+"""
+Starts an RQ worker with the NLP models already loaded.
+
+`rq worker` forks a fresh process per job, so models loaded lazily inside a job are
+thrown away when it finishes. Warming them up here, in the parent, means every
+forked job process inherits them for free.
+
+Workers listen on the priority queues from queues.py (search > interactive > bulk),
+taking a job from a lower queue only when the ones above it are empty. --pool picks
+one of the launch configurations in queues.WORKER_POOLS, so each workload can get its
+own pool of workers, sized from the /stats/queues metrics. Keep warm-up on for any
+pool that includes the search queue: book-details lookups run there and extract
+keywords with spaCy.
+
+Usage:
+    python worker.py                              # all queues, in priority order
+    python worker.py --pool interactive           # search + interactive only, for user-facing capacity
+    python worker.py --pool bulk --no-warm-up     # enrichment shards only; they only call the LLM
+    python worker.py search interactive           # explicit queue names, highest priority first
+"""
+import argparse
+
+from redis import Redis
+
+import queues
+import tasks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('queues', nargs='*', help="Queue names to listen on, highest priority first (overrides --pool)")
+    parser.add_argument('--pool', choices=sorted(queues.WORKER_POOLS), default='all',
+                        help="Predefined set of queues to listen on (default: all, in priority order)")
+    parser.add_argument('--no-warm-up', action='store_true', help="Don't preload spaCy/VADER before taking jobs")
+    args = parser.parse_args()
+
+    if not args.no_warm_up:
+        tasks.warm_up_models()
+
+    queue_names = args.queues or queues.WORKER_POOLS[args.pool]
+    print(f"Listening on queues: {', '.join(queue_names)}")
+    redis_conn = Redis()
+    worker = queues.MetricsWorker([queues.get_queue(name, redis_conn) for name in queue_names], connection=redis_conn)
+    # The scheduler runs delayed jobs such as the debounced catalogue refresh
+    worker.work(with_scheduler=True)
+
+
+if __name__ == "__main__":
+    main()